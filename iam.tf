@@ -121,6 +121,7 @@ data aws_iam_policy_document lambda-summariseVcf {
     ]
     resources = [
       aws_sns_topic.summariseSlice.arn,
+      aws_sns_topic.performQuery.arn,
     ]
   }
 
@@ -306,7 +307,8 @@ data aws_iam_policy_document lambda-getAnalyses {
     ]
     resources = [
       "${aws_dynamodb_table.datasets.arn}/index/*",
-      "${aws_dynamodb_table.variant_query_responses.arn}/index/*"
+      "${aws_dynamodb_table.variant_query_responses.arn}/index/*",
+      aws_dynamodb_table.variant_query_responses.arn,
     ]
   }
 
@@ -314,6 +316,7 @@ data aws_iam_policy_document lambda-getAnalyses {
     actions = [
       "dynamodb:PutItem",
       "dynamodb:UpdateItem",
+      "dynamodb:BatchWriteItem",
     ]
     resources = [
       aws_dynamodb_table.variant_queries.arn,
@@ -356,6 +359,16 @@ data aws_iam_policy_document lambda-getAnalyses {
       aws_sns_topic.splitQuery.arn,
     ]
   }
+
+  statement {
+    actions = [
+      "sqs:CreateQueue",
+      "sqs:ReceiveMessage",
+      "sqs:DeleteMessage",
+      "sqs:DeleteQueue",
+    ]
+    resources = ["arn:aws:sqs:*:*:sbeacon-query-*"]
+  }
 }
 
 #
@@ -368,7 +381,8 @@ data aws_iam_policy_document lambda-getGenomicVariants {
     ]
     resources = [
       "${aws_dynamodb_table.datasets.arn}/index/*",
-      "${aws_dynamodb_table.variant_query_responses.arn}/index/*"
+      "${aws_dynamodb_table.variant_query_responses.arn}/index/*",
+      aws_dynamodb_table.variant_query_responses.arn,
     ]
   }
 
@@ -376,6 +390,7 @@ data aws_iam_policy_document lambda-getGenomicVariants {
     actions = [
       "dynamodb:PutItem",
       "dynamodb:UpdateItem",
+      "dynamodb:BatchWriteItem",
     ]
     resources = [
       aws_dynamodb_table.variant_queries.arn,
@@ -420,6 +435,16 @@ data aws_iam_policy_document lambda-getGenomicVariants {
     ]
     resources = ["*"]
   }
+
+  statement {
+    actions = [
+      "sqs:CreateQueue",
+      "sqs:ReceiveMessage",
+      "sqs:DeleteMessage",
+      "sqs:DeleteQueue",
+    ]
+    resources = ["arn:aws:sqs:*:*:sbeacon-query-*"]
+  }
 }
 
 #
@@ -432,7 +457,8 @@ data aws_iam_policy_document lambda-getIndividuals {
     ]
     resources = [
       "${aws_dynamodb_table.datasets.arn}/index/*",
-      "${aws_dynamodb_table.variant_query_responses.arn}/index/*"
+      "${aws_dynamodb_table.variant_query_responses.arn}/index/*",
+      aws_dynamodb_table.variant_query_responses.arn,
     ]
   }
 
@@ -440,6 +466,7 @@ data aws_iam_policy_document lambda-getIndividuals {
     actions = [
       "dynamodb:PutItem",
       "dynamodb:UpdateItem",
+      "dynamodb:BatchWriteItem",
     ]
     resources = [
       aws_dynamodb_table.variant_queries.arn,
@@ -482,6 +509,16 @@ data aws_iam_policy_document lambda-getIndividuals {
       aws_sns_topic.splitQuery.arn,
     ]
   }
+
+  statement {
+    actions = [
+      "sqs:CreateQueue",
+      "sqs:ReceiveMessage",
+      "sqs:DeleteMessage",
+      "sqs:DeleteQueue",
+    ]
+    resources = ["arn:aws:sqs:*:*:sbeacon-query-*"]
+  }
 }
 
 #
@@ -494,7 +531,8 @@ data aws_iam_policy_document lambda-getBiosamples {
     ]
     resources = [
       "${aws_dynamodb_table.datasets.arn}/index/*",
-      "${aws_dynamodb_table.variant_query_responses.arn}/index/*"
+      "${aws_dynamodb_table.variant_query_responses.arn}/index/*",
+      aws_dynamodb_table.variant_query_responses.arn,
     ]
   }
 
@@ -502,6 +540,7 @@ data aws_iam_policy_document lambda-getBiosamples {
     actions = [
       "dynamodb:PutItem",
       "dynamodb:UpdateItem",
+      "dynamodb:BatchWriteItem",
     ]
     resources = [
       aws_dynamodb_table.variant_queries.arn,
@@ -544,6 +583,16 @@ data aws_iam_policy_document lambda-getBiosamples {
       aws_sns_topic.splitQuery.arn,
     ]
   }
+
+  statement {
+    actions = [
+      "sqs:CreateQueue",
+      "sqs:ReceiveMessage",
+      "sqs:DeleteMessage",
+      "sqs:DeleteQueue",
+    ]
+    resources = ["arn:aws:sqs:*:*:sbeacon-query-*"]
+  }
 }
 
 #
@@ -556,7 +605,8 @@ data aws_iam_policy_document lambda-getDatasets {
     ]
     resources = [
       "${aws_dynamodb_table.datasets.arn}/index/*",
-      "${aws_dynamodb_table.variant_query_responses.arn}/index/*"
+      "${aws_dynamodb_table.variant_query_responses.arn}/index/*",
+      aws_dynamodb_table.variant_query_responses.arn,
     ]
   }
 
@@ -564,6 +614,7 @@ data aws_iam_policy_document lambda-getDatasets {
     actions = [
       "dynamodb:PutItem",
       "dynamodb:UpdateItem",
+      "dynamodb:BatchWriteItem",
     ]
     resources = [
       aws_dynamodb_table.variant_queries.arn,
@@ -606,6 +657,16 @@ data aws_iam_policy_document lambda-getDatasets {
       aws_sns_topic.splitQuery.arn,
     ]
   }
+
+  statement {
+    actions = [
+      "sqs:CreateQueue",
+      "sqs:ReceiveMessage",
+      "sqs:DeleteMessage",
+      "sqs:DeleteQueue",
+    ]
+    resources = ["arn:aws:sqs:*:*:sbeacon-query-*"]
+  }
 }
 
 #
@@ -664,7 +725,8 @@ data aws_iam_policy_document lambda-getRuns {
     ]
     resources = [
       "${aws_dynamodb_table.datasets.arn}/index/*",
-      "${aws_dynamodb_table.variant_query_responses.arn}/index/*"
+      "${aws_dynamodb_table.variant_query_responses.arn}/index/*",
+      aws_dynamodb_table.variant_query_responses.arn,
     ]
   }
 
@@ -672,6 +734,7 @@ data aws_iam_policy_document lambda-getRuns {
     actions = [
       "dynamodb:PutItem",
       "dynamodb:UpdateItem",
+      "dynamodb:BatchWriteItem",
     ]
     resources = [
       aws_dynamodb_table.variant_queries.arn,
@@ -714,6 +777,16 @@ data aws_iam_policy_document lambda-getRuns {
       aws_sns_topic.splitQuery.arn,
     ]
   }
+
+  statement {
+    actions = [
+      "sqs:CreateQueue",
+      "sqs:ReceiveMessage",
+      "sqs:DeleteMessage",
+      "sqs:DeleteQueue",
+    ]
+    resources = ["arn:aws:sqs:*:*:sbeacon-query-*"]
+  }
 }
 
 #
@@ -745,6 +818,42 @@ data aws_iam_policy_document lambda-splitQuery {
       aws_sns_topic.performQuery.arn,
     ]
   }
+
+  statement {
+    actions = [
+      "dynamodb:DescribeTable",
+      "dynamodb:UpdateItem",
+      "dynamodb:GetItem",
+    ]
+    resources = [
+      aws_dynamodb_table.variant_queries.arn,
+    ]
+  }
+
+  statement {
+    actions = [
+      "dynamodb:DescribeTable",
+      "dynamodb:PutItem",
+    ]
+    resources = [
+      aws_dynamodb_table.variant_query_responses.arn,
+    ]
+  }
+
+  statement {
+    actions = [
+      "s3:GetObject",
+      "s3:ListBucket",
+    ]
+    resources = ["*"]
+  }
+
+  statement {
+    actions = [
+      "sqs:SendMessage",
+    ]
+    resources = ["arn:aws:sqs:*:*:sbeacon-query-*"]
+  }
 }
 
 #
@@ -770,9 +879,17 @@ data aws_iam_policy_document lambda-performQuery {
       "s3:GetObject",
       "s3:PutObject",
       "s3:ListBucket",
+      "s3:AbortMultipartUpload",
     ]
     resources = ["*"]
   }
+
+  statement {
+    actions = [
+      "sqs:SendMessage",
+    ]
+    resources = ["arn:aws:sqs:*:*:sbeacon-query-*"]
+  }
 }
 
 # 
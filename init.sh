@@ -98,3 +98,5 @@ pip install jsonschema --target layers/python_libraries/python --upgrade
 pip install pynamodb --target layers/python_libraries/python --upgrade
 pip install pyorc --target layers/python_libraries/python --upgrade
 pip install requests --target layers/python_libraries/python --upgrade
+pip install numpy --target layers/python_libraries/python --upgrade
+pip install 'aiobotocore[boto3]' --target layers/python_libraries/python --upgrade
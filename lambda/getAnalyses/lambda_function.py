@@ -2,8 +2,9 @@ import json
 
 from jsonschema import Draft202012Validator
 
-from apiutils.api_response import bad_request
+from apiutils.api_response import bad_request, server_error
 from apiutils.request_hash import hash_query
+from utils.async_invoke import InvocationError
 from route_analyses import route as route_analyses
 from route_analyses_filtering_terms import route as route_analyses_filtering_terms
 from route_analyses_id import route as route_analyses_id
@@ -50,7 +51,10 @@ def lambda_handler(event, context):
         return route_analyses_id(event)
 
     elif event['resource'] == '/analyses/{id}/g_variants':
-        return route_analyses_id_g_variants(event, event_hash)
+        try:
+            return route_analyses_id_g_variants(event, event_hash)
+        except InvocationError as e:
+            return server_error(errorMessage=str(e))
 
 
 if __name__ == '__main__':
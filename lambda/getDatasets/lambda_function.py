@@ -2,8 +2,9 @@ import json
 
 from jsonschema import Draft202012Validator
 
-from apiutils.api_response import bad_request
+from apiutils.api_response import bad_request, server_error
 from apiutils.request_hash import hash_query
+from utils.async_invoke import InvocationError
 from route_datasets import route as route_datasets
 from route_datasets_id import route as route_datasets_id
 from route_datasets_id_g_variants import route as route_datasets_id_g_variants
@@ -49,7 +50,10 @@ def lambda_handler(event, context):
         return route_datasets_id(event)
 
     elif event['resource'] == '/datasets/{id}/g_variants':
-        return route_datasets_id_g_variants(event, event_hash)
+        try:
+            return route_datasets_id_g_variants(event, event_hash)
+        except InvocationError as e:
+            return server_error(errorMessage=str(e))
 
     elif event['resource'] == '/datasets/{id}/biosamples':
         return route_datasets_id_biosamples(event)
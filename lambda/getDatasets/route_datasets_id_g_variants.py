@@ -8,6 +8,7 @@ from smart_open import open as sopen
 
 from apiutils.api_response import bundle_response, fetch_from_cache
 from variantutils.search_variants import perform_variant_search, perform_variant_search_sync
+from variantutils.aggregation import VariantAggregator
 import apiutils.responses as responses
 import apiutils.entries as entries
 from athena.dataset import Dataset, parse_datasets_with_samples
@@ -53,8 +54,8 @@ def route(event, query_id):
         print(f"Query params {params}")
         apiVersion = params.get("apiVersion", BEACON_API_VERSION)
         requestedSchemas = params.get("requestedSchemas", [])
-        skip = params.get("skip", None)
-        limit = params.get("limit", None)
+        skip = int(params.get("skip", 0))
+        limit = int(params.get("limit", 100))
         includeResultsetResponses = params.get("includeResultsetResponses", 'NONE')
         start = params.get("start", None)
         end = params.get("end", None)
@@ -73,6 +74,7 @@ def route(event, query_id):
             filters_list = filters_str.split(',')
         filters = [{'id': fil_id} for fil_id in filters_list]
         requestedGranularity = params.get("requestedGranularity", "boolean")
+        queryTimeout = params.get("queryTimeout", None)
 
     if event['httpMethod'] == 'POST':
         params = json.loads(event.get('body', "{}")) or dict()
@@ -84,6 +86,11 @@ def route(event, query_id):
         requestedSchemas = meta.get("requestedSchemas", [])
         # query data
         requestedGranularity = query.get("requestedGranularity", "boolean")
+        queryTimeout = query.get("queryTimeout", None)
+        # pagination
+        pagination = query.get("pagination", dict())
+        skip = pagination.get("skip", 0)
+        limit = pagination.get("limit", 100)
         requestParameters = query.get("requestParameters", dict())
         start = requestParameters.get("start", None)
         end = requestParameters.get("end", None)
@@ -116,6 +123,8 @@ def route(event, query_id):
             datasets = Dataset.get_by_query(query, execution_parameters=execution_parameters)
             samples = []
 
+        coverage = dict()
+
         query_responses = perform_variant_search_sync(
             datasets=datasets,
             referenceName=referenceName,
@@ -129,50 +138,38 @@ def route(event, query_id):
             requestedGranularity=requestedGranularity,
             includeResultsetResponses=includeResultsetResponses,
             query_id=query_id,
-            dataset_samples=samples
+            dataset_samples=samples,
+            timeout=queryTimeout,
+            coverage=coverage
         )
 
-        variants = set()
-        results = list()
-        # key=pos-ref-alt
-        # val=counts
-        variant_call_counts = defaultdict(int)
-        variant_allele_counts = defaultdict(int)
-        exists = False
-
-        for query_response in query_responses:
-            exists = exists or query_response.exists
-
-            if exists:
-                if requestedGranularity == 'boolean':
-                    break
-                if check_all:
-                    variants.update(query_response.variants)
-
-                    for variant in query_response.variants:
-                        chrom, pos, ref, alt, typ = variant.split('\t')
-                        idx = f'{pos}_{ref}_{alt}'
-                        variant_call_counts[idx] += query_response.call_count
-                        variant_allele_counts[idx] += query_response.all_alleles_count
-                        internal_id = f'{assemblyId}\t{chrom}\t{pos}\t{ref}\t{alt}'
-                        results.append(entries.get_variant_entry(base64.b64encode(f'{internal_id}'.encode()).decode(), assemblyId, ref, alt, int(pos), int(pos) + len(alt), typ))
+        aggregator = VariantAggregator(
+            assemblyId,
+            skip=skip,
+            limit=limit,
+            with_variants=check_all and requestedGranularity != 'boolean',
+            boolean=requestedGranularity == 'boolean'
+        ).consume(query_responses)
+        exists = aggregator.exists
 
         if requestedGranularity == 'boolean':
-            response = responses.get_boolean_response(exists=exists)
+            response = responses.get_boolean_response(exists=exists, info=aggregator.get_info(coverage))
             print('Returning Response: {}'.format(json.dumps(response)))
             return bundle_response(200, response, query_id)
 
         if requestedGranularity == 'count':
-            response = responses.get_counts_response(exists=exists, count=len(variants))
+            response = responses.get_counts_response(exists=exists, count=aggregator.count, info=aggregator.get_info(coverage))
             print('Returning Response: {}'.format(json.dumps(response)))
             return bundle_response(200, response, query_id)
 
         if requestedGranularity in ('record', 'aggregated'):
             response = responses.get_result_sets_response(
                 setType='genomicVariant', 
+                reqPagination=responses.get_pagination_object(skip, limit),
                 exists=exists,
-                total=len(variants),
-                results=results
+                total=aggregator.count,
+                results=aggregator.results,
+                info=aggregator.get_info(coverage)
             )
             print('Returning Response: {}'.format(json.dumps(response)))
             return bundle_response(200, response, query_id)
@@ -2,8 +2,9 @@ import json
 
 from jsonschema import Draft202012Validator
 
-from apiutils.api_response import bad_request
+from apiutils.api_response import bad_request, server_error
 from apiutils.request_hash import hash_query
+from utils.async_invoke import InvocationError
 from route_g_variants import route as route_g_variants
 from route_g_variants_id import route as route_g_variants_id
 from route_g_variants_id_individuals import route as route_g_variants_id_individuals
@@ -38,17 +39,21 @@ def lambda_handler(event, context):
 
     event_hash = hash_query(event)
 
-    if event["resource"] == "/g_variants":
-        return route_g_variants(event, event_hash)
+    try:
+        if event["resource"] == "/g_variants":
+            return route_g_variants(event, event_hash)
 
-    elif event['resource'] == '/g_variants/{id}':
-        return route_g_variants_id(event, event_hash)
+        elif event['resource'] == '/g_variants/{id}':
+            return route_g_variants_id(event, event_hash)
 
-    elif event['resource'] == '/g_variants/{id}/individuals':
-        return route_g_variants_id_individuals(event, event_hash)
+        elif event['resource'] == '/g_variants/{id}/individuals':
+            return route_g_variants_id_individuals(event, event_hash)
 
-    elif event['resource'] == '/g_variants/{id}/biosamples':
-        return route_g_variants_id_biosamples(event, event_hash)
+        elif event['resource'] == '/g_variants/{id}/biosamples':
+            return route_g_variants_id_biosamples(event, event_hash)
+    except InvocationError as e:
+        # a split of the query failed, rather than answer from the rest
+        return server_error(errorMessage=str(e))
 
 
 if __name__ == '__main__':
@@ -8,6 +8,7 @@ import sys
 from smart_open import open as sopen
 
 from variantutils.search_variants import perform_variant_search_sync
+from variantutils.aggregation import VariantAggregator
 from apiutils.api_response import bundle_response, fetch_from_cache
 import apiutils.responses as responses
 import apiutils.entries as entries
@@ -52,8 +53,8 @@ def route(event, query_id):
         print(f"Query params {params}")
         apiVersion = params.get("apiVersion", BEACON_API_VERSION)
         requestedSchemas = params.get("requestedSchemas", [])
-        skip = params.get("skip", 0)
-        limit = params.get("limit", 100)
+        skip = int(params.get("skip", 0))
+        limit = int(params.get("limit", 100))
         includeResultsetResponses = params.get("includeResultsetResponses", 'NONE')
         start = [int(a) for a in params["start"].split(",")]
         end = [int(a) for a in params["end"].split(",")]
@@ -73,6 +74,7 @@ def route(event, query_id):
             filters_list = filters_str.split(',')
         filters = [{'id': fil_id} for fil_id in filters_list]
         requestedGranularity = params.get("requestedGranularity", "boolean")
+        queryTimeout = params.get("queryTimeout", None)
 
     if event['httpMethod'] == 'POST':
         params = json.loads(event['body']) or dict()
@@ -85,6 +87,7 @@ def route(event, query_id):
         # query data
         requestParameters = query.get("requestParameters", None)
         requestedGranularity = query.get("requestedGranularity", "boolean")
+        queryTimeout = query.get("queryTimeout", None)
         # pagination
         pagination = query.get("pagination", dict())
         skip = pagination.get("skip", 0)
@@ -125,6 +128,8 @@ def route(event, query_id):
             datasets = Dataset.get_by_query(query, execution_parameters=execution_parameters)
             samples = []
 
+        coverage = dict()
+
         query_responses = perform_variant_search_sync(
             datasets=datasets,
             referenceName=referenceName,
@@ -138,37 +143,19 @@ def route(event, query_id):
             requestedGranularity=requestedGranularity,
             includeResultsetResponses=includeResultsetResponses,
             query_id=query_id,
-            dataset_samples=samples
+            dataset_samples=samples,
+            timeout=queryTimeout,
+            coverage=coverage
         )
     
-        variants = set()
-        results = list()
-        found = set()
-        # key=pos-ref-alt
-        # val=counts
-        variant_call_counts = defaultdict(int)
-        variant_allele_counts = defaultdict(int)
-        exists = False
-
-        for query_response in query_responses:
-            exists = exists or query_response.exists
-
-            if exists:
-                if requestedGranularity == 'boolean':
-                    break
-                if check_all:
-                    variants.update(query_response.variants)
-
-                    for variant in query_response.variants:
-                        chrom, pos, ref, alt, typ = variant.split('\t')
-                        idx = f'{pos}_{ref}_{alt}'
-                        variant_call_counts[idx] += query_response.call_count
-                        variant_allele_counts[idx] += query_response.all_alleles_count
-                        internal_id = f'{assemblyId}\t{chrom}\t{pos}\t{ref}\t{alt}'
-
-                        if internal_id not in found:
-                            results.append(entries.get_variant_entry(base64.b64encode(f'{internal_id}'.encode()).decode(), assemblyId, ref, alt, int(pos), int(pos) + len(alt), typ))
-                            found.add(internal_id)
+        aggregator = VariantAggregator(
+            assemblyId,
+            skip=skip,
+            limit=limit,
+            with_variants=check_all and requestedGranularity != 'boolean',
+            boolean=requestedGranularity == 'boolean'
+        ).consume(query_responses)
+        exists = aggregator.exists
 
         # query = VariantQuery.get(query_id)
         # query.update(actions=[
@@ -177,12 +164,12 @@ def route(event, query_id):
         # ])
 
         if requestedGranularity == 'boolean':
-            response = responses.get_boolean_response(exists=exists)
+            response = responses.get_boolean_response(exists=exists, info=aggregator.get_info(coverage))
             print('Returning Response: {}'.format(json.dumps(response)))
             return bundle_response(200, response, query_id)
 
         if requestedGranularity == 'count':
-            response = responses.get_counts_response(exists=exists, count=len(variants))
+            response = responses.get_counts_response(exists=exists, count=aggregator.count, info=aggregator.get_info(coverage))
             print('Returning Response: {}'.format(json.dumps(response)))
             return bundle_response(200, response, query_id)
 
@@ -191,8 +178,9 @@ def route(event, query_id):
                 setType='genomicVariant', 
                 reqPagination=responses.get_pagination_object(skip, limit),
                 exists=exists,
-                total=len(variants),
-                results=results
+                total=aggregator.count,
+                results=aggregator.results,
+                info=aggregator.get_info(coverage)
             )
             print('Returning Response: {}'.format(json.dumps(response)))
             return bundle_response(200, response, query_id)
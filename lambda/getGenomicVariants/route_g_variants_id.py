@@ -5,6 +5,8 @@ import base64
 
 from apiutils.api_response import bundle_response, fetch_from_cache
 from variantutils.search_variants import perform_variant_search_sync
+from variantutils.aggregation import VariantAggregator
+from variantutils.point_query import perform_point_query
 import apiutils.responses as responses
 import apiutils.entries as entries
 from dynamodb.variant_queries import get_job_status, JobStatus, VariantQuery, get_current_time_utc
@@ -48,7 +50,10 @@ def route(event, query_id):
         print(f"Query params {params}")
         apiVersion = params.get("apiVersion", BEACON_API_VERSION)
         requestedSchemas = params.get("requestedSchemas", [])
+        skip = int(params.get("skip", 0))
+        limit = int(params.get("limit", 100))
         requestedGranularity = params.get("requestedGranularity", "boolean")
+        queryTimeout = params.get("queryTimeout", None)
         filters_list = []
         filters_str = params.get("filters", filters_list)
         if isinstance(filters_str, str):
@@ -65,6 +70,11 @@ def route(event, query_id):
         requestedSchemas = meta.get("requestedSchemas", [])
         # query data
         requestedGranularity = query.get("requestedGranularity", "boolean")
+        queryTimeout = query.get("queryTimeout", None)
+        # pagination
+        pagination = query.get("pagination", dict())
+        skip = pagination.get("skip", 0)
+        limit = pagination.get("limit", 100)
         filters = query.get("filters", [])
         requestParameters = query.get("requestParameters", dict())
 
@@ -89,50 +99,45 @@ def route(event, query_id):
             datasets = Dataset.get_by_query(query, execution_parameters=execution_parameters)
             samples = []
 
-        variants = set()
-        results = list()
-        found = set()
-        # key=pos-ref-alt
-        # val=counts
-        variant_call_counts = defaultdict(int)
-        variant_allele_counts = defaultdict(int)
-
-        query_responses = perform_variant_search_sync(
+        coverage = dict()
+        # exact lookups are answered in process from the vcf index
+        query_responses = perform_point_query(
             datasets=datasets,
             referenceName=referenceName,
             referenceBases=referenceBases,
             alternateBases=alternateBases,
-            start=start,
-            end=end,
-            variantType=None,
-            variantMinLength=0,
-            variantMaxLength=-1,
-            requestedGranularity=requestedGranularity,
-            includeResultsetResponses='ALL',
-            query_id=query_id,
+            pos=pos + 1,
+            includeSamples=False,
             dataset_samples=samples
         )
 
-        exists = False
-
-        for query_response in query_responses:
-            exists = exists or query_response.exists
-
-            if exists:
-                if requestedGranularity == 'boolean':
-                    break
-                variants.update(query_response.variants)
-
-                for variant in query_response.variants:
-                    chrom, pos, ref, alt, typ = variant.split('\t')
-                    idx = f'{pos}_{ref}_{alt}'
-                    variant_call_counts[idx] += query_response.call_count
-                    variant_allele_counts[idx] += query_response.all_alleles_count
-                    internal_id = f'{assemblyId}\t{chrom}\t{pos}\t{ref}\t{alt}'
+        if query_responses is None:
+            query_responses = perform_variant_search_sync(
+                datasets=datasets,
+                referenceName=referenceName,
+                referenceBases=referenceBases,
+                alternateBases=alternateBases,
+                start=start,
+                end=end,
+                variantType=None,
+                variantMinLength=0,
+                variantMaxLength=-1,
+                requestedGranularity=requestedGranularity,
+                includeResultsetResponses='ALL',
+                query_id=query_id,
+                dataset_samples=samples,
+                timeout=queryTimeout,
+                coverage=coverage
+            )
 
-                    if internal_id not in found:
-                        results.append(entries.get_variant_entry(base64.b64encode(f'{internal_id}'.encode()).decode(), assemblyId, ref, alt, int(pos), int(pos) + len(alt), typ))
-                        found.add(internal_id)
+        aggregator = VariantAggregator(
+            assemblyId,
+            skip=skip,
+            limit=limit,
+            with_variants=requestedGranularity != 'boolean',
+            boolean=requestedGranularity == 'boolean'
+        ).consume(query_responses)
+        exists = aggregator.exists
 
         # query = VariantQuery.get(query_id)
         # query.update(actions=[
@@ -141,21 +146,23 @@ def route(event, query_id):
         # ])
 
         if requestedGranularity == 'boolean':
-            response = responses.get_boolean_response(exists=exists)
+            response = responses.get_boolean_response(exists=exists, info=aggregator.get_info(coverage))
             print('Returning Response: {}'.format(json.dumps(response)))
             return bundle_response(200, response, query_id)
 
         if requestedGranularity == 'count':
-            response = responses.get_counts_response(exists=exists, count=len(variants))
+            response = responses.get_counts_response(exists=exists, count=aggregator.count, info=aggregator.get_info(coverage))
             print('Returning Response: {}'.format(json.dumps(response)))
             return bundle_response(200, response, query_id)
 
         if requestedGranularity in ('record', 'aggregated'):
             response = responses.get_result_sets_response(
                 setType='genomicVariant', 
+                reqPagination=responses.get_pagination_object(skip, limit),
                 exists=exists,
-                total=len(variants),
-                results=results
+                total=aggregator.count,
+                results=aggregator.results,
+                info=aggregator.get_info(coverage)
             )
             print('Returning Response: {}'.format(json.dumps(response)))
             return bundle_response(200, response, query_id)
@@ -9,6 +9,7 @@ import jsons
 
 from apiutils.api_response import bundle_response, fetch_from_cache
 from variantutils.search_variants import perform_variant_search_sync
+from variantutils.point_query import perform_point_query
 import apiutils.responses as responses
 from athena.biosample import Biosample
 from dynamodb.variant_queries import get_job_status, JobStatus, VariantQuery, get_current_time_utc
@@ -120,6 +121,7 @@ def route(event, query_id):
         apiVersion = params.get("apiVersion", BEACON_API_VERSION)
         requestedSchemas = params.get("requestedSchemas", [])
         requestedGranularity = params.get("requestedGranularity", "boolean")
+        queryTimeout = params.get("queryTimeout", None)
         skip = params.get("skip", 0)
         limit = params.get("limit", 100)
         # currentPage = params.get("currentPage", None)
@@ -139,6 +141,7 @@ def route(event, query_id):
         requestedSchemas = meta.get("requestedSchemas", [])
         # query data
         requestedGranularity = query.get("requestedGranularity", "boolean")
+        queryTimeout = query.get("queryTimeout", None)
         # pagination
         pagination = query.get("pagination", dict())
         skip = pagination.get("skip", 0)
@@ -171,23 +174,38 @@ def route(event, query_id):
             datasets = Dataset.get_by_query(query, execution_parameters=execution_parameters)
             samples = []
 
-        query_responses = perform_variant_search_sync(
+        coverage = dict()
+        # exact lookups are answered in process from the vcf index
+        query_responses = perform_point_query(
             datasets=datasets,
             referenceName=referenceName,
             referenceBases=referenceBases,
             alternateBases=alternateBases,
-            start=start,
-            end=end,
-            variantType=None,
-            variantMinLength=0,
-            variantMaxLength=-1,
-            requestedGranularity='record', # we need the records for this task
-            includeResultsetResponses='ALL',
-            query_id=query_id,
-            dataset_samples=samples,
-            passthrough={ 'includeSamples': True }
+            pos=pos + 1,
+            includeSamples=True,
+            dataset_samples=samples
         )
 
+        if query_responses is None:
+            query_responses = perform_variant_search_sync(
+                datasets=datasets,
+                referenceName=referenceName,
+                referenceBases=referenceBases,
+                alternateBases=alternateBases,
+                start=start,
+                end=end,
+                variantType=None,
+                variantMinLength=0,
+                variantMaxLength=-1,
+                requestedGranularity='record', # we need the records for this task
+                includeResultsetResponses='ALL',
+                query_id=query_id,
+                dataset_samples=samples,
+                passthrough={ 'includeSamples': True },
+                timeout=queryTimeout,
+                coverage=coverage
+            )
+
         exists = False
 
         for query_response in query_responses:
@@ -232,13 +250,13 @@ def route(event, query_id):
         # ])
 
         if requestedGranularity == 'boolean':
-            response = responses.get_boolean_response(exists=exists)
+            response = responses.get_boolean_response(exists=exists, info=responses.get_coverage_info(coverage))
             print('Returning Response: {}'.format(json.dumps(response)))
             return bundle_response(200, response, query_id)
 
         if requestedGranularity == 'count':
             count = iterated_biosamples
-            response = responses.get_counts_response(exists=count > 0, count=count)
+            response = responses.get_counts_response(exists=count > 0, count=count, info=responses.get_coverage_info(coverage))
             print('Returning Response: {}'.format(json.dumps(response)))
             return bundle_response(200, response, query_id)
 
@@ -250,7 +268,8 @@ def route(event, query_id):
                 reqPagination=responses.get_pagination_object(skip=skip, limit=limit),
                 exists=len(biosamples) > 0,
                 total=len(biosamples),
-                results=jsons.dump(biosamples, strip_privates=True)
+                results=jsons.dump(biosamples, strip_privates=True),
+                info=responses.get_coverage_info(coverage)
             )
             print('Returning Response: {}'.format(json.dumps(response)))
             return bundle_response(200, response, query_id)
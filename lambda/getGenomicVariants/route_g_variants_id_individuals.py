@@ -8,6 +8,7 @@ import jsons
 
 from apiutils.api_response import bundle_response, fetch_from_cache
 from variantutils.search_variants import perform_variant_search_sync
+from variantutils.point_query import perform_point_query
 import apiutils.responses as responses
 from athena.individual import Individual
 from dynamodb.variant_queries import get_job_status, JobStatus, VariantQuery, get_current_time_utc
@@ -98,6 +99,7 @@ def route(event, query_id):
             filters_list = filters_str.split(',')
         filters = [{'id': fil_id} for fil_id in filters_list]
         requestedGranularity = params.get("requestedGranularity", "boolean")
+        queryTimeout = params.get("queryTimeout", None)
 
     if event['httpMethod'] == 'POST':
         params = json.loads(event.get('body', "{}")) or dict()
@@ -109,6 +111,7 @@ def route(event, query_id):
         requestedSchemas = meta.get("requestedSchemas", [])
         # query data
         requestedGranularity = query.get("requestedGranularity", "boolean")
+        queryTimeout = query.get("queryTimeout", None)
         requestParameters = query.get("requestParameters", dict())
         # pagination
         pagination = query.get("pagination", dict())
@@ -141,23 +144,38 @@ def route(event, query_id):
             datasets = Dataset.get_by_query(query, execution_parameters=execution_parameters)
             samples = []
 
-        query_responses = perform_variant_search_sync(
+        coverage = dict()
+        # exact lookups are answered in process from the vcf index
+        query_responses = perform_point_query(
             datasets=datasets,
             referenceName=referenceName,
             referenceBases=referenceBases,
             alternateBases=alternateBases,
-            start=start,
-            end=end,
-            variantType=None,
-            variantMinLength=0,
-            variantMaxLength=-1,
-            requestedGranularity='record', # we need the records for this task
-            includeResultsetResponses='ALL',
-            query_id=query_id,
-            dataset_samples=samples,
-            passthrough={ 'includeSamples': True }
+            pos=pos + 1,
+            includeSamples=True,
+            dataset_samples=samples
         )
 
+        if query_responses is None:
+            query_responses = perform_variant_search_sync(
+                datasets=datasets,
+                referenceName=referenceName,
+                referenceBases=referenceBases,
+                alternateBases=alternateBases,
+                start=start,
+                end=end,
+                variantType=None,
+                variantMinLength=0,
+                variantMaxLength=-1,
+                requestedGranularity='record', # we need the records for this task
+                includeResultsetResponses='ALL',
+                query_id=query_id,
+                dataset_samples=samples,
+                passthrough={ 'includeSamples': True },
+                timeout=queryTimeout,
+                coverage=coverage
+            )
+
         exists = False
 
         for query_response in query_responses:
@@ -204,13 +222,13 @@ def route(event, query_id):
         # ])
 
         if requestedGranularity == 'boolean':
-            response = responses.get_boolean_response(exists=exists)
+            response = responses.get_boolean_response(exists=exists, info=responses.get_coverage_info(coverage))
             print('Returning Response: {}'.format(json.dumps(response)))
             return bundle_response(200, response, query_id)
 
         if requestedGranularity == 'count':
             count = iterated_individuals
-            response = responses.get_counts_response(exists=count > 0, count=count)
+            response = responses.get_counts_response(exists=count > 0, count=count, info=responses.get_coverage_info(coverage))
             print('Returning Response: {}'.format(json.dumps(response)))
             return bundle_response(200, response, query_id)
         
@@ -222,7 +240,8 @@ def route(event, query_id):
                 reqPagination=responses.get_pagination_object(skip=skip, limit=limit),
                 exists=len(individuals) > 0,
                 total=len(individuals),
-                results=jsons.dump(individuals, strip_privates=True)
+                results=jsons.dump(individuals, strip_privates=True),
+                info=responses.get_coverage_info(coverage)
             )
             print('Returning Response: {}'.format(json.dumps(response)))
             return bundle_response(200, response, query_id)
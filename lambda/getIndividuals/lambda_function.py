@@ -2,8 +2,9 @@ import json
 
 from jsonschema import Draft202012Validator
 
-from apiutils.api_response import bad_request
+from apiutils.api_response import bad_request, server_error
 from apiutils.request_hash import hash_query
+from utils.async_invoke import InvocationError
 from route_individuals import route as route_individuals
 from route_individuals_filtering_terms import route as route_individuals_filtering_terms
 from route_individuals_id import route as route_individuals_id
@@ -51,7 +52,10 @@ def lambda_handler(event, context):
         return route_individuals_id(event)
 
     elif event['resource'] == '/individuals/{id}/g_variants':
-        return route_individuals_id_g_variants(event, event_hash)
+        try:
+            return route_individuals_id_g_variants(event, event_hash)
+        except InvocationError as e:
+            return server_error(errorMessage=str(e))
 
     elif event['resource'] == '/individuals/{id}/biosamples':
         return route_individuals_id_biosamples(event)
@@ -2,8 +2,9 @@ import json
 
 from jsonschema import Draft202012Validator
 
-from apiutils.api_response import bad_request
+from apiutils.api_response import bad_request, server_error
 from apiutils.request_hash import hash_query
+from utils.async_invoke import InvocationError
 from route_runs import route as route_runs
 from route_runs_id import route as route_runs_id
 from route_runs_id_g_variants import route as route_runs_id_g_variants
@@ -48,7 +49,10 @@ def lambda_handler(event, context):
         return route_runs_id(event)
 
     elif event['resource'] == '/runs/{id}/g_variants':
-        return route_runs_id_g_variants(event, event_hash)
+        try:
+            return route_runs_id_g_variants(event, event_hash)
+        except InvocationError as e:
+            return server_error(errorMessage=str(e))
 
     elif event['resource'] == '/runs/{id}/analyses':
         return route_runs_id_analyses(event)
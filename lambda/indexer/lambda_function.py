@@ -17,6 +17,7 @@ from generate_query_terms import QUERY as TERMS_QUERY
 from generate_query_relations import QUERY as RELATIONS_QUERY
 from dynamodb.ontologies import Ontology, Descendants, Anscestors
 from dynamodb.onto_index import OntoData
+from apiutils.request_hash import update_catalogue_version
 
 
 athena = boto3.client('athena')
@@ -378,6 +379,8 @@ def lambda_handler(event, context):
     # join last running threads
     index_thread.join()
     relations_thread.join()
+    # new terms change the answers to filters
+    update_catalogue_version()
     print('Success')
 
 
@@ -0,0 +1,114 @@
+import re
+
+
+BASES = {
+    'A',
+    'C',
+    'G',
+    'T',
+    'N',
+}
+
+
+def is_repeat_of(alt, reference, min_repeats):
+    # equivalent of re.fullmatch(f'({reference}){{{min_repeats},}}', alt)
+    repeats, remainder = divmod(len(alt), len(reference))
+    return remainder == 0 and repeats >= min_repeats and alt == reference * repeats
+
+
+def alt_predicate(payload):
+    '''
+    Returns a function (alt, reference) -> bool for the requested alternate
+    bases or variant type, chosen once per payload
+    '''
+    v_prefix = '<{}'.format(payload.variant_type)
+
+    # if alternate base defined
+    if payload.alternate_bases is not None:
+        if payload.alternate_bases == 'N':
+            return lambda alt, reference: alt.upper() in BASES
+        alternate_bases = payload.alternate_bases
+        return lambda alt, reference: alt.upper() == alternate_bases
+
+    # alternate base not defined
+    if payload.variant_type == 'DEL':
+        def predicate(alt, reference):
+            if alt.startswith('<'):
+                return alt.startswith(v_prefix) or alt == '<CN0>'
+            return len(alt) < len(reference)
+    elif payload.variant_type == 'INS':
+        def predicate(alt, reference):
+            if alt.startswith('<'):
+                return alt.startswith(v_prefix)
+            return len(alt) > len(reference)
+    elif payload.variant_type == 'DUP':
+        def predicate(alt, reference):
+            if alt.startswith('<'):
+                return alt.startswith(v_prefix) or (alt.startswith('<CN') and alt not in ('<CN0>', '<CN1>'))
+            return is_repeat_of(alt, reference, 2)
+    elif payload.variant_type == 'DUP:TANDEM':
+        def predicate(alt, reference):
+            if alt.startswith('<'):
+                return alt.startswith(v_prefix) or alt == '<CN2>'
+            return alt == reference + reference
+    elif payload.variant_type == 'CNV':
+        def predicate(alt, reference):
+            if alt.startswith('<'):
+                return alt.startswith(('<CN', '<DEL', '<DUP', v_prefix))
+            return alt == '.' or is_repeat_of(alt, reference, 0)
+    else:
+        # For structural variants that aren't otherwise recognisable
+        def predicate(alt, reference):
+            return alt.startswith(v_prefix)
+    return predicate
+
+
+def reference_predicate(payload, wildcards):
+    '''
+    Returns a function reference -> bool, or None when any reference matches.
+    With wildcards, every N in the requested bases matches any base.
+    '''
+    if payload.reference_bases == 'N':
+        return None
+    if wildcards and 'N' in payload.reference_bases:
+        rgx = re.compile('^' + payload.reference_bases.replace('N', '[ACGTN]{1}') + '$')
+        return lambda reference: rgx.match(reference.upper()) is not None
+    reference_bases = payload.reference_bases
+    return lambda reference: reference.upper() == reference_bases
+
+
+def build_matcher(payload, reference_wildcards=False):
+    '''
+    Compiles the payload's region, end range, reference, alternate and
+    length constraints into one function
+        match(pos, reference, all_alts) -> (alts, hit_indexes)
+    where hit_indexes are the matching positions in alts, empty if the
+    record does not match.
+    '''
+    # region is of form: "chrom:start-end"
+    first_bp = int(payload.region[payload.region.find(':') + 1: payload.region.find('-')])
+    last_bp = int(payload.region[payload.region.find('-') + 1:])
+    end_min = payload.end_min
+    end_max = payload.end_max
+    min_length = payload.variant_min_length
+    max_length = float('inf') if payload.variant_max_length < 0 else payload.variant_max_length
+    reference_ok = reference_predicate(payload, reference_wildcards)
+    alt_ok = alt_predicate(payload)
+    no_hits = ([], [])
+
+    def match(pos, reference, all_alts):
+        # Ensure each variant will only be found by one process
+        if not first_bp <= pos <= last_bp:
+            return no_hits
+        # must be within end range
+        if not end_min <= pos + len(reference) - 1 <= end_max:
+            return no_hits
+        if reference_ok is not None and not reference_ok(reference):
+            return no_hits
+        alts = all_alts.split(',')
+        return alts, [
+            i for i, alt in enumerate(alts)
+            if min_length <= len(alt) <= max_length and alt_ok(alt, reference)
+        ]
+
+    return match
@@ -0,0 +1,101 @@
+import threading
+import time
+
+from payloads.lambda_payloads import PerformQueryPayload
+from dynamodb.variant_queries import hit_signalled
+
+
+# records read between clock checks
+CHECK_INTERVAL = 256
+# seconds between checks of the hit signal of a boolean query
+SIGNAL_INTERVAL = 0.5
+# seconds a read of the hit signal is kept for after it expires, so the
+# reads of finished queries are dropped
+SIGNAL_RETENTION = 60
+# query id -> (time read, signalled), shared by the work items of a
+# container so they make one read of the query item every SIGNAL_INTERVAL
+signal_reads = {}
+signal_lock = threading.Lock()
+
+
+class Deadline:
+    '''
+    Deadline of a query payload, in epoch seconds or None for no limit.
+    Iterations wrapped with until_expired stop once it passes and
+    passed is set, the response is then returned as partial. Readers
+    that filter records themselves check reached as they scan instead,
+    until_expired only sees the records they let through. The same goes
+    for the short circuit.
+    They also stop, setting stopped, once short_circuit returns True,
+    called at most every SIGNAL_INTERVAL seconds. The response is partial
+    then too, and is not cached.
+    '''
+    def __init__(self, deadline, short_circuit=None):
+        self.deadline = deadline
+        self.passed = False
+        self.short_circuit = short_circuit
+        self.stopped = False
+        self.signal_checked = None
+
+    def expired(self):
+        if self.deadline is not None and time.time() > self.deadline:
+            self.passed = True
+        return self.passed
+
+    def short_circuited(self):
+        if self.short_circuit is None or self.stopped:
+            return self.stopped
+        now = time.time()
+        if self.signal_checked is None or now - self.signal_checked >= SIGNAL_INTERVAL:
+            self.signal_checked = now
+            self.stopped = self.short_circuit()
+        return self.stopped
+
+    def reached(self):
+        '''
+        For readers that check the deadline and the hit signal as they
+        scan, see vcfutils.region_reader.query_region
+        '''
+        if self.expired():
+            print('Deadline passed, returning partial results')
+            return True
+        if self.short_circuited():
+            print('Another split found a hit, stopping')
+            return True
+        return False
+
+    def until_expired(self, items, interval=CHECK_INTERVAL):
+        for n, item in enumerate(items):
+            if n % interval == 0:
+                if self.expired():
+                    print('Deadline passed, returning partial results')
+                    return
+                if self.short_circuited():
+                    print('Another split found a hit, stopping')
+                    return
+            yield item
+
+
+def shared_hit_signalled(query_id):
+    with signal_lock:
+        now = time.time()
+        read = signal_reads.get(query_id)
+        if read is not None and (read[1] or now - read[0] < SIGNAL_INTERVAL):
+            return read[1]
+        for stale_id, (read_time, _) in list(signal_reads.items()):
+            if now - read_time > SIGNAL_RETENTION:
+                del signal_reads[stale_id]
+        # read under the lock, work items waiting on it use this read
+        signalled = hit_signalled(query_id)
+        signal_reads[query_id] = (time.time(), signalled)
+        return signalled
+
+
+def get_deadline(payload: PerformQueryPayload):
+    '''
+    Deadline of the payload. A boolean query is answered by the first
+    hit of any split, so its splits also stop once one is signalled.
+    '''
+    if payload.requested_granularity == 'boolean':
+        return Deadline(payload.deadline, lambda: shared_hit_signalled(payload.query_id))
+    return Deadline(payload.deadline)
@@ -3,10 +3,21 @@ import jsons
 import re
 import os
 import glob
+import copy
+import base64
+import concurrent.futures
 
 import search_variants
 import search_variants_in_samples
+import search_carriers
+from save_response import save_response
 from payloads.lambda_payloads import PerformQueryPayload
+from payloads.lambda_responses import PerformQueryResponse
+from dynamodb.variant_queries import signal_hit
+from utils.completion import notify
+from vcfutils.cache import CACHE_DIR, VcfModifiedError, cache, fetch, get_index
+from vcfutils.carrier_store import save_window
+from vcfutils.result_cache import get_result_key, put_cached_result
 
 BASES = [
     'A',
@@ -18,11 +29,16 @@ BASES = [
 
 all_count_pattern = re.compile('[0-9]+')
 get_all_calls = all_count_pattern.findall
+# work items of a batch processed concurrently
+BATCH_WORKERS = 8
 
 
 def lambda_handler(event, context):
+    # keep the vcf cache warm across invocations, remove everything else
     files = glob.glob('/tmp/*')
     for file in files:
+        if file == CACHE_DIR:
+            continue
         try:
             os.unlink(file)
         except OSError as e:
@@ -38,15 +54,115 @@ def lambda_handler(event, context):
         is_async = False
         print('using invoke event')
 
+    # ingestion time job published by summariseVcf
+    if 'carrierStore' in event:
+        build_carrier_store(**event['carrierStore'])
+        print(f'VCF cache stats: {json.dumps(cache.stats())}')
+        return
+
     performQueryPayload = jsons.load(event, PerformQueryPayload)
+
+    if performQueryPayload.work_items:
+        responses = perform_batch(performQueryPayload, is_async)
+        print(f'VCF cache stats: {json.dumps(cache.stats())}')
+        print(f'Returning {len(responses)} responses')
+        return [encode_response(response) for response in responses]
+
+    response = perform_query(performQueryPayload, is_async)
+
+    print(f'VCF cache stats: {json.dumps(cache.stats())}')
+    print(f'Returning response')
+    return encode_response(response)
+
+
+def encode_response(response):
+    # compact binary response, base64 for the json invoke payload
+    return base64.b64encode(response.dumpb()).decode()
+
+
+def perform_query(payload: PerformQueryPayload, is_async):
+    response = search(payload, is_async)
+    # complete responses are reused by later queries of the same work
+    # item, streamed ones refer to objects that expire with the query
+    if not response.partial and not response.variant_chunks:
+        put_cached_result(get_result_key(payload, payload.vcf_location, payload.region), response.dumpb())
+    # the other splits of a boolean query can stop
+    if payload.requested_granularity == 'boolean' and response.exists:
+        signal_hit(payload.query_id)
+        notify(payload.completion_channel)
+    return response
+
+
+def search(payload: PerformQueryPayload, is_async):
+    '''
+    Runs the engine of the payload. A VCF replaced while it is read has
+    its etag dropped by the cache, so the work item is run again against
+    the new file and index. Records already counted can't be mixed with
+    the new ones, so it starts over. Should it change again the item is
+    answered as partial rather than failing the rest of its batch.
+    '''
+    try:
+        return run_engine(payload, is_async)
+    except VcfModifiedError as e:
+        print(f'Running the query again - {e}')
+    try:
+        return run_engine(payload, is_async)
+    except VcfModifiedError as e:
+        print(f'Returning partial results - {e}')
+    response = PerformQueryResponse(
+        exists = False,
+        dataset_id = payload.dataset_id,
+        vcf_location = payload.vcf_location,
+        all_alleles_count = 0,
+        variants = [],
+        call_count = 0,
+        sample_indices = [],
+        sample_names = [],
+        partial = True
+    )
+    if is_async:
+        save_response(payload, response)
+    return response
+
+
+def run_engine(payload: PerformQueryPayload, is_async):
     # switch operations
-    if performQueryPayload.passthrough.get('selectedSamplesOnly', False):
-        response = search_variants_in_samples.perform_query(performQueryPayload, is_async)
+    if payload.passthrough.get('selectedSamplesOnly', False):
+        # bitset engine when the carrier store exists, vcf scan otherwise
+        response = search_carriers.perform_query(payload, is_async)
+        if response is not None:
+            return response
+        return search_variants_in_samples.perform_query(payload, is_async)
     else:
-        response = search_variants.perform_query(performQueryPayload, is_async)
+        return search_variants.perform_query(payload, is_async)
 
-    print(f'Returning response')
-    return response.dump()
+
+def perform_batch(payload: PerformQueryPayload, is_async):
+    '''
+    Runs each [vcf_location, region] work item as its own query and returns
+    the responses in the order of the work items. Items on the same VCF
+    share the warm index and block cache.
+    '''
+    item_payloads = []
+    for vcf_location, region in payload.work_items:
+        item_payload = copy.copy(payload)
+        item_payload.vcf_location = vcf_location
+        item_payload.region = region
+        item_payload.work_items = None
+        item_payloads.append(item_payload)
+
+    with concurrent.futures.ThreadPoolExecutor(BATCH_WORKERS) as pool:
+        return list(pool.map(lambda item: perform_query(item, is_async), item_payloads))
+
+
+def build_carrier_store(location, etag, windows):
+    '''
+    Builds and uploads the carrier store objects of the given
+    [chrom, window_start] windows of a VCF
+    '''
+    index = get_index(location)
+    for chrom, window_start in windows:
+        save_window(search_carriers.VARIANTS_BUCKET, location, etag, chrom, window_start, index, fetch)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,43 @@
+def case_insensitive(bases, wildcards=False):
+    # POSIX regular expression, bcftools has no case insensitive flag
+    return ''.join(
+        '[ACGTNacgtn]' if wildcards and base == 'N' else f'[{base.upper()}{base.lower()}]'
+        for base in bases
+    )
+
+
+def bcftools_filters(payload, reference_wildcards=False):
+    '''
+    Translates the payload constraints that bcftools can evaluate itself
+    into --include/--types arguments, so only candidate records reach
+    python. The remaining checks (end range, variant type and length)
+    are left to the matcher, which still runs on every candidate.
+    '''
+    # region is of form: "chrom:start-end"
+    first_bp = int(payload.region[payload.region.find(':') + 1: payload.region.find('-')])
+    last_bp = int(payload.region[payload.region.find('-') + 1:])
+    # --regions also returns records starting before the region that overlap it
+    terms = [f'POS>={first_bp}', f'POS<={last_bp}']
+    reference_bases = payload.reference_bases
+    alternate_bases = payload.alternate_bases
+
+    if reference_bases != 'N':
+        terms.append(f'REF~"^{case_insensitive(reference_bases, reference_wildcards)}$"')
+
+    if alternate_bases is not None and alternate_bases != 'N':
+        # case insensitive like the matcher, anchored at allele boundaries
+        # so it holds whether bcftools tests each allele or the joined list
+        terms.append(f'ALT~"(^|,){case_insensitive(alternate_bases)}(,|$)"')
+
+    args = ['--include', ' && '.join(terms)]
+
+    # a single base reference with a single base alternate can only be a snp
+    if (
+        alternate_bases is not None
+        and len(alternate_bases) == 1
+        and len(reference_bases) == 1
+        and reference_bases != 'N'
+    ):
+        args += ['--types', 'snps']
+
+    return args
@@ -0,0 +1,99 @@
+import subprocess
+
+from botocore.exceptions import ClientError
+
+from vcfutils.region_reader import query_region, get_sample_names
+from vcfutils.cache import get_index, fetch
+from pushdown import bcftools_filters
+
+
+def bcftools_records(payload, match, sample_names=None, include_samples=False, reference_wildcards=False):
+    '''
+    Fallback for VCFs the native reader cannot serve (non s3 or unindexed)
+    '''
+    args = [
+        'bcftools', 'query',
+        '--regions', payload.region,
+        '--format', '%POS\t%REF\t%ALT\t%INFO\t[%GT,]\t[%SAMPLE,]\n' if include_samples else '%POS\t%REF\t%ALT\t%INFO\t[%GT,]\n',
+    ]
+    if sample_names is not None:
+        args += ['--samples', ','.join(sample_names)]
+    # let bcftools discard non candidate records before they reach python
+    args += bcftools_filters(payload, reference_wildcards)
+    args.append(payload.vcf_location)
+    print('CMD: ' + ' '.join(args[:5] + [repr(args[5])] + args[6:]))
+
+    query_process = subprocess.Popen(args, stdout=subprocess.PIPE, cwd='/tmp', encoding='ascii')
+    all_sample_names = []
+
+    def records():
+        try:
+            for line in query_process.stdout:
+                try:
+                    if include_samples:
+                        (position, reference, all_alts, info_str, genotypes, samples) = line.split('\t')
+                        if len(all_sample_names) == 0:
+                            all_sample_names.extend(samples.strip().strip(',').split(','))
+                    else:
+                        (position, reference, all_alts, info_str, genotypes) = line.rstrip('\n').split('\t')
+                except ValueError as e:
+                    print(repr(line.split('\t')))
+                    raise e
+                pos = int(position)
+                # bcftools filters are only a superset of the matcher
+                matched = match(pos, reference, all_alts)
+                if matched[1]:
+                    yield pos, reference, all_alts, info_str, genotypes, matched
+        finally:
+            query_process.stdout.close()
+
+    return all_sample_names, records()
+
+
+def native_records(payload, index, match, sample_names=None, include_samples=False, stop=None):
+    sample_columns = None
+    all_sample_names = []
+
+    if include_samples or sample_names is not None:
+        header_samples = get_sample_names(payload.vcf_location, fetch)
+        if sample_names is None:
+            all_sample_names = header_samples
+        else:
+            # same as bcftools --samples, keeping the order requested
+            positions = {sample: n for n, sample in enumerate(header_samples)}
+            sample_columns = [positions[sample] for sample in sample_names if sample in positions]
+            all_sample_names = [header_samples[n] for n in sample_columns]
+
+    records = query_region(
+        payload.vcf_location,
+        payload.region,
+        index=index,
+        sample_columns=sample_columns,
+        # skip the genotype columns of records that can't match
+        match=match,
+        stop=stop,
+        fetch=fetch
+    )
+    return all_sample_names, records
+
+
+def query_records(payload, match, sample_names=None, include_samples=False, reference_wildcards=False, stop=None):
+    '''
+    Records of payload.region as (pos, ref, alt, info, genotypes,
+    (alts, hit indexes)) tuples along with the names of the samples in
+    the genotype column. Only records with hits are returned, each
+    matched once.
+    Reads the bgzf blocks directly from s3 and only spawns bcftools
+    when that is not possible. Records are filtered with the payload's
+    matcher, or the equivalent bcftools expression, before the genotypes
+    are read. The native reader ends early once stop() returns True.
+    '''
+    if payload.vcf_location.startswith('s3://'):
+        try:
+            index = get_index(payload.vcf_location)
+        except (ValueError, ClientError) as e:
+            print(f'Falling back to bcftools - {e}')
+        else:
+            return native_records(payload, index, match, sample_names, include_samples, stop)
+
+    return bcftools_records(payload, match, sample_names, include_samples, reference_wildcards)
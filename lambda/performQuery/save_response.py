@@ -0,0 +1,61 @@
+import os
+from uuid import uuid4
+
+import boto3
+from botocore.exceptions import ClientError
+from pynamodb.exceptions import PynamoDBException
+
+from payloads.lambda_payloads import PerformQueryPayload
+from payloads.lambda_responses import PerformQueryResponse
+import dynamodb.variant_queries as db
+from utils.completion import notify
+
+
+VARIANTS_BUCKET = os.environ['VARIANTS_BUCKET']
+
+s3 = boto3.client('s3')
+
+
+def save_response(payload: PerformQueryPayload, response: PerformQueryResponse):
+    '''
+    Records the response of an async query for the fan in
+    '''
+    try:
+        uuid = uuid4().hex
+        body = response.dumpb()
+        split_id = payload.get_split_id()
+
+        result = db.VariantResponse(payload.query_id)
+        result.responseNumber = db.get_response_number(split_id)
+
+        if len(body) < 1024 * 300:
+            # response
+            result.checkS3 = False
+            result.compactResult = body
+        else:
+            key = f'variant-queries/{uuid}.bin'
+            s3.put_object(
+                Body = body,
+                Bucket = VARIANTS_BUCKET,
+                Key = key
+            )
+            print(f'Uploaded - {VARIANTS_BUCKET}/{key}')
+            # s3 details
+            s3loc = db.S3Location()
+            s3loc.bucket = VARIANTS_BUCKET
+            s3loc.key = key
+            # response
+            result.responseLocation = s3loc
+            result.checkS3 = True
+        # the fan in counts each split once
+        fan_out = db.record_response(result, db.get_shard_id(payload.query_id, split_id))
+        if fan_out is None:
+            print(f'Dropping duplicate response for split {split_id}')
+            return
+        # the last response of the shard wakes the fan in to sum them
+        if fan_out == 0:
+            notify(payload.completion_channel)
+    except (ClientError, PynamoDBException) as e:
+        print(f"Error: {e}")
+        # lambda retries the invocation, the response is recorded once
+        raise e
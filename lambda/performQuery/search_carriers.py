@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+
+from payloads.lambda_payloads import PerformQueryPayload
+from payloads.lambda_responses import PerformQueryResponse
+from allele_matcher import build_matcher
+from save_response import save_response
+from variant_stream import VariantStream
+from deadline import get_deadline
+from vcfutils.cache import cache, get_etag
+from vcfutils.carrier_store import get_window_starts, load_window, popcount
+from vcfutils.region_reader import parse_region
+
+
+VARIANTS_BUCKET = os.environ['VARIANTS_BUCKET']
+
+
+def load_windows(payload: PerformQueryPayload):
+    '''
+    Carrier store windows covering the payload region, or None when any of
+    them is missing and the query has to scan the VCF instead
+    '''
+    if not payload.vcf_location.startswith('s3://'):
+        return None
+    chrom, start, end = parse_region(payload.region)
+    etag = get_etag(payload.vcf_location)
+    windows = []
+    for window_start in get_window_starts(start, end):
+        window = load_window(VARIANTS_BUCKET, payload.vcf_location, etag, chrom, window_start, cache=cache)
+        if window is None:
+            return None
+        windows.append(window)
+    return windows
+
+
+def perform_query(payload: PerformQueryPayload, is_async):
+    '''
+    Same as search_variants_in_samples.perform_query, answered from the
+    carrier store. Both count over the selected samples only and agree on
+    the order of sample_indices. Returns None
+    if the carrier store has not been built for the region.
+    '''
+    windows = load_windows(payload)
+    if windows is None:
+        return None
+
+    match = build_matcher(payload, reference_wildcards=True)
+    selected_sample_names = payload.passthrough.get('sampleNames', ['_'])
+    # region is of form: "chrom:start-end"
+    chrom = payload.region[:payload.region.find(':')]
+    exists = False
+    variant_stream = VariantStream(payload)
+    deadline = get_deadline(payload)
+    call_count = 0
+    all_alleles_count = 0
+    carrier_names = set()
+    sample_names = []
+
+    for window in deadline.until_expired(windows, 1):
+        selection = window.selection(selected_sample_names)
+        carriers = np.zeros_like(selection)
+
+        for rec, (pos, reference, all_alts, variant_type) in enumerate(window.records):
+            alts, hit_indexes = match(int(pos), reference, all_alts)
+            if not hit_indexes:
+                continue
+            offset = window.allele_offsets[rec]
+
+            for i in hit_indexes:
+                row = offset + i
+                allele_carriers = window.carriers[row] & selection
+                allele_calls = popcount(allele_carriers) + popcount(window.doubles[row] & selection)
+                if allele_calls:
+                    # ["Chr1 123 A G SNP"]
+                    variant_stream.extend([f'{chrom}\t{pos}\t{reference}\t{alts[i]}\t{variant_type}'])
+                    carriers |= allele_carriers
+                call_count += allele_calls
+
+            if call_count:
+                exists = True
+                if not payload.include_details:
+                    break
+            all_alleles_count += popcount(window.called1[rec] & selection) + popcount(window.called2[rec] & selection)
+
+        if exists and not payload.include_details:
+            break
+        if payload.requested_granularity in ('record', 'aggregated'):
+            carrier_names.update(
+                window.sample_names[n]
+                for n in np.flatnonzero(np.unpackbits(carriers, count=len(window.sample_names)))
+            )
+
+    sample_indices = []
+    if payload.requested_granularity in ('record', 'aggregated') and windows:
+        # indexes into the selected samples present in the vcf, in the
+        # order requested as bcftools --samples and the scan engine have it
+        present = set(windows[0].sample_names)
+        all_sample_names = [sample for sample in selected_sample_names if sample in present]
+        sample_indices = [n for n, sample in enumerate(all_sample_names) if sample in carrier_names]
+        sample_names = [all_sample_names[n] for n in sample_indices]
+
+    variants, variant_chunks = variant_stream.finish()
+
+    response = PerformQueryResponse(
+        exists = exists,
+        dataset_id = payload.dataset_id,
+        vcf_location =  payload.vcf_location,
+        all_alleles_count = all_alleles_count,
+        variants = variants,
+        call_count = call_count,
+        sample_indices = sample_indices,
+        sample_names = sample_names,
+        variant_chunks = variant_chunks,
+        partial = deadline.passed or deadline.stopped
+    )
+    if is_async:
+        save_response(payload, response)
+
+    return response
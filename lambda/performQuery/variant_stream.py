@@ -0,0 +1,158 @@
+import os
+from uuid import uuid4
+
+import boto3
+
+from payloads.lambda_payloads import PerformQueryPayload
+from payloads.lambda_responses import PerformQueryResponse
+
+
+VARIANTS_BUCKET = os.environ['VARIANTS_BUCKET']
+# local stand-in for the multipart upload, used when set
+RESULT_CHUNK_DIR = os.environ.get('RESULT_CHUNK_DIR')
+# variants held in memory before they are flushed as a chunk
+CHUNK_VARIANTS = 10000
+# smallest part s3 accepts in a multipart upload, except for the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+s3 = boto3.client('s3')
+
+
+class S3MultipartSink:
+    '''
+    Appends chunks to one object with a multipart upload, parts are
+    uploaded once MIN_PART_SIZE bytes are pending
+    '''
+    def __init__(self, bucket, key):
+        self.bucket = bucket
+        self.key = key
+        self.location = f's3://{bucket}/{key}'
+        self.upload_id = None
+        self.parts = []
+        self.pending = []
+        self.pending_size = 0
+        self.size = 0
+
+    def write(self, body):
+        first_byte = self.size
+        self.size += len(body)
+        self.pending.append(body)
+        self.pending_size += len(body)
+        if self.pending_size >= MIN_PART_SIZE:
+            self.upload_part()
+        return first_byte, self.size - 1
+
+    def upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = s3.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+        part_number = len(self.parts) + 1
+        response = s3.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=b''.join(self.pending)
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.pending = []
+        self.pending_size = 0
+
+    def close(self):
+        if self.pending:
+            self.upload_part()
+        s3.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts}
+        )
+        print(f'Uploaded - {self.location} in {len(self.parts)} parts')
+
+    def abort(self):
+        if self.upload_id is not None:
+            s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+class LocalFileSink:
+    def __init__(self, path):
+        self.location = path
+        self.file = open(path, 'wb')
+
+    def write(self, body):
+        first_byte = self.file.tell()
+        self.file.write(body)
+        return first_byte, self.file.tell() - 1
+
+    def close(self):
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.location)
+
+
+def get_sink():
+    uuid = uuid4().hex
+    if RESULT_CHUNK_DIR is not None:
+        return LocalFileSink(os.path.join(RESULT_CHUNK_DIR, f'{uuid}.bin'))
+    return S3MultipartSink(VARIANTS_BUCKET, f'variant-queries/{uuid}.bin')
+
+
+class VariantStream:
+    '''
+    Collects the variant strings of a query. Every CHUNK_VARIANTS variants
+    are encoded as a compact response and written out, so memory does not
+    grow with the number of hits. Results that never fill a chunk stay
+    inline.
+    '''
+    def __init__(self, payload: PerformQueryPayload):
+        self.payload = payload
+        self.buffer = []
+        self.chunks = []
+        self.sink = None
+
+    def extend(self, variants):
+        self.buffer.extend(variants)
+        if len(self.buffer) >= CHUNK_VARIANTS:
+            self.flush()
+
+    def flush(self):
+        if self.sink is None:
+            self.sink = get_sink()
+        chunk = PerformQueryResponse(
+            exists = True,
+            dataset_id = self.payload.dataset_id,
+            vcf_location = self.payload.vcf_location,
+            all_alleles_count = 0,
+            variants = self.buffer,
+            call_count = 0,
+            sample_indices = [],
+            sample_names = []
+        )
+        try:
+            first_byte, last_byte = self.sink.write(chunk.dumpb())
+        except Exception as e:
+            self.sink.abort()
+            raise e
+        self.chunks.append({
+            'location': self.sink.location,
+            'first_byte': first_byte,
+            'last_byte': last_byte,
+            'count': len(self.buffer),
+        })
+        self.buffer = []
+
+    def finish(self):
+        '''
+        Returns (variants, variant_chunks) for the response
+        '''
+        if self.sink is None:
+            return self.buffer, []
+        if self.buffer:
+            self.flush()
+        try:
+            self.sink.close()
+        except Exception as e:
+            self.sink.abort()
+            raise e
+        return [], self.chunks
@@ -1,113 +1,288 @@
+import base64
+import concurrent.futures
 import json
 import os
-import concurrent.futures
-import queue
 
-import boto3
 import jsons
+from botocore.exceptions import ClientError
 
-from payloads.lambda_payloads import SplitQueryPayload, PerformQueryPayload
+from payloads.lambda_payloads import SplitQueryPayload, PerformQueryPayload, get_split_id
+from payloads.lambda_responses import PerformQueryResponse, COMPACT_HEADER
+from dynamodb.variant_queries import (
+    VariantQuery, VariantResponse, S3Location, get_response_number, hit_signalled, signal_hit, add_fan_out
+)
+from vcfutils.cache import get_index
+from vcfutils.split_planner import plan_splits
+from vcfutils.region_reader import get_region_chunks
+from vcfutils.result_cache import is_enabled, get_result_key, get_result_location, get_cached_result
+from utils.sns_batch import publish_batch
+from utils.async_invoke import invoke_all
+from utils.completion import notify
 
 
+# fixed window for vcfs without a usable index
 SPLIT_SIZE = 10000
+# compressed vcf bytes read by each performQuery work item
+SPLIT_BYTES = int(os.environ.get('SPLIT_QUERY_BYTES_PER_WORKER', 2 * 1024 * 1024))
+# number of (vcf, region) work items sent to each performQuery invocation
+BATCH_SIZE = 16
+# concurrent synchronous performQuery invocations
+PERFORM_QUERY_CONCURRENCY = 32
+# seconds before the query deadline that performQuery stops scanning, and
+# that this function stops waiting, to leave time for the responses to
+# travel back to the API
+PERFORM_QUERY_DEADLINE_MARGIN = 1.5
+SPLIT_QUERY_DEADLINE_MARGIN = 0.5
+# concurrent result cache lookups
+CACHE_LOOKUP_THREADS = 32
+# cached responses smaller than this are saved in the responses table,
+# as performQuery does
+INLINE_RESPONSE_BYTES = 1024 * 300
 PERFORM_QUERY = os.environ['PERFORM_QUERY_LAMBDA']
 PERFORM_QUERY_TOPIC_ARN = os.environ['PERFORM_QUERY_TOPIC_ARN']
 
-aws_lambda = boto3.client('lambda')
-sns = boto3.client('sns')
-
 
-def perform_query(payload: PerformQueryPayload):
-    kwargs = {
-        'TopicArn': PERFORM_QUERY_TOPIC_ARN,
-        'Message': jsons.dumps(payload)
-    }
-    sns.publish(**kwargs)
+def perform_queries(payloads):
+    unpublished = publish_batch(PERFORM_QUERY_TOPIC_ARN, [jsons.dumps(payload) for payload in payloads])
+    # work items that will never respond
+    return [work_item for n in unpublished for work_item in payloads[n].work_items]
 
 
-def perform_query_sync(payload: PerformQueryPayload, results_queue: queue.Queue):
-    response = aws_lambda.invoke(
-        FunctionName=PERFORM_QUERY,
-        InvocationType='RequestResponse',
-        Payload=jsons.dumps(payload),
+def get_missing_response(payload: PerformQueryPayload, vcf_location):
+    '''
+    Stands in for a work item that did not respond before the deadline
+    '''
+    response = PerformQueryResponse(
+        exists = False,
+        dataset_id = payload.dataset_id,
+        vcf_location = vcf_location,
+        all_alleles_count = 0,
+        variants = [],
+        call_count = 0,
+        sample_indices = [],
+        sample_names = [],
+        partial = True
     )
+    return base64.b64encode(response.dumpb()).decode()
 
-    results_queue.put(json.loads(response['Payload'].read()))
 
+def any_exists(result_array):
+    # exists flag in the header of the compact responses
+    return any(COMPACT_HEADER.unpack_from(base64.b64decode(result))[1] for result in result_array)
+
+
+def perform_queries_sync(payloads, deadline=None, boolean=False):
+    results = []
+    responded = set()
+    if deadline is not None:
+        deadline -= SPLIT_QUERY_DEADLINE_MARGIN
+    # batched payloads return one response per work item, straggling
+    # batches are re-invoked and only the first copy to return is kept
+    batch_results = invoke_all(PERFORM_QUERY, [jsons.dumps(payload) for payload in payloads], PERFORM_QUERY_CONCURRENCY, speculate=True, deadline=deadline)
+    for n, result_array in batch_results:
+        responded.add(n)
+        results += result_array
+        # the first hit answers a boolean query, batches not yet
+        # invoked are dropped and running ones cancelled
+        if boolean and any_exists(result_array):
+            batch_results.close()
+            return results
+    # the api reports these as not covered
+    for n, payload in enumerate(payloads):
+        if n not in responded:
+            results += [get_missing_response(payload, vcf_location) for vcf_location, _ in payload.work_items]
+    return results
 
-def split_query(split_payload: SplitQueryPayload):
-    # to find HITs or ALL we must analyse all vcfs
-    check_all = split_payload.include_datasets in ('HIT', 'ALL')
 
-    split_start = split_payload.start_min
-    pool = concurrent.futures.ThreadPoolExecutor(32)
-
-    while split_start <= split_payload.start_max:
-        split_end = min(split_start + SPLIT_SIZE - 1, split_payload.start_max)
-        # perform query on this split of the vcf
-        for vcf_location, chrom in split_payload.vcf_locations.items():
-            payload = PerformQueryPayload(
-                passthrough=split_payload.passthrough,
-                dataset_id=split_payload.dataset_id,
-                query_id=split_payload.query_id,
-                reference_bases=split_payload.reference_bases,
-                end_min=split_payload.end_min,
-                end_max=split_payload.end_max,
-                alternate_bases=split_payload.alternate_bases,
-                variant_type=split_payload.variant_type,
-                requested_granularity=split_payload.requested_granularity,
-                variant_min_length=split_payload.variant_min_length,
-                variant_max_length=split_payload.variant_max_length,
-                include_details=check_all,
-                # region for bcftools
-                region=f'{chrom}:{split_start}-{split_end}',
-                vcf_location=vcf_location
-            )
-            pool.submit(perform_query, payload)
-
-        # next split
+def get_fixed_splits(start, end):
+    split_start = start
+
+    while split_start <= end:
+        split_end = min(split_start + SPLIT_SIZE - 1, end)
+        yield split_start, split_end
         split_start += SPLIT_SIZE
 
-    pool.shutdown()
 
+def get_splits(vcf_location, chrom, start, end):
+    '''
+    Regions of about SPLIT_BYTES compressed bytes each, planned from the
+    vcf index, or fixed SPLIT_SIZE windows if the index can't be read.
+    Returns (index, splits), index is None for fixed windows.
+    '''
+    if vcf_location.startswith('s3://'):
+        try:
+            index = get_index(vcf_location)
+        except (ValueError, ClientError) as e:
+            print(f'Using fixed splits for {vcf_location} - {e}')
+        else:
+            return index, plan_splits(index, chrom, start, end, SPLIT_BYTES)
+    return None, list(get_fixed_splits(start, end))
 
-def split_query_sync(split_payload: SplitQueryPayload):
+
+def get_work_items(split_payload: SplitQueryPayload):
+    '''
+    [vcf_location, region] work items, and the number of splits dropped
+    because the vcf index has no chunks overlapping them
+    '''
+    work_items = []
+    skipped = 0
+
+    # perform query on each split of each vcf
+    for vcf_location, chrom in split_payload.vcf_locations.items():
+        index, splits = get_splits(vcf_location, chrom, split_payload.start_min, split_payload.start_max)
+        for split_start, split_end in splits:
+            if index is not None and not get_region_chunks(index, chrom, split_start, split_end):
+                skipped += 1
+                continue
+            # region for bcftools
+            work_items.append([vcf_location, f'{chrom}:{split_start}-{split_end}'])
+
+    print(f'Planned {len(work_items)} work items, skipped {skipped} empty splits')
+    return work_items, skipped
+
+
+def get_perform_query_payload(split_payload: SplitQueryPayload, work_items):
     # to find HITs or ALL we must analyse all vcfs
     check_all = split_payload.include_datasets in ('HIT', 'ALL')
 
-    split_start = split_payload.start_min
-    pool = concurrent.futures.ThreadPoolExecutor(32)
-    results_queue = queue.Queue()
-
-    while split_start <= split_payload.start_max:
-        split_end = min(split_start + SPLIT_SIZE - 1, split_payload.start_max)
-        # perform query on this split of the vcf
-        for vcf_location, chrom in split_payload.vcf_locations.items():
-            payload = PerformQueryPayload(
-                passthrough=split_payload.passthrough,
-                dataset_id=split_payload.dataset_id,
-                query_id=split_payload.query_id,
-                reference_bases=split_payload.reference_bases,
-                end_min=split_payload.end_min,
-                end_max=split_payload.end_max,
-                alternate_bases=split_payload.alternate_bases,
-                variant_type=split_payload.variant_type,
-                requested_granularity=split_payload.requested_granularity,
-                variant_min_length=split_payload.variant_min_length,
-                variant_max_length=split_payload.variant_max_length,
-                include_details=check_all,
-                # region for bcftools
-                region=f'{chrom}:{split_start}-{split_end}',
-                vcf_location=vcf_location
-            )
-            pool.submit(perform_query_sync, payload, results_queue)
-
-        # next split
-        split_start += SPLIT_SIZE
+    return PerformQueryPayload(
+        passthrough=split_payload.passthrough,
+        dataset_id=split_payload.dataset_id,
+        query_id=split_payload.query_id,
+        reference_bases=split_payload.reference_bases,
+        end_min=split_payload.end_min,
+        end_max=split_payload.end_max,
+        alternate_bases=split_payload.alternate_bases,
+        variant_type=split_payload.variant_type,
+        requested_granularity=split_payload.requested_granularity,
+        variant_min_length=split_payload.variant_min_length,
+        variant_max_length=split_payload.variant_max_length,
+        include_details=check_all,
+        work_items=work_items,
+        deadline=None if split_payload.deadline is None else split_payload.deadline - PERFORM_QUERY_DEADLINE_MARGIN,
+        completion_channel=split_payload.completion_channel
+    )
+
+
+def get_perform_query_payloads(split_payload: SplitQueryPayload, work_items):
+    for batch_start in range(0, len(work_items), BATCH_SIZE):
+        yield get_perform_query_payload(split_payload, work_items[batch_start:batch_start + BATCH_SIZE])
+
 
-    pool.shutdown()
+def find_cached(split_payload: SplitQueryPayload, work_items):
+    '''
+    Looks the work items up in the result cache. Returns the cached ones
+    as (work item, result key, compact response) and those left to run.
+    '''
+    if not work_items or not is_enabled():
+        return [], work_items
+    payload = get_perform_query_payload(split_payload, [])
+
+    def lookup(work_item):
+        key = get_result_key(payload, *work_item)
+        return key, get_cached_result(key)
+
+    with concurrent.futures.ThreadPoolExecutor(CACHE_LOOKUP_THREADS) as pool:
+        lookups = list(pool.map(lookup, work_items))
+    cached = [(work_item, key, body) for work_item, (key, body) in zip(work_items, lookups) if body is not None]
+    remaining = [work_item for work_item, (_, body) in zip(work_items, lookups) if body is None]
+    print(f'{len(cached)} of {len(work_items)} work items answered from the result cache')
+    return cached, remaining
+
+
+def cached_exists(cached):
+    return any(COMPACT_HEADER.unpack_from(body)[1] for _, _, body in cached)
+
+
+def save_cached_responses(split_payload: SplitQueryPayload, cached):
+    '''
+    Records the cached responses for the fan in as performQuery would
+    have, returns the work items recorded
+    '''
+    saved = []
+    for (vcf_location, region), key, body in cached:
+        result = VariantResponse(split_payload.query_id)
+        result.responseNumber = get_response_number(get_split_id(split_payload.dataset_id, vcf_location, region))
+        location = get_result_location(key)
+        if location is None or len(body) < INLINE_RESPONSE_BYTES:
+            result.checkS3 = False
+            result.compactResult = body
+        else:
+            # the fan in reads it straight from the cache
+            result.responseLocation = S3Location(bucket=location[0], key=location[1])
+            result.checkS3 = True
+        if result.saveOnce():
+            saved.append([vcf_location, region])
+    return saved
+
+
+def get_work_item_ids(split_payload: SplitQueryPayload, work_items):
+    return [get_split_id(split_payload.dataset_id, vcf_location, region) for vcf_location, region in work_items]
+
+
+def record_fan_out(split_payload: SplitQueryPayload, work_items, count):
+    '''
+    Adds count expected responses for each work item, notifying the fan
+    in if that leaves a counter shard with none outstanding
+    '''
+    if add_fan_out(split_payload.query_id, get_work_item_ids(split_payload, work_items), count):
+        notify(split_payload.completion_channel)
+
+
+def finish_split_query(split_payload: SplitQueryPayload, skipped):
+    # the query counted this split query as one response, now replaced
+    # by those of its work items
+    if add_fan_out(split_payload.query_id, [split_payload.dataset_id], -1):
+        notify(split_payload.completion_channel)
+    if skipped:
+        VariantQuery(split_payload.query_id).update(actions=[
+            VariantQuery.skippedFanOut.set(
+                VariantQuery.skippedFanOut + skipped)
+        ])
+
+
+def is_answered(split_payload: SplitQueryPayload):
+    '''
+    True if another split of the boolean query has already found a hit
+    '''
+    if split_payload.requested_granularity != 'boolean' or not hit_signalled(split_payload.query_id):
+        return False
+    print(f'Query {split_payload.query_id} already answered, skipping')
+    return True
+
+
+def split_query(split_payload: SplitQueryPayload):
+    if is_answered(split_payload):
+        finish_split_query(split_payload, 0)
+        return
+    work_items, skipped = get_work_items(split_payload)
+    cached, work_items = find_cached(split_payload, work_items)
+    payloads = list(get_perform_query_payloads(split_payload, work_items))
+    # counted before publishing, so the fan in never sees a premature 0
+    record_fan_out(split_payload, work_items + [work_item for work_item, _, _ in cached], 1)
+    record_fan_out(split_payload, save_cached_responses(split_payload, cached), -1)
+    if split_payload.requested_granularity == 'boolean' and cached_exists(cached):
+        signal_hit(split_payload.query_id)
+        notify(split_payload.completion_channel)
+    unpublished = perform_queries(payloads)
+    record_fan_out(split_payload, unpublished, -1)
+    finish_split_query(split_payload, skipped)
+
+
+def split_query_sync(split_payload: SplitQueryPayload):
+    if is_answered(split_payload):
+        return []
+    boolean = split_payload.requested_granularity == 'boolean'
+    work_items, _ = get_work_items(split_payload)
+    cached, work_items = find_cached(split_payload, work_items)
+    results = [base64.b64encode(body).decode() for _, _, body in cached]
+    # a cached hit already answers a boolean query
+    if boolean and cached_exists(cached):
+        signal_hit(split_payload.query_id)
+        return results
+    payloads = list(get_perform_query_payloads(split_payload, work_items))
 
-    return list(results_queue.queue)
+    return results + perform_queries_sync(payloads, split_payload.deadline, boolean)
 
 
 def lambda_handler(event, context):
@@ -10,6 +10,7 @@ import boto3
 from smart_open import open as sopen
 
 from apiutils.api_response import bad_request, bundle_response
+from apiutils.request_hash import update_catalogue_version
 from utils.chrom_matching import get_vcf_chromosomes
 from dynamodb.datasets import Dataset as DynamoDataset, VcfChromosomeMap
 from athena.dataset import Dataset
@@ -212,6 +213,8 @@ def submit_dataset(body_dict, method):
         create_dataset(body_dict)
     else:
         update_dataset(body_dict)
+    # cached query responses no longer reflect the catalogue
+    update_catalogue_version()
     
     # if summarise:
     #     summarise_dataset(body_dict['datasetId'])
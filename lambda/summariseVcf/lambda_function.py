@@ -5,7 +5,8 @@ import os
 import boto3
 from botocore.exceptions import ClientError
 
-from index_reader import Csi, Tbi
+from vcfutils.index_reader import Csi, Tbi
+from vcfutils.carrier_store import get_build_windows
 
 COUNTS = [
     'variantCount',
@@ -14,6 +15,7 @@ COUNTS = [
 ]
 
 SUMMARISE_SLICE_SNS_TOPIC_ARN = os.environ['SUMMARISE_SLICE_SNS_TOPIC_ARN']
+PERFORM_QUERY_TOPIC_ARN = os.environ['PERFORM_QUERY_TOPIC_ARN']
 VARIANTS_BUCKET = os.environ['VARIANTS_BUCKET']
 VCF_SUMMARIES_TABLE_NAME = os.environ['DYNAMO_VCF_SUMMARIES_TABLE']
 
@@ -22,6 +24,7 @@ MIN_SS_TIME = 0.1  # minimum time summariseSlice will run (s)
 SS_RATE = 75000000  # Processing speed of summariseSlice (B/s)
 SNS_TIME = 0.02  # Time to publish a message to SNS
 MAX_CONCURRENCY = 1000  # Maximum number of summariseSlice functions to invoke
+CARRIER_WINDOWS_PER_JOB = 16  # Carrier store windows built by one performQuery
 
 
 dynamodb = boto3.client('dynamodb')
@@ -87,8 +90,7 @@ def find_best_split(total_size, epsilon):
     return next_size
 
 
-def get_chunk_boundaries(location):
-    index = get_vcf_index(location)
+def get_chunk_boundaries(index):
     bin_limit = index.bin_limit  # for excluding pseudobins
     return {
         ref_name: sorted(
@@ -229,13 +231,36 @@ def publish_slice_updates(location, slices):
         print('Received Response: {}'.format(json.dumps(response)))
 
 
-def s3_get_object(s3_location, **extra_kwargs):
+def publish_carrier_store_builds(location, index):
+    etag = s3.head_object(**split_location(location))['ETag']
+    windows = get_build_windows(index)
+    for n in range(0, len(windows), CARRIER_WINDOWS_PER_JOB):
+        kwargs = {
+            'TopicArn': PERFORM_QUERY_TOPIC_ARN,
+            'Message': json.dumps({
+                'carrierStore': {
+                    'location': location,
+                    'etag': etag,
+                    'windows': windows[n:n + CARRIER_WINDOWS_PER_JOB],
+                },
+            }),
+        }
+        print('Publishing to SNS: {}'.format(json.dumps(kwargs)))
+        response = sns.publish(**kwargs)
+        print('Received Response: {}'.format(json.dumps(response)))
+
+
+def split_location(s3_location):
     delim_index = s3_location.find('/', 5)
-    bucket = s3_location[5:delim_index]
-    key = s3_location[delim_index + 1:]
+    return {
+        'Bucket': s3_location[5:delim_index],
+        'Key': s3_location[delim_index + 1:],
+    }
+
+
+def s3_get_object(s3_location, **extra_kwargs):
     kwargs = {
-        'Bucket': bucket,
-        'Key': key,
+        **split_location(s3_location),
         **extra_kwargs
     }
     print(f"Calling s3.get_object with kwargs: {json.dumps(kwargs)}")
@@ -251,8 +276,9 @@ def s3_get_object(s3_location, **extra_kwargs):
 
 
 def summarise_vcf(location):
+    index = get_vcf_index(location)
     # dictionary of form {ref: [sorted chunks]}
-    chunk_boundaries = get_chunk_boundaries(location)
+    chunk_boundaries = get_chunk_boundaries(index)
     first_chunk_start = min(boundaries[0] for boundaries in chunk_boundaries.values()) >> 16
     last_chunk_end = (max(boundaries[-1] for boundaries in chunk_boundaries.values()) >> 16) + 2**16
     num_chunks = sum(len(boundaries) for boundaries in chunk_boundaries.values()) - 1
@@ -276,6 +302,8 @@ def summarise_vcf(location):
     # actual content added by summariseSlice
     delete_old_variant_files(location)
     publish_slice_updates(location, slices)
+    # bit packed carrier sets for sample restricted queries
+    publish_carrier_store_builds(location, index)
 
 
 def update_sample_count(location, sample_count):
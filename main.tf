@@ -152,6 +152,7 @@ module "lambda-summariseVcf" {
 
   environment_variables = {
     SUMMARISE_SLICE_SNS_TOPIC_ARN = aws_sns_topic.summariseSlice.arn
+    PERFORM_QUERY_TOPIC_ARN = aws_sns_topic.performQuery.arn
     VARIANTS_BUCKET = aws_s3_bucket.variants-bucket.bucket
     DYNAMO_VCF_SUMMARIES_TABLE = aws_dynamodb_table.vcf_summaries.name
   }
@@ -697,10 +698,15 @@ module "lambda-splitQuery" {
   source_path = "${path.module}/lambda/splitQuery"
   tags = var.common-tags
 
-  environment_variables = {
-    PERFORM_QUERY_LAMBDA = module.lambda-performQuery.lambda_function_name,
-    PERFORM_QUERY_TOPIC_ARN = aws_sns_topic.performQuery.arn
-  }
+  environment_variables = merge(
+    {
+      PERFORM_QUERY_LAMBDA = module.lambda-performQuery.lambda_function_name,
+      PERFORM_QUERY_TOPIC_ARN = aws_sns_topic.performQuery.arn
+      SPLIT_QUERY_BYTES_PER_WORKER = 2097152
+      RESULT_CACHE_BUCKET = aws_s3_bucket.variants-bucket.bucket
+    },
+    local.dynamodb_variables
+  )
 
   layers = [
     local.python_libraries_layer
@@ -733,6 +739,7 @@ module "lambda-performQuery" {
   environment_variables = merge({
       BEACON_API_VERSION = local.api_version
       VARIANTS_BUCKET = aws_s3_bucket.variants-bucket.bucket
+      RESULT_CACHE_BUCKET = aws_s3_bucket.variants-bucket.bucket
     },
     local.sbeacon_variables,
     local.dynamodb_variables)
@@ -26,6 +26,23 @@ resource "aws_s3_bucket_lifecycle_configuration" "variants_bucket_lifecycle" {
     expiration {
       days = 1
     }
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 1
+    }
+  }
+
+  rule {
+    id = "clean-old-cached-results"
+    status = "Enabled"
+
+    filter {
+      prefix = "query-cache/"
+    }
+
+    expiration {
+      days = 1
+    }
   }
 }
 
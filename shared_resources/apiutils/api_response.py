@@ -8,13 +8,17 @@ HEADERS = {"Access-Control-Allow-Origin": "*"}
 BEACON_API_VERSION = os.environ['BEACON_API_VERSION']
 BEACON_ID = os.environ['BEACON_ID']
 METADATA_BUCKET = os.environ['METADATA_BUCKET']
+RESPONSE_CACHE_PREFIX = 'query-responses/'
+# larger responses are not cached, they are cheaper to recompute than
+# to keep
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 4 * 1024 * 1024))
 
 
-def bad_request(*, apiVersion=None, errorMessage=None, filters=[], pagination={}, requestParameters=None, requestedSchemas=None):
+def error_response(status_code, *, apiVersion=None, errorMessage=None, filters=[], pagination={}, requestParameters=None, requestedSchemas=None):
     response = {
         "$schema": "https://json-schema.org/draft/2020-12/schema",
         "error": {
-            "errorCode": 400,
+            "errorCode": status_code,
             "errorMessage": f"{errorMessage}"
         },
         "meta": {
@@ -31,21 +35,51 @@ def bad_request(*, apiVersion=None, errorMessage=None, filters=[], pagination={}
         }
     }
 
-    return bundle_response(400, response)
+    return bundle_response(status_code, response)
+
+
+def bad_request(**kwargs):
+    return error_response(400, **kwargs)
+
+
+def server_error(**kwargs):
+    return error_response(500, **kwargs)
 
 
 def bundle_response(status_code, body, query_id=None):
-    # TODO implement caching
-    # if query_id:
-    #     with sopen(f's3://{METADATA_BUCKET}/query-responses/{query_id}.json', 'w') as s3f:
-    #         json.dump(body, s3f)
+    '''
+    API gateway response with body. Only the g_variants routes, whose
+    answers take a variant search fan out, pass query_id, the body is
+    then cached as its response before it is returned, see
+    dynamodb.variant_queries.get_job_status
+    '''
+    body_json = json.dumps(body)
+    if query_id and status_code == 200:
+        # written before the handler returns, lambda freezes the
+        # environment after that
+        cache_response(query_id, body, body_json)
     return {
         'statusCode': status_code,
         'headers': HEADERS,
-        'body': json.dumps(body),
+        'body': body_json,
     }
 
 
+def cache_response(query_id, body, body_json):
+    # responses cut short by the query deadline are not the answer
+    if body.get('info', {}).get('partial', False):
+        return
+    if len(body_json) > RESPONSE_CACHE_MAX_BYTES:
+        print(f'Not caching response to {query_id} of {len(body_json)} characters')
+        return
+    try:
+        with sopen(f's3://{METADATA_BUCKET}/{RESPONSE_CACHE_PREFIX}{query_id}.json', 'w') as s3f:
+            s3f.write(body_json)
+    except Exception as e:
+        # the next identical request just runs the query again
+        print(f'Could not cache response to {query_id} - {e}')
+
+
 # think of a better way to do the following with python schema validation
 def missing_parameter(*parameters):
     if len(parameters) > 1:
@@ -56,5 +90,6 @@ def missing_parameter(*parameters):
 
 
 def fetch_from_cache(query_id):
-    with sopen(f's3://{METADATA_BUCKET}/query-responses/{query_id}.json') as s3f:
+    with sopen(f's3://{METADATA_BUCKET}/{RESPONSE_CACHE_PREFIX}{query_id}.json') as s3f:
         return json.load(s3f)
+
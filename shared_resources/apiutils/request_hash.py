@@ -1,14 +1,59 @@
 import base64
 import json
 import hashlib
+import os
+import time
+import uuid
+
+import boto3
+from botocore.exceptions import ClientError
+
+
+METADATA_BUCKET = os.environ['METADATA_BUCKET']
+# object rewritten whenever datasets or their metadata change, its etag
+# versions the catalogue
+CATALOGUE_VERSION_KEY = 'catalogue-version'
+# seconds a lambda keeps using the version it last read
+CATALOGUE_VERSION_TTL = int(os.environ.get('CATALOGUE_VERSION_TTL', 30))
+s3 = boto3.client('s3')
+catalogue_version = None
+catalogue_version_read = 0
+
+
+def get_catalogue_version():
+    global catalogue_version, catalogue_version_read
+
+    if catalogue_version is None or time.time() - catalogue_version_read > CATALOGUE_VERSION_TTL:
+        try:
+            catalogue_version = s3.head_object(Bucket=METADATA_BUCKET, Key=CATALOGUE_VERSION_KEY)['ETag']
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                raise
+            # nothing submitted since the version was introduced
+            catalogue_version = ''
+        catalogue_version_read = time.time()
+    return catalogue_version
+
+
+def update_catalogue_version():
+    '''
+    Moves the catalogue to a new version, so responses cached for the
+    previous one are no longer served
+    '''
+    s3.put_object(Bucket=METADATA_BUCKET, Key=CATALOGUE_VERSION_KEY, Body=uuid.uuid4().hex.encode())
 
 
 def hash_query(event):
+    '''
+    Id of the query in event, the same for identical requests against the
+    same version of the dataset catalogue
+    '''
     hash_attr = { 'body', 'httpMethod', 'path', 'pathParameters', 'queryStringParameters' }
     hash_event = { attr: event.get(attr, None) for attr in hash_attr }
-    
+
     if hash_event.get('body'):
         hash_event['body'] = json.loads(hash_event['body'])
+    hash_event['catalogueVersion'] = get_catalogue_version()
     event_str = json.dumps(hash_event, sort_keys=True)
 
-    return hashlib.md5(event_str.encode()).hexdigest()
\ No newline at end of file
+    return hashlib.md5(event_str.encode()).hexdigest()
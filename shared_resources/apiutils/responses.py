@@ -254,3 +254,16 @@ def get_boolean_response(*,
     }
 
 # Helpers end
+
+
+def get_coverage_info(coverage):
+    '''
+    info of a response built from a variant search that stopped at its
+    deadline, flags it as partial along with how much was searched
+    '''
+    if not coverage.get('partial', False):
+        return {}
+    return {
+        'partial': True,
+        'coverage': {key: value for key, value in coverage.items() if key != 'partial'}
+    }
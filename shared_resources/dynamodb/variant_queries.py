@@ -1,19 +1,49 @@
 import os
+import hashlib
+import queue
+import random
+import threading
+import time
+from collections import Counter
 from datetime import datetime, timezone, timedelta
 from enum import Enum
 
 import boto3
+from botocore.exceptions import ClientError
 from pynamodb.models import Model
 from pynamodb.indexes import LocalSecondaryIndex, AllProjection
 from pynamodb.attributes import (
-    UnicodeAttribute, NumberAttribute, MapAttribute, TTLAttribute, BooleanAttribute, UTCDateTimeAttribute
+    UnicodeAttribute, NumberAttribute, MapAttribute, TTLAttribute, BooleanAttribute, UTCDateTimeAttribute,
+    BinaryAttribute
 )
+from pynamodb.connection import Connection
+from pynamodb.exceptions import PutError, TransactWriteError, PynamoDBException
+from pynamodb.transactions import TransactWrite
 
 
 QUERIES_TABLE_NAME = os.environ['DYNAMO_VARIANT_QUERIES_TABLE']
 VARIANT_QUERY_RESPONSES_TABLE_NAME = os.environ['DYNAMO_VARIANT_QUERY_RESPONSES_TABLE']
+# local stand-in for the hitFound signal, used when set
+QUERY_SIGNAL_DIR = os.environ.get('QUERY_SIGNAL_DIR')
+# items the fan in counters of a query are spread over
+FAN_IN_SHARDS = 16
+# response numbers are 64 bit split ids, read back in this many
+# concurrently queried ranges
+RESPONSE_NUMBER_LIMIT = 2 ** 64
+RESPONSE_SEGMENTS = 8
+# responses read ahead of the consumer
+RESPONSE_BUFFER = 64
+# attempts at recording a response before the invocation fails and is
+# retried by lambda
+RECORD_RESPONSE_ATTEMPTS = 10
+# full api responses cached by query id, the bucket lifecycle removes
+# them after two days
+RESPONSE_CACHE_BUCKET = os.environ.get('METADATA_BUCKET')
+RESPONSE_CACHE_PREFIX = 'query-responses/'
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 6 * 3600))
 SESSION = boto3.session.Session()
 REGION = SESSION.region_name
+s3 = boto3.client('s3')
 
 
 def get_current_time_utc():
@@ -32,9 +62,10 @@ class VariantQuery(Model):
         region = REGION
 
     id = UnicodeAttribute(hash_key=True, default='test')
-    responsesCounter = NumberAttribute(default=0)
-    responses = NumberAttribute(default=0)
-    fanOut = NumberAttribute(default=0)
+    # splits never invoked, the vcf index has no records in them
+    skippedFanOut = NumberAttribute(default=0)
+    # set once any split of a boolean query finds a variant
+    hitFound = BooleanAttribute(null=True)
     startTime = UTCDateTimeAttribute(default_for_new=get_current_time_utc())
     endTime = UTCDateTimeAttribute(null=True)
     elapsedTime = NumberAttribute(default_for_new=-1)
@@ -42,21 +73,81 @@ class VariantQuery(Model):
     complete = BooleanAttribute(default_for_new=False)
 
 
-    # atomically increment
-    def getResponseNumber(self):
+# one of the FAN_IN_SHARDS counter items of a query, in the queries table
+# as {query id}#{shard}. Responses still expected and responses recorded
+# are the sums over the shards, so concurrent workers update different
+# items instead of one hot key.
+class VariantQueryShard(Model):
+    class Meta:
+        table_name = QUERIES_TABLE_NAME
+        region = REGION
+
+    id = UnicodeAttribute(hash_key=True)
+    fanOut = NumberAttribute(default=0)
+    responses = NumberAttribute(default=0)
+    timeToExist = TTLAttribute(default_for_new=timedelta(minutes=5))
+
+
+    # atomically add, returns the fanOut of the shard after
+    def addFanOut(self, count):
         self.update(actions=[
-            VariantQuery.responsesCounter.set(VariantQuery.responsesCounter + 1),
+            VariantQueryShard.fanOut.set(VariantQueryShard.fanOut + count),
         ])
-        return self.responsesCounter
+        return self.fanOut
 
 
-    # atomically increment
+    # atomically count a response, returns the fanOut of the shard after
     def markFinished(self):
         self.update(actions=[
-            VariantQuery.responses.set(VariantQuery.responses + 1),
-            VariantQuery.fanOut.set(VariantQuery.fanOut - 1),
-            VariantQuery.endTime.set(get_current_time_utc()),
+            VariantQueryShard.responses.set(VariantQueryShard.responses + 1),
+            VariantQueryShard.fanOut.set(VariantQueryShard.fanOut - 1),
         ])
+        return self.fanOut
+
+
+def get_shard_id(query_id, key):
+    '''
+    Counter shard of a split query, keyed by its dataset id, or of a
+    performQuery work item, keyed by its split id. Every increment and
+    decrement for the same key goes to the same shard, so no shard drops
+    to 0 while its responses are outstanding.
+    '''
+    shard = int(hashlib.md5(key.encode()).hexdigest()[:8], 16) % FAN_IN_SHARDS
+    return f'{query_id}#{shard}'
+
+
+def init_fan_out(query_id, keys):
+    '''
+    Resets the counter shards of a query with one expected response per key
+    '''
+    counts = Counter(get_shard_id(query_id, key) for key in keys)
+    with VariantQueryShard.batch_write() as batch:
+        for shard in range(FAN_IN_SHARDS):
+            shard_id = f'{query_id}#{shard}'
+            batch.save(VariantQueryShard(shard_id, fanOut=counts[shard_id]))
+
+
+def add_fan_out(query_id, keys, count):
+    '''
+    Adds count expected responses per key, True if this left any shard
+    with none outstanding
+    '''
+    emptied = False
+    for shard_id, n in Counter(get_shard_id(query_id, key) for key in keys).items():
+        emptied |= VariantQueryShard(shard_id).addFanOut(n * count) == 0
+    return emptied
+
+
+def get_fan_in(query_id):
+    '''
+    (responses outstanding, responses recorded) of a query
+    '''
+    fan_out = 0
+    responses = 0
+    for shard in VariantQueryShard.batch_get([f'{query_id}#{shard}' for shard in range(FAN_IN_SHARDS)], consistent_read=True):
+        fan_out += shard.fanOut
+        responses += shard.responses
+    return fan_out, responses
 
 
 class VariantResponseIndex(LocalSecondaryIndex):
@@ -82,9 +173,144 @@ class VariantResponse(Model):
     variantResponseIndex = VariantResponseIndex()
     checkS3 = BooleanAttribute()
     result = UnicodeAttribute(null=True)
+    # PerformQueryResponse.dumpb() output
+    compactResult = BinaryAttribute(null=True)
     timeToExist = TTLAttribute(default_for_new=timedelta(hours=24))
 
 
+    # saves the response under the responseNumber of its split, False if a
+    # duplicate delivery or re-invocation already saved it
+    def saveOnce(self):
+        try:
+            self.save(condition=VariantResponse.id.does_not_exist())
+        except PutError as e:
+            if e.cause_response_code == 'ConditionalCheckFailedException':
+                return False
+            raise e
+        return True
+
+
+def get_response_number(split_id):
+    # sort key of the response of a split, the same for duplicates
+    return int(split_id, 16)
+
+
+def record_response(result, shard_id):
+    '''
+    Saves result and counts it against the counter shard shard_id in one
+    transaction, so neither happens without the other. Returns the
+    fanOut of the shard after, or None if a duplicate delivery or
+    re-invocation already recorded the response.
+    '''
+    for attempt in range(RECORD_RESPONSE_ATTEMPTS):
+        try:
+            with TransactWrite(connection=Connection(region=REGION)) as transaction:
+                transaction.save(result, condition=VariantResponse.id.does_not_exist())
+                transaction.update(VariantQueryShard(shard_id), actions=[
+                    VariantQueryShard.responses.set(VariantQueryShard.responses + 1),
+                    VariantQueryShard.fanOut.set(VariantQueryShard.fanOut - 1),
+                ])
+            break
+        except TransactWriteError as e:
+            reasons = e.cancellation_reasons or []
+            # the save is the first item of the transaction
+            if reasons and reasons[0] is not None and reasons[0].code == 'ConditionalCheckFailed':
+                return None
+            if attempt == RECORD_RESPONSE_ATTEMPTS - 1:
+                raise e
+            print(f'Retrying recording response {result.responseNumber} - {e}')
+            time.sleep(random.random())
+    return VariantQueryShard.get(shard_id, consistent_read=True, attributes_to_get=['fanOut']).fanOut
+
+
+def query_responses(query_id):
+    '''
+    Yields the responses of a query as their pages arrive. The range of
+    response numbers is split into RESPONSE_SEGMENTS, each paged through
+    by its own thread. At most RESPONSE_BUFFER items are held before the
+    consumer takes them.
+    '''
+    buffer = queue.Queue(RESPONSE_BUFFER)
+    stop = threading.Event()
+    segment_size = RESPONSE_NUMBER_LIMIT // RESPONSE_SEGMENTS
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read_segment(segment):
+        first = segment * segment_size
+        last = RESPONSE_NUMBER_LIMIT - 1 if segment == RESPONSE_SEGMENTS - 1 else first + segment_size - 1
+        try:
+            for item in VariantResponse.query(
+                query_id,
+                VariantResponse.responseNumber.between(first, last),
+                consistent_read=True
+            ):
+                if not put(item):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        put(None)
+
+    threads = [threading.Thread(target=read_segment, args=(segment,), daemon=True) for segment in range(RESPONSE_SEGMENTS)]
+    for thread in threads:
+        thread.start()
+    try:
+        finished = 0
+        while finished < RESPONSE_SEGMENTS:
+            item = buffer.get()
+            if item is None:
+                finished += 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        # the consumer may stop early, the threads then stop at their
+        # next item
+        stop.set()
+
+
+def signal_hit(query_id):
+    '''
+    Tells the other splits of a boolean query that its answer is known
+    '''
+    if QUERY_SIGNAL_DIR is not None:
+        open(os.path.join(QUERY_SIGNAL_DIR, f'{query_id}.hit'), 'w').close()
+        return
+    # the signal only saves work, the hit itself is already in the
+    # response of the caller
+    try:
+        VariantQuery(query_id).update(actions=[
+            VariantQuery.hitFound.set(True),
+            # the synchronous path never saves the query, expire it anyway
+            VariantQuery.timeToExist.set(get_current_time_utc() + timedelta(minutes=5)),
+        ])
+    except PynamoDBException as e:
+        print(f'Could not signal the hit of {query_id} - {e}')
+
+
+def hit_signalled(query_id):
+    if QUERY_SIGNAL_DIR is not None:
+        return os.path.exists(os.path.join(QUERY_SIGNAL_DIR, f'{query_id}.hit'))
+    try:
+        query = VariantQuery.get(query_id, attributes_to_get=['hitFound'])
+    except VariantQuery.DoesNotExist:
+        return False
+    except PynamoDBException as e:
+        # as if not signalled, the split then just runs to the end
+        print(f'Could not read the hit signal of {query_id} - {e}')
+        return False
+    return bool(query.hitFound)
+
+
 class JobStatus(Enum):
     COMPLETED = 1
     RUNNING = 2
@@ -92,15 +318,23 @@ class JobStatus(Enum):
 
 
 def get_job_status(query_id):
-    # TODO implement caching
-    # try:
-    #     item = VariantQuery.get(query_id)
-    #     if item.complete:
-    #         return JobStatus.COMPLETED
-    #     else:
-    #         return JobStatus.RUNNING
-    # except VariantQuery.DoesNotExist:
-    return JobStatus.NEW
+    '''
+    COMPLETED if a response to query_id younger than RESPONSE_CACHE_TTL
+    was cached by apiutils.api_response.bundle_response, NEW otherwise.
+    Query ids hash the catalogue version, so responses from before a
+    submission are never found.
+    '''
+    if not RESPONSE_CACHE_BUCKET:
+        return JobStatus.NEW
+    try:
+        obj = s3.head_object(Bucket=RESPONSE_CACHE_BUCKET, Key=f'{RESPONSE_CACHE_PREFIX}{query_id}.json')
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+            print(f'Could not look up cached response to {query_id} - {e}')
+        return JobStatus.NEW
+    if get_current_time_utc() - obj['LastModified'] > timedelta(seconds=RESPONSE_CACHE_TTL):
+        return JobStatus.NEW
+    return JobStatus.COMPLETED
 
 
 if __name__ == '__main__':
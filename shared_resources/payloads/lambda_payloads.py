@@ -1,3 +1,5 @@
+import hashlib
+
 import jsons
 
 # TODO
@@ -25,6 +27,10 @@ class SplitQueryPayload(jsons.JsonSerializable):
             requested_granularity,
             variant_min_length,
             variant_max_length,
+            # epoch seconds by which results are returned, None for no limit
+            deadline=None,
+            # where the final completion of an async query is posted
+            completion_channel=None,
         ):
         self.passthrough = passthrough
         self.dataset_id = dataset_id
@@ -42,6 +48,8 @@ class SplitQueryPayload(jsons.JsonSerializable):
         self.requested_granularity = requested_granularity
         self.variant_min_length = variant_min_length
         self.variant_max_length = variant_max_length
+        self.deadline = deadline
+        self.completion_channel = completion_channel
 
 class PerformQueryPayload(jsons.JsonSerializable):
     def __init__(self, *,
@@ -59,7 +67,15 @@ class PerformQueryPayload(jsons.JsonSerializable):
             requested_granularity=None,
             variant_min_length=None,
             variant_max_length=None,
-            vcf_location=None
+            vcf_location=None,
+            # batch mode, list of [vcf_location, region] pairs
+            # each processed as if sent in its own payload
+            work_items=None,
+            # epoch seconds after which the scan stops and returns what it
+            # has found, None for no limit
+            deadline=None,
+            # where the final completion of an async query is posted
+            completion_channel=None
         ):
         self.passthrough = passthrough
         self.dataset_id = dataset_id
@@ -74,4 +90,19 @@ class PerformQueryPayload(jsons.JsonSerializable):
         self.requested_granularity = requested_granularity
         self.variant_min_length = variant_min_length
         self.variant_max_length = variant_max_length
-        self.vcf_location = vcf_location    
+        self.vcf_location = vcf_location
+        self.work_items = work_items
+        self.deadline = deadline
+        self.completion_channel = completion_channel
+
+    def get_split_id(self):
+        '''
+        Identifies the work item, the same for every delivery or
+        re-invocation of it
+        '''
+        return get_split_id(self.dataset_id, self.vcf_location, self.region)
+
+
+def get_split_id(dataset_id, vcf_location, region):
+    key = f'{dataset_id}\t{vcf_location}\t{region}'
+    return hashlib.md5(key.encode()).hexdigest()[:16]
@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+import struct
 import jsons
 
 # TODO
@@ -10,6 +11,35 @@ class SplitQueryResponse:
     sample: any
 
 
+'''
+Compact binary layout of PerformQueryResponse, all integers little endian
+
+    header          COMPACT_HEADER
+    string offsets  uint32[strings + 1], offsets into the string blob
+    variants        uint32[variants] x 5 columns, chrom, pos, ref, alt and
+                    type; all but pos are string ids
+    sample indices  uint32[sample indices]
+    sample names    uint32[sample names], string ids
+    variant chunks  VARIANT_CHUNK[variant chunks]
+    string blob     utf-8 bytes of the shared string table
+
+The string ids of vcf_location and dataset_id are in the header.
+'''
+COMPACT_MAGIC = b'PQR2'
+# magic, exists, partial, all_alleles_count, call_count, vcf_location
+# and dataset_id string ids, strings, variants, sample indices, sample
+# names, variant chunks
+COMPACT_HEADER = struct.Struct('<4sBBxxqqIIIIIII')
+# location string id, first byte, last byte, variants
+VARIANT_CHUNK = struct.Struct('<IqqI')
+VARIANT_COLUMNS = 5
+
+
+def pack_uint32(values):
+    # fixed width whatever the size of a C int on the platform
+    return struct.pack(f'<{len(values)}I', *values)
+
+
 # response sent by PerformQuery lambda
 @dataclass
 class PerformQueryResponse(jsons.JsonSerializable):
@@ -21,4 +51,71 @@ class PerformQueryResponse(jsons.JsonSerializable):
     call_count: int
     sample_indices: list
     sample_names: list
-    
+    # streamed variants, manifest of
+    # {location, first_byte, last_byte, count} chunks
+    variant_chunks: list = field(default_factory=list)
+    # the query deadline passed before the region was fully scanned
+    partial: bool = False
+
+    def dumpb(self):
+        '''
+        Encodes the response in the compact binary layout
+        '''
+        string_ids = dict()
+
+        def string_id(string):
+            if string not in string_ids:
+                string_ids[string] = len(string_ids)
+            return string_ids[string]
+
+        vcf_location_id = string_id(self.vcf_location)
+        dataset_id_id = string_id(self.dataset_id)
+        columns = [[] for _ in range(VARIANT_COLUMNS)]
+
+        # ["Chr1 123 A G SNP"]
+        for variant in self.variants:
+            chrom, pos, ref, alt, variant_type = variant.split('\t')
+            columns[0].append(string_id(chrom))
+            columns[1].append(int(pos))
+            columns[2].append(string_id(ref))
+            columns[3].append(string_id(alt))
+            columns[4].append(string_id(variant_type))
+
+        sample_names = [string_id(name) for name in self.sample_names]
+        variant_chunks = [
+            VARIANT_CHUNK.pack(
+                string_id(chunk['location']),
+                chunk['first_byte'],
+                chunk['last_byte'],
+                chunk['count']
+            )
+            for chunk in self.variant_chunks
+        ]
+        encoded = [string.encode() for string in string_ids]
+        offsets = [0]
+        for string in encoded:
+            offsets.append(offsets[-1] + len(string))
+
+        header = COMPACT_HEADER.pack(
+            COMPACT_MAGIC,
+            self.exists,
+            self.partial,
+            self.all_alleles_count,
+            self.call_count,
+            vcf_location_id,
+            dataset_id_id,
+            len(encoded),
+            len(self.variants),
+            len(self.sample_indices),
+            len(sample_names),
+            len(variant_chunks)
+        )
+        return b''.join([
+            header,
+            pack_uint32(offsets),
+            *(pack_uint32(column) for column in columns),
+            pack_uint32(self.sample_indices),
+            pack_uint32(sample_names),
+            *variant_chunks,
+            *encoded
+        ])
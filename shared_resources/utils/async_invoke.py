@@ -0,0 +1,310 @@
+import asyncio
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from botocore.exceptions import ClientError
+
+
+# point the client at a local fake lambda endpoint for testing
+LAMBDA_ENDPOINT_URL = os.environ.get('LAMBDA_ENDPOINT_URL')
+READ_TIMEOUT = 900  # seconds, longer than any invoked function runs
+# straggler invocations are re-issued once they run longer than this
+# multiple of the percentile of completed invocation latencies
+SPECULATION_PERCENTILE = 90
+SPECULATION_FACTOR = 1.5
+# fraction of invocations, and the least number, completed before
+# latencies are trusted
+SPECULATION_AFTER = 0.5
+SPECULATION_MIN_SAMPLES = 3
+# seconds between straggler checks
+SPECULATION_INTERVAL = 0.1
+# invocations started per second of each function, and the burst
+# allowed above that rate, shared by all queries in this container
+INVOKE_RATE = float(os.environ.get('INVOKE_RATE', 200))
+INVOKE_BURST = float(os.environ.get('INVOKE_BURST', 200))
+# throttled invocations are retried after a random delay of up to
+# THROTTLE_BASE_DELAY * 2 ** retry seconds, capped at THROTTLE_MAX_DELAY
+THROTTLE_RETRIES = 6
+THROTTLE_BASE_DELAY = 0.1
+THROTTLE_MAX_DELAY = 5
+THROTTLE_ERRORS = ('TooManyRequestsException', 'ThrottlingException')
+METRICS_NAMESPACE = 'sBeacon'
+
+
+class InvocationError(Exception):
+    '''
+    Raised once the results of the invocations that succeeded have been
+    yielded, if any payload failed or stayed throttled
+    '''
+    def __init__(self, function_name, failures):
+        self.function_name = function_name
+        self.failures = failures
+        super().__init__(f'{len(failures)} {function_name} invocations failed - {next(iter(failures.values()))}')
+
+
+class TokenBucket:
+    '''
+    Limits the rate invocations of one function are started at. Holds no
+    event loop primitives, so it is shared across the loops of
+    successive queries.
+    '''
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def throttled(self):
+        # lambda is over its concurrency, hold back the other callers too
+        self.refill()
+        self.tokens = min(self.tokens, 0)
+
+
+# function name: TokenBucket
+buckets = dict()
+
+
+def get_bucket(function_name):
+    if function_name not in buckets:
+        buckets[function_name] = TokenBucket(INVOKE_RATE, INVOKE_BURST)
+    return buckets[function_name]
+
+
+class InvokeMetrics:
+    '''
+    Queued, in flight and throttled invocations of one call to
+    invoke_as_completed, logged in CloudWatch embedded metric format
+    '''
+    def __init__(self, function_name):
+        self.function_name = function_name
+        self.queued = 0
+        self.in_flight = 0
+        self.max_queued = 0
+        self.max_in_flight = 0
+        self.invocations = 0
+        self.throttled = 0
+        self.failed = 0
+
+    @contextmanager
+    def queue(self):
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        try:
+            yield
+        finally:
+            self.queued -= 1
+
+    @contextmanager
+    def invocation(self):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.invocations += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    def log(self):
+        metrics = {
+            'QueuedInvocations': self.max_queued,
+            'InFlightInvocations': self.max_in_flight,
+            'Invocations': self.invocations,
+            'ThrottledInvocations': self.throttled,
+            'FailedInvocations': self.failed,
+        }
+        print(json.dumps({
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [['FunctionName']],
+                    'Metrics': [{'Name': name, 'Unit': 'Count'} for name in metrics],
+                }],
+            },
+            'FunctionName': self.function_name,
+            **metrics,
+        }))
+
+
+def is_throttle(error):
+    return error.response.get('Error', {}).get('Code') in THROTTLE_ERRORS
+
+
+async def invoke(client, function_name, payload):
+    response = await client.invoke(
+        FunctionName=function_name,
+        InvocationType='RequestResponse',
+        Payload=payload,
+    )
+    async with response['Payload'] as stream:
+        body = await stream.read()
+    if 'FunctionError' in response:
+        raise RuntimeError(body.decode())
+    return json.loads(body)
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[(len(ordered) - 1) * percent // 100]
+
+
+async def invoke_as_completed(function_name, payloads, concurrency, speculate=False, deadline=None):
+    '''
+    Invokes function_name once per json payload, at most concurrency
+    invocations at a time on one connection pool of the same size, and
+    yields (payload index, decoded result) in completion order.
+    Invocations are started no faster than the token bucket of the
+    function allows, and throttled ones are retried with jittered
+    backoff. Once the results are all yielded, InvocationError is raised
+    if any payload failed. Invocations still running are cancelled if
+    the consumer stops early, or once deadline, in epoch seconds, passes.
+
+    With speculate, an invocation running well past the latency of the
+    completed ones is issued a second time. Whichever copy returns first
+    is yielded and the other is cancelled, so each payload yields at most
+    one result.
+    '''
+    config = AioConfig(
+        max_pool_connections=concurrency,
+        read_timeout=READ_TIMEOUT,
+        # throttles are retried here, against the shared token bucket
+        retries={'mode': 'standard', 'total_max_attempts': 1},
+    )
+    session = get_session()
+    async with session.create_client('lambda', endpoint_url=LAMBDA_ENDPOINT_URL, config=config) as client:
+        semaphore = asyncio.Semaphore(concurrency)
+        bucket = get_bucket(function_name)
+        metrics = InvokeMetrics(function_name)
+        # task: payload index, for the attempts still running
+        running = dict()
+        # task: time its current attempt started, while one is running
+        started = dict()
+        attempts = [0] * len(payloads)
+        latencies = []
+        cancelled = []
+        # payload index: error, for payloads with no successful attempt
+        failures = dict()
+
+        async def timed_invoke(n):
+            task = asyncio.current_task()
+            for retry in range(THROTTLE_RETRIES + 1):
+                with metrics.queue():
+                    await semaphore.acquire()
+                try:
+                    with metrics.queue():
+                        await bucket.acquire()
+                    started[task] = time.monotonic()
+                    with metrics.invocation():
+                        return await invoke(client, function_name, payloads[n])
+                except ClientError as e:
+                    if not is_throttle(e) or retry == THROTTLE_RETRIES:
+                        raise
+                    # backing off is not straggling
+                    del started[task]
+                    metrics.throttled += 1
+                    bucket.throttled()
+                finally:
+                    semaphore.release()
+                with metrics.queue():
+                    await asyncio.sleep(random.uniform(0, min(THROTTLE_MAX_DELAY, THROTTLE_BASE_DELAY * 2 ** retry)))
+
+        def launch(n):
+            running[asyncio.ensure_future(timed_invoke(n))] = n
+            attempts[n] += 1
+
+        for n in range(len(payloads)):
+            launch(n)
+        min_samples = max(SPECULATION_MIN_SAMPLES, int(len(payloads) * SPECULATION_AFTER))
+
+        try:
+            while running:
+                timeout = SPECULATION_INTERVAL if speculate else None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        print(f'Deadline passed with {len(running)} {function_name} invocations running')
+                        break
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                done, _ = await asyncio.wait(
+                    running,
+                    timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task not in running:
+                        # the other copy finished in the same wait
+                        continue
+                    n = running.pop(task)
+                    others = [other for other, m in running.items() if m == n]
+                    error = task.exception()
+                    if error is not None:
+                        if not others:
+                            # no copy left that may succeed
+                            print(f'{function_name} failed for payload {n} - {error}')
+                            metrics.failed += 1
+                            failures[n] = error
+                        continue
+                    latencies.append(time.monotonic() - started[task])
+                    for other in others:
+                        other.cancel()
+                        del running[other]
+                        cancelled.append(other)
+                    yield n, task.result()
+
+                if not speculate or len(latencies) < min_samples:
+                    continue
+                threshold = percentile(latencies, SPECULATION_PERCENTILE) * SPECULATION_FACTOR
+                now = time.monotonic()
+                for task, n in list(running.items()):
+                    if attempts[n] == 1 and task in started and now - started[task] > threshold:
+                        print(f'Re-invoking {function_name} for payload {n}, running {now - started[task]:.1f}s against a threshold of {threshold:.1f}s')
+                        launch(n)
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, *cancelled, return_exceptions=True)
+            metrics.log()
+        if failures:
+            raise InvocationError(function_name, failures)
+
+
+def iterate_async(async_iterator):
+    '''
+    Drives an async iterator from synchronous code, yielding each item as
+    soon as it is ready
+    '''
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(async_iterator.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(async_iterator.aclose())
+        loop.close()
+
+
+def invoke_all(function_name, payloads, concurrency, speculate=False, deadline=None):
+    '''
+    Synchronous generator over invoke_as_completed
+    '''
+    return iterate_async(invoke_as_completed(function_name, payloads, concurrency, speculate, deadline))
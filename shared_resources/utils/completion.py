@@ -0,0 +1,99 @@
+import os
+import re
+import threading
+import time
+from uuid import uuid4
+
+import boto3
+from botocore.exceptions import ClientError
+
+
+# in process stand-in for the queues, used when set
+LOCAL_COMPLETION_CHANNELS = os.environ.get('LOCAL_COMPLETION_CHANNELS')
+QUEUE_PREFIX = 'sbeacon-query-'
+# longest long poll sqs allows, seconds
+MAX_WAIT = 20
+
+sqs = boto3.client('sqs')
+# channel: threading.Event of the in process stand-in
+local_channels = dict()
+
+
+def open_channel(query_id):
+    '''
+    Creates the channel the final completion of a query is posted to.
+    Returns its id to pass on in the payloads, or None if it could not
+    be created and the caller has to poll. Every run gets its own
+    channel, identical queries may run at once and sqs won't reuse the
+    name of a deleted queue for 60 seconds.
+    '''
+    run_id = f'{query_id}-{uuid4().hex[:12]}'
+    if LOCAL_COMPLETION_CHANNELS:
+        channel = f'local:{run_id}'
+        local_channels[channel] = threading.Event()
+        return channel
+    # the run suffix is kept when long query ids are cut
+    name = QUEUE_PREFIX + re.sub('[^A-Za-z0-9_-]', '_', run_id)[-(80 - len(QUEUE_PREFIX)):]
+    try:
+        return sqs.create_queue(
+            QueueName=name,
+            Attributes={'MessageRetentionPeriod': '60'}
+        )['QueueUrl']
+    except ClientError as e:
+        print(f'Polling without a completion channel - {e}')
+        return None
+
+
+def notify(channel):
+    if channel is None:
+        return
+    if channel.startswith('local:'):
+        event = local_channels.get(channel)
+        # a channel of another process, its query polls instead
+        if event is not None:
+            event.set()
+        return
+    try:
+        sqs.send_message(QueueUrl=channel, MessageBody='complete')
+    except ClientError as e:
+        # the query falls back to polling
+        print(f'Could not notify {channel} - {e}')
+
+
+def wait(channel, timeout):
+    '''
+    Waits up to timeout seconds for a notification, True if one arrived
+    '''
+    if channel.startswith('local:'):
+        event = local_channels[channel]
+        notified = event.wait(timeout)
+        event.clear()
+        return notified
+    try:
+        response = sqs.receive_message(
+            QueueUrl=channel,
+            MaxNumberOfMessages=10,
+            # whole seconds only, a notification ends the wait early anyway
+            WaitTimeSeconds=min(max(round(timeout), 1), MAX_WAIT)
+        )
+        messages = response.get('Messages', [])
+        for message in messages:
+            sqs.delete_message(QueueUrl=channel, ReceiptHandle=message['ReceiptHandle'])
+    except ClientError as e:
+        # same as polling without a channel
+        print(f'Could not wait on {channel} - {e}')
+        time.sleep(timeout)
+        return False
+    return len(messages) > 0
+
+
+def close_channel(channel):
+    if channel is None:
+        return
+    if channel.startswith('local:'):
+        local_channels.pop(channel, None)
+        return
+    try:
+        sqs.delete_queue(QueueUrl=channel)
+    except ClientError as e:
+        print(f'Could not delete {channel} - {e}')
@@ -0,0 +1,92 @@
+import concurrent.futures
+import random
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+
+# PublishBatch limits
+MAX_BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 256 * 1024
+# concurrent PublishBatch calls
+MAX_CONCURRENCY = 8
+MAX_ATTEMPTS = 5
+
+sns = boto3.client('sns')
+
+
+def pack_batches(messages):
+    '''
+    Groups (n, message) pairs into batches within the entry count and
+    total size limits of PublishBatch
+    '''
+    batches = []
+    batch = []
+    batch_bytes = 0
+    for message in messages:
+        size = len(message[1].encode())
+        if batch and (len(batch) == MAX_BATCH_ENTRIES or batch_bytes + size > MAX_BATCH_BYTES):
+            batches.append(batch)
+            batch = []
+            batch_bytes = 0
+        batch.append(message)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def publish_messages(topic_arn, messages):
+    '''
+    Publishes one batch of (n, message) pairs, retrying entries that fail
+    for reasons other than the message itself. Returns the n of the
+    messages not published.
+    '''
+    entries = {str(n): message for n, message in messages}
+    dropped = []
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            # jittered exponential backoff
+            time.sleep(random.random() * 2 ** attempt * 0.05)
+        try:
+            response = sns.publish_batch(
+                TopicArn=topic_arn,
+                PublishBatchRequestEntries=[
+                    {'Id': entry_id, 'Message': message}
+                    for entry_id, message in entries.items()
+                ]
+            )
+        except ClientError as e:
+            print(f'Retrying PublishBatch - {e}')
+            continue
+        retry = dict()
+        for failure in response.get('Failed', []):
+            if failure['SenderFault']:
+                print(f"Dropping message - {failure['Code']}: {failure.get('Message')}")
+                dropped.append(int(failure['Id']))
+            else:
+                retry[failure['Id']] = entries[failure['Id']]
+        entries = retry
+        if not entries:
+            break
+    else:
+        print(f'Failed to publish {len(entries)} messages to {topic_arn}')
+    return dropped + [int(entry_id) for entry_id in entries]
+
+
+def publish_batch(topic_arn, messages):
+    '''
+    Publishes messages to an SNS topic with PublishBatch, up to
+    MAX_CONCURRENCY calls at a time. Returns the indexes of the messages
+    that could not be published.
+    '''
+    batches = pack_batches(list(enumerate(messages)))
+    with concurrent.futures.ThreadPoolExecutor(MAX_CONCURRENCY) as pool:
+        unpublished = sorted(
+            n
+            for failed in pool.map(lambda batch: publish_messages(topic_arn, batch), batches)
+            for n in failed
+        )
+    print(f'Published {len(messages) - len(unpublished)} messages in {len(batches)} batches')
+    return unpublished
@@ -0,0 +1,90 @@
+import base64
+import bisect
+import hashlib
+
+import apiutils.entries as entries
+import apiutils.responses as responses
+
+
+# bytes of the digests variant internal ids are deduplicated by
+DIGEST_SIZE = 8
+
+
+class VariantAggregator:
+    '''
+    Merges performQuery responses into the distinct variants of a query
+    as they arrive. Variants are deduplicated by internal id, kept as
+    DIGEST_SIZE byte digests, and paged in (chrom, pos, ref, alt) order,
+    so the page from skip to skip + limit is the same whatever order the
+    responses arrive in. Only the first skip + limit variants of that
+    order are held.
+
+    Responses arrive in no particular order, so a page is only fixed once
+    all of them are read. Only a boolean query is answered early, on its
+    first hit, complete is then False.
+    '''
+    def __init__(self, assembly_id, *, skip=0, limit=None, with_variants=True, boolean=False):
+        self.assembly_id = assembly_id
+        self.skip = skip
+        self.end = None if limit is None else skip + limit
+        self.with_variants = with_variants
+        self.boolean = boolean
+        self.exists = False
+        self.count = 0
+        # sorted ((chrom, pos, ref, alt), type) of the first variants
+        self.ordered = []
+        self.seen = set()
+        self.complete = True
+
+    @property
+    def answered(self):
+        return self.boolean and self.exists
+
+    @property
+    def results(self):
+        return [
+            entries.get_variant_entry(
+                base64.b64encode(f'{self.assembly_id}\t{chrom}\t{pos}\t{ref}\t{alt}'.encode()).decode(),
+                self.assembly_id, ref, alt, pos, pos + len(alt), typ)
+            for (chrom, pos, ref, alt), typ in self.ordered[self.skip:self.end]
+        ]
+
+    def add(self, query_response):
+        self.exists = self.exists or query_response.exists
+        if not self.with_variants:
+            return
+
+        for variant in query_response.variants:
+            chrom, pos, ref, alt, typ = variant.split('\t')
+            internal_id = f'{self.assembly_id}\t{chrom}\t{pos}\t{ref}\t{alt}'
+            digest = int.from_bytes(hashlib.blake2b(internal_id.encode(), digest_size=DIGEST_SIZE).digest(), 'little')
+
+            if digest in self.seen:
+                continue
+            self.seen.add(digest)
+            self.count += 1
+            entry = ((chrom, int(pos), ref, alt), typ)
+            if self.end is None or len(self.ordered) < self.end:
+                bisect.insort(self.ordered, entry)
+            elif entry[0] < self.ordered[-1][0]:
+                bisect.insort(self.ordered, entry)
+                self.ordered.pop()
+
+    def consume(self, query_responses):
+        '''
+        Adds the responses of a variant search until the query is
+        answered, closing the search if it is stopped early
+        '''
+        query_responses = iter(query_responses)
+        for query_response in query_responses:
+            self.add(query_response)
+            if self.answered:
+                self.complete = False
+                # cancels the invocations of a search still running
+                if hasattr(query_responses, 'close'):
+                    query_responses.close()
+                break
+        return self
+
+    def get_info(self, coverage):
+        return responses.get_coverage_info(coverage)
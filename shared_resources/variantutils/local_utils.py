@@ -1,44 +1,28 @@
 import os
 import jsons
-import json
-import queue
-
-import boto3
 
 from payloads.lambda_payloads import SplitQueryPayload
+from utils.sns_batch import publish_batch
+from utils.async_invoke import invoke_all
 
 
-SPLIT_SIZE = 10000
 SPLIT_QUERY = os.environ['SPLIT_QUERY_LAMBDA']
 SPLIT_QUERY_TOPIC_ARN = os.environ['SPLIT_QUERY_TOPIC_ARN']
+# concurrent synchronous splitQuery invocations
+SPLIT_QUERY_CONCURRENCY = 100
 
-aws_lambda = boto3.client('lambda')
-sns = boto3.client('sns')
-
-
-def get_split_query_fan_out(start_min, start_max):
-    fan_out = 0
-    split_start = start_min
-    while split_start <= start_max:
-        fan_out += 1
-        split_start += SPLIT_SIZE
-    return fan_out
-
-
-def split_query(payload: SplitQueryPayload):
-    kwargs = {
-        'TopicArn': SPLIT_QUERY_TOPIC_ARN,
-        'Message': jsons.dumps(payload)
-    }
-
-    sns.publish(**kwargs)
 
+def split_queries(payloads):
+    '''
+    Publishes the split query payloads, returns the indexes of those that
+    could not be published
+    '''
+    return publish_batch(SPLIT_QUERY_TOPIC_ARN, [jsons.dumps(payload) for payload in payloads])
 
-def split_query_sync(payload: SplitQueryPayload, results_queue: queue.Queue):
-    response = aws_lambda.invoke(
-        FunctionName=SPLIT_QUERY,
-        InvocationType='RequestResponse',
-        Payload=jsons.dumps(payload),
-    )
 
-    results_queue.put(json.loads(response['Payload'].read()))
+def split_queries_sync(payloads, deadline=None):
+    '''
+    Invokes splitQuery for each payload, yields (payload index, list of
+    results) as they complete, until the deadline
+    '''
+    return invoke_all(SPLIT_QUERY, [jsons.dumps(payload) for payload in payloads], SPLIT_QUERY_CONCURRENCY, deadline=deadline)
@@ -0,0 +1,124 @@
+import concurrent.futures
+
+from botocore.exceptions import ClientError
+
+from utils.chrom_matching import get_matching_chromosome
+from payloads.lambda_responses import PerformQueryResponse
+from vcfutils.cache import fetch, get_index
+from vcfutils.region_reader import query_region, get_sample_names
+from vcfutils.genotypes import decode_genotypes, carrier_indices, count_record
+
+
+THREADS = 32
+
+
+def query_vcf(dataset_id, location, chrom, pos, reference_bases, alternate_bases, sample_names, include_samples):
+    '''
+    Looks up one variant in one vcf, reading only the bgzf blocks the
+    index gives for the position
+    '''
+    index = get_index(location)
+    sample_columns = None
+    all_sample_names = []
+
+    if include_samples or sample_names:
+        header_samples = get_sample_names(location, fetch)
+        if sample_names:
+            positions = {sample: n for n, sample in enumerate(header_samples)}
+            sample_columns = [positions[sample] for sample in sample_names if sample in positions]
+            all_sample_names = [header_samples[n] for n in sample_columns]
+        else:
+            all_sample_names = header_samples
+
+    records = query_region(
+        location,
+        f'{chrom}:{pos}-{pos}',
+        index=index,
+        sample_columns=sample_columns,
+        include=lambda record_pos, reference, all_alts: record_pos == pos and reference.upper() == reference_bases,
+        fetch=fetch
+    )
+    variants = []
+    call_count = 0
+    all_alleles_count = 0
+    sample_indices = set()
+
+    for (record_pos, reference, all_alts, info_str, genotypes) in records:
+        alts = all_alts.split(',')
+        hit_indexes = [i for i, alt in enumerate(alts) if alt.upper() == alternate_bases]
+        if not hit_indexes:
+            continue
+        hit_alleles = [i + 1 for i in hit_indexes]
+        # the rule of the performQuery engine the fan out would use, INFO
+        # counts unless samples are selected
+        variant_type, called_indexes, record_calls, record_alleles, gt_matrix = count_record(
+            info_str, genotypes, hit_indexes, use_info=sample_columns is None)
+        all_alleles_count += record_alleles
+
+        if record_calls:
+            call_count += record_calls
+            # ["Chr1 123 A G SNP"]
+            variants.extend(f'{chrom}\t{record_pos}\t{reference}\t{alts[i]}\t{variant_type}' for i in called_indexes)
+            if include_samples:
+                if gt_matrix is None:
+                    gt_matrix = decode_genotypes(genotypes)
+                sample_indices.update(carrier_indices(gt_matrix, hit_alleles))
+
+    return PerformQueryResponse(
+        exists = call_count > 0,
+        dataset_id = dataset_id,
+        vcf_location = location,
+        all_alleles_count = all_alleles_count,
+        variants = variants,
+        call_count = call_count,
+        sample_indices = sorted(sample_indices),
+        sample_names = [all_sample_names[n] for n in sorted(sample_indices)]
+    )
+
+
+def perform_point_query(*,
+        datasets,
+        referenceName,
+        referenceBases,
+        alternateBases,
+        pos,
+        includeSamples=False,
+        dataset_samples=[]
+):
+    '''
+    Answers an exact (chrom, pos, ref, alt) lookup in process, without the
+    splitQuery/performQuery fan out. pos is 1-based. Returns None when a
+    vcf can't be read this way, the caller should then use
+    perform_variant_search_sync.
+    '''
+    vcf_queries = []
+    for n, dataset in enumerate(datasets):
+        sample_names = dataset_samples[n] if len(dataset_samples) == len(datasets) else []
+        for vcfm in dataset._vcfChromosomeMap:
+            chrom = get_matching_chromosome(vcfm['chromosomes'], referenceName)
+            if not chrom or vcfm['vcf'] not in dataset._vcfLocations:
+                continue
+            if not vcfm['vcf'].startswith('s3://'):
+                return None
+            vcf_queries.append((dataset.id, vcfm['vcf'], chrom, sample_names))
+
+    with concurrent.futures.ThreadPoolExecutor(THREADS) as pool:
+        futures = [
+            pool.submit(
+                query_vcf,
+                dataset_id,
+                location,
+                chrom,
+                pos,
+                referenceBases.upper(),
+                alternateBases.upper(),
+                sample_names,
+                includeSamples
+            )
+            for dataset_id, location, chrom, sample_names in vcf_queries
+        ]
+        try:
+            return [future.result() for future in futures]
+        except (ValueError, ClientError) as e:
+            print(f'Point query not possible - {e}')
+            return None
@@ -1,29 +1,271 @@
-import concurrent.futures
+import collections.abc
 import jsons
 import time
 import copy
-import queue
-import botocore
+import base64
+import struct
+import sys
+from array import array
+from collections import deque
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
 
 import boto3
 
-from .local_utils import split_query, split_query_sync, get_split_query_fan_out
+from .local_utils import split_queries, split_queries_sync
+from utils.completion import open_channel, wait, close_channel
 from utils.chrom_matching import get_matching_chromosome
-from dynamodb.variant_queries import VariantQuery, VariantResponse
+from dynamodb.variant_queries import VariantQuery, init_fan_out, add_fan_out, get_fan_in, query_responses
 from payloads.lambda_payloads import SplitQueryPayload
-from payloads.lambda_responses import PerformQueryResponse
-
-client_config = botocore.config.Config(
-    max_pool_connections=100,
-)
+from payloads.lambda_responses import PerformQueryResponse, COMPACT_MAGIC, COMPACT_HEADER, VARIANT_CHUNK, VARIANT_COLUMNS
 
 REQUEST_TIMEOUT = 600  # seconds
-THREADS = 500
+# seconds between polls of the query record when no completion arrives,
+# doubling up to MAX_POLL_INTERVAL
+POLL_INTERVAL = 0.5
+MAX_POLL_INTERVAL = 8
+# seconds, default and upper bound of a synchronous query's time budget,
+# inside the 29 s API Gateway integration timeout
+QUERY_TIMEOUT = 25
+# concurrent downloads of responses spilled to s3, and the bytes of
+# downloaded responses held before the consumer catches up
+PREFETCH_CONCURRENCY = 16
+PREFETCH_MAX_BYTES = 128 * 1024 * 1024
 
-aws_lambda = boto3.client('lambda', config=client_config)
 s3 = boto3.client('s3')
 
 
+def uint32_view(buffer, offset, count):
+    # a view only where a C unsigned int is the little endian uint32 of
+    # the layout
+    if sys.byteorder == 'little' and array('I').itemsize == 4:
+        return buffer[offset:offset + 4 * count].cast('I')
+    return struct.unpack_from(f'<{count}I', buffer, offset)
+
+
+class CompactStrings(collections.abc.Sequence):
+    '''
+    String table of a compact response, strings are decoded on access
+    '''
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, n):
+        return str(self.blob[self.offsets[n]:self.offsets[n + 1]], 'utf-8')
+
+
+class CompactVariants(collections.abc.Sequence):
+    '''
+    Variant strings of a compact response, built from the columns on access
+    '''
+    def __init__(self, strings, columns):
+        self.strings = strings
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns[1])
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self[i] for i in range(*n.indices(len(self)))]
+        chrom, pos, ref, alt, variant_type = self.columns
+        strings = self.strings
+        # ["Chr1 123 A G SNP"]
+        return f'{strings[chrom[n]]}\t{pos[n]}\t{strings[ref[n]]}\t{strings[alt[n]]}\t{strings[variant_type[n]]}'
+
+
+class CompactSampleNames(collections.abc.Sequence):
+    def __init__(self, strings, ids):
+        self.strings = strings
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self[i] for i in range(*n.indices(len(self)))]
+        return self.strings[self.ids[n]]
+
+
+def read_chunk(chunk):
+    if chunk['location'].startswith('s3://'):
+        delim_index = chunk['location'].find('/', 5)
+        obj = s3.get_object(
+            Bucket=chunk['location'][5:delim_index],
+            Key=chunk['location'][delim_index + 1:],
+            Range=f"bytes={chunk['first_byte']}-{chunk['last_byte']}"
+        )
+        return obj['Body'].read()
+    # local stand-in
+    with open(chunk['location'], 'rb') as chunk_file:
+        chunk_file.seek(chunk['first_byte'])
+        return chunk_file.read(chunk['last_byte'] - chunk['first_byte'] + 1)
+
+
+class ChunkedVariants(collections.abc.Iterable):
+    '''
+    Variant strings streamed by performQuery. Chunks are fetched one at a
+    time on every iteration, so only one chunk is held in memory.
+    '''
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __len__(self):
+        return sum(chunk['count'] for chunk in self.chunks)
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yield from load_compact_response(read_chunk(chunk)).variants
+
+
+def load_compact_response(data):
+    '''
+    Decodes PerformQueryResponse.dumpb() output. Columns are views over
+    data, nothing is copied until a variant or name is read.
+    '''
+    buffer = memoryview(data)
+    (
+        magic,
+        exists,
+        partial,
+        all_alleles_count,
+        call_count,
+        vcf_location_id,
+        dataset_id_id,
+        n_strings,
+        n_variants,
+        n_sample_indices,
+        n_sample_names,
+        n_variant_chunks
+    ) = COMPACT_HEADER.unpack_from(buffer)
+    if magic != COMPACT_MAGIC:
+        raise ValueError('Not a compact PerformQueryResponse')
+    offset = COMPACT_HEADER.size
+    offsets = uint32_view(buffer, offset, n_strings + 1)
+    offset += 4 * (n_strings + 1)
+    columns = []
+    for _ in range(VARIANT_COLUMNS):
+        columns.append(uint32_view(buffer, offset, n_variants))
+        offset += 4 * n_variants
+    sample_indices = uint32_view(buffer, offset, n_sample_indices)
+    offset += 4 * n_sample_indices
+    sample_names = uint32_view(buffer, offset, n_sample_names)
+    offset += 4 * n_sample_names
+    variant_chunks = list(VARIANT_CHUNK.iter_unpack(buffer[offset:offset + VARIANT_CHUNK.size * n_variant_chunks]))
+    offset += VARIANT_CHUNK.size * n_variant_chunks
+    strings = CompactStrings(buffer[offset:], offsets)
+    variant_chunks = [
+        {
+            'location': strings[location],
+            'first_byte': first_byte,
+            'last_byte': last_byte,
+            'count': count,
+        }
+        for location, first_byte, last_byte, count in variant_chunks
+    ]
+    variants = CompactVariants(strings, columns)
+
+    return PerformQueryResponse(
+        exists=bool(exists),
+        vcf_location=strings[vcf_location_id],
+        dataset_id=strings[dataset_id_id],
+        all_alleles_count=all_alleles_count,
+        variants=ChunkedVariants(variant_chunks) if variant_chunks else variants,
+        call_count=call_count,
+        sample_indices=sample_indices,
+        sample_names=CompactSampleNames(strings, sample_names),
+        variant_chunks=variant_chunks,
+        partial=bool(partial)
+    )
+
+
+def load_response(result):
+    '''
+    PerformQueryResponse from a synchronous performQuery result, either a
+    base64 compact response or a json object
+    '''
+    if isinstance(result, str):
+        return load_compact_response(base64.b64decode(result))
+    return jsons.load(result, PerformQueryResponse)
+
+
+def fetch_response(var_response):
+    '''
+    Decodes a saved response, downloading it first if it was spilled to
+    s3. Returns its size in bytes and the PerformQueryResponse.
+    '''
+    if var_response.checkS3:
+        location = var_response.responseLocation
+        body = s3.get_object(
+            Bucket=location.bucket,
+            Key=location.key,
+        )['Body'].read()
+        if location.key.endswith('.bin'):
+            return len(body), load_compact_response(body)
+        return len(body), jsons.loads(body, PerformQueryResponse)
+    if var_response.compactResult is not None:
+        return len(var_response.compactResult), load_compact_response(var_response.compactResult)
+    return len(var_response.result), jsons.loads(var_response.result, PerformQueryResponse)
+
+
+def prefetch_responses(var_responses):
+    '''
+    Yields the decoded var_responses in the order they become ready,
+    downloading PREFETCH_CONCURRENCY spilled ones at a time. No more are
+    started while those ready but not yet consumed hold
+    PREFETCH_MAX_BYTES or more. The var_responses generator is closed
+    along with this one.
+    '''
+    executor = ThreadPoolExecutor(PREFETCH_CONCURRENCY)
+    pending = set()
+    # (size, response) decoded and waiting to be consumed
+    ready = deque()
+    buffered = 0
+    exhausted = False
+
+    try:
+        while True:
+            for future in [future for future in pending if future.done()]:
+                pending.remove(future)
+                size, response = future.result()
+                buffered += size
+                ready.append((size, response))
+            while not exhausted and len(pending) < PREFETCH_CONCURRENCY and buffered < PREFETCH_MAX_BYTES:
+                var_response = next(var_responses, None)
+                if var_response is None:
+                    exhausted = True
+                else:
+                    pending.add(executor.submit(fetch_response, var_response))
+            if ready:
+                size, response = ready.popleft()
+                buffered -= size
+                yield response
+            elif pending:
+                futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            else:
+                return
+    finally:
+        # the consumer may stop early, as a boolean query does
+        executor.shutdown(wait=False, cancel_futures=True)
+        var_responses.close()
+
+
+def get_deadline(timeout, max_timeout):
+    '''
+    Epoch seconds deadline of a query given the timeout in seconds asked
+    for by the user, if any
+    '''
+    if timeout is None:
+        timeout = max_timeout
+    return time.time() + min(float(timeout), max_timeout)
+
+
 def perform_variant_search(*,
         datasets,
         referenceName,
@@ -38,8 +280,16 @@ def perform_variant_search(*,
         includeResultsetResponses,
         query_id='TEST',
         passthrough=dict(),
-        dataset_samples=[]
+        dataset_samples=[],
+        timeout=None,
+        coverage=None
 ):
+    '''
+    Fans the search out over SNS and waits for the responses recorded in
+    dynamodb until the deadline. coverage, if given, is filled with the
+    number of splits responded and outstanding, and partial is set when
+    the deadline passed first.
+    '''
     try:
         # get vcf file and the name of chromosome in it eg: "chr1", "Chr4", "CHR1" or just "1"
         vcf_chromosomes = {vcfm['vcf']: get_matching_chromosome(
@@ -62,6 +312,11 @@ def perform_variant_search(*,
         print('Error occured ', e)
         return False, []
 
+    deadline = get_deadline(timeout, REQUEST_TIMEOUT)
+    if coverage is None:
+        coverage = dict()
+    coverage['partial'] = False
+
     start_min += 1
     start_max += 1
     end_min += 1
@@ -70,11 +325,11 @@ def perform_variant_search(*,
     # record the query event on DB
     query_record = VariantQuery(query_id)
     query_record.save()
-    split_query_fan_out = get_split_query_fan_out(start_min, start_max)
-    perform_query_fan_out = 0
+    # the last response posts here, so the fan in need not poll
+    channel = open_channel(query_id)
+    split_payloads = []
 
     print('Start event publishing')
-    pool = concurrent.futures.ThreadPoolExecutor(THREADS)
 
     # parallelism across datasets
     for n, dataset in enumerate(datasets):
@@ -91,9 +346,6 @@ def perform_variant_search(*,
             event_passthrough['sampleNames'] = dataset_samples[n]
             event_passthrough['selectedSamplesOnly'] = True
 
-        # record perform query fan out size
-        perform_query_fan_out += split_query_fan_out * len(vcf_locations)
-
         # call split query for each dataset found
         payload = SplitQueryPayload(
             passthrough=event_passthrough,
@@ -111,48 +363,57 @@ def perform_variant_search(*,
             include_datasets=includeResultsetResponses,
             requested_granularity=requestedGranularity,
             variant_min_length=variantMinLength,
-            variant_max_length=variantMaxLength
+            variant_max_length=variantMaxLength,
+            deadline=deadline,
+            completion_channel=channel
         )
-        pool.submit(split_query, payload)
-
-    pool.shutdown()
+        split_payloads.append(payload)
 
-    query_record.update(actions=[
-        VariantQuery.fanOut.set(
-            VariantQuery.fanOut + perform_query_fan_out)
-    ])
+    # one response per split query until each replaces its own count
+    # with those of the performQuery work items it plans
+    init_fan_out(query_id, [payload.dataset_id for payload in split_payloads])
+    unpublished = split_queries(split_payloads)
+    add_fan_out(query_id, [split_payloads[n].dataset_id for n in unpublished], -1)
 
     print('End event publishing')
     
-    start_time = time.time()
-    query_results = dict()
-
-    while time.time() - start_time < REQUEST_TIMEOUT:
-        try:
-            query_record.refresh()
-            time.sleep(0.5)
-            if query_record.fanOut == 0:
-                for item in  VariantResponse.batch_get([(query_id, resp_no) for resp_no in range(1, query_record.responses + 1)]):
-                    query_results[item.responseNumber] = item
-                print(f"Query fan in completed with {len(query_results)} items")
+    interval = POLL_INTERVAL
+    fan_out, responses, answered = -1, 0, False
+
+    try:
+        while True:
+            fan_out, responses = get_fan_in(query_id)
+            # a boolean query is answered by the first hit of any split
+            if requestedGranularity == 'boolean':
+                query_record.refresh(consistent_read=True)
+                answered = bool(query_record.hitFound)
+            else:
+                answered = False
+            if fan_out == 0 or answered or time.time() >= deadline:
+                print(f"Query fan in completed with {responses} responses")
                 break
-        except Exception as e:
-            print("Errored", e)
-            break
+            # woken by the final completion, the counters are read again
+            # after a backoff in case a notification was lost
+            timeout = max(min(interval, deadline - time.time()), 0)
+            if channel is None:
+                time.sleep(timeout)
+            elif wait(channel, timeout):
+                continue
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+    except Exception as e:
+        print("Errored", e)
+    finally:
+        close_channel(channel)
+
+    coverage.update({
+        'partial': fan_out != 0 and not answered,
+        'splits': responses + max(fan_out, 0),
+        'splitsCompleted': responses,
+    })
 
     print('Start results generator')
-    for _, var_response in query_results.items():
-        if var_response.checkS3:
-            loc = var_response.responseLocation
-            obj = s3.get_object(
-                Bucket=loc.bucket,
-                Key=loc.key,
-            )
-            query_response = jsons.loads(obj['Body'].read(), PerformQueryResponse)
-        else:
-            query_response = jsons.loads(var_response.result, PerformQueryResponse)
-        
-        yield query_response
+    # streamed as the pages of responses arrive
+    yield from prefetch_responses(query_responses(query_id))
 
 
 def perform_variant_search_sync(*,
@@ -169,8 +430,16 @@ def perform_variant_search_sync(*,
         includeResultsetResponses,
         query_id='TEST',
         passthrough=dict(),
-        dataset_samples=[]
+        dataset_samples=[],
+        timeout=None,
+        coverage=None
 ):
+    '''
+    Invokes splitQuery for each dataset and yields the performQuery
+    responses as they arrive, until the deadline. coverage, if given, is
+    filled in as the responses are consumed, partial is set when some
+    datasets or splits did not complete in time.
+    '''
     try:
         # get vcf file and the name of chromosome in it eg: "chr1", "Chr4", "CHR1" or just "1"
         vcf_chromosomes = {vcfm['vcf']: get_matching_chromosome(
@@ -193,14 +462,22 @@ def perform_variant_search_sync(*,
         print('Error occured ', e)
         return False, []
 
+    deadline = get_deadline(timeout, QUERY_TIMEOUT)
+    if coverage is None:
+        coverage = dict()
+    coverage['partial'] = False
+
+    # boolean queries share a hit signal under the query id, keep runs of
+    # the same query apart
+    query_id = f'{query_id}-{uuid4().hex[:8]}'
+
     start_min += 1
     start_max += 1
     end_min += 1
     end_max += 1
 
     print('Start event publishing')
-    results_queue = queue.Queue()
-    pool = concurrent.futures.ThreadPoolExecutor(THREADS)
+    split_payloads = []
 
     # parallelism across datasets
     for n, dataset in enumerate(datasets):
@@ -234,12 +511,39 @@ def perform_variant_search_sync(*,
             include_datasets=includeResultsetResponses,
             requested_granularity=requestedGranularity,
             variant_min_length=variantMinLength,
-            variant_max_length=variantMaxLength
+            variant_max_length=variantMaxLength,
+            deadline=deadline
         )
-        pool.submit(split_query_sync, payload, results_queue)
+        split_payloads.append(payload)
+
+    # counted as the responses arrive, so coverage is right also when the
+    # consumer stops early
+    coverage.update({
+        'datasets': len(split_payloads),
+        'datasetsResponded': 0,
+        'splits': 0,
+        'splitsCompleted': 0,
+    })
 
-    pool.shutdown()
+    # results are consumed as each split query completes
+    split_results = split_queries_sync(split_payloads, deadline)
+    try:
+        for _, res_array in split_results:
+            coverage['datasetsResponded'] += 1
+            query_responses = [load_response(res) for res in res_array]
+            for response in query_responses:
+                coverage['splits'] += 1
+                coverage['splitsCompleted'] += not response.partial
+                yield response
+            # the first hit answers a boolean query, the split queries
+            # still pending are cancelled
+            if requestedGranularity == 'boolean' and any(response.exists for response in query_responses):
+                print('Boolean query answered')
+                return
+    finally:
+        # also when the consumer stops early
+        split_results.close()
     print('End event publishing')
-    
-    return [jsons.load(res, PerformQueryResponse) for res_array in results_queue.queue for res in res_array]
+
+    coverage['partial'] = coverage['datasetsResponded'] < len(split_payloads) or coverage['splitsCompleted'] < coverage['splits']
        
\ No newline at end of file
@@ -0,0 +1,233 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+from .region_reader import s3, split_s3_location, parse_index, block_spans
+
+
+CACHE_DIR = os.environ.get('VCF_CACHE_DIR', '/tmp/vcf-cache')
+# keep well within the lambda ephemeral storage
+CACHE_SIZE = int(os.environ.get('VCF_CACHE_SIZE', 512 * 1024 * 1024))
+# how long an etag is trusted before asking s3 again
+ETAG_TTL = 60  # seconds
+# parsed indexes kept in memory
+MAX_PARSED_INDEXES = 8
+# empty block closing every bgzf file, nothing is read past it
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+class LruFileCache:
+    '''
+    Size bounded cache of bytes on local disk, evicting the least
+    recently used entries. Survives across warm invocations.
+    '''
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        # batched performQuery reads from several threads
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # pick up files left by the previous invocations, oldest first,
+        # and drop the partial writes of any that crashed or timed out
+        paths = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if not name.endswith('.part'):
+                paths.append(path)
+                continue
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        for path in sorted(paths, key=os.path.getmtime):
+            self.entries[path] = os.path.getsize(path)
+            self.total_bytes += self.entries[path]
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest())
+
+    def get(self, key):
+        path = self.path(key)
+        with self.lock:
+            if path not in self.entries:
+                self.misses += 1
+                return None
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                self.total_bytes -= self.entries.pop(path)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        path = self.path(key)
+        # write then rename so a crashed invocation never leaves partial files
+        temp_path = f'{path}.{threading.get_ident()}.part'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        with self.lock:
+            if path in self.entries:
+                self.total_bytes -= self.entries.pop(path)
+            self.evict(len(data))
+            os.replace(temp_path, path)
+            self.entries[path] = len(data)
+            self.total_bytes += len(data)
+
+    def count_hit(self):
+        # for lookups answered before reaching the disk
+        with self.lock:
+            self.hits += 1
+
+    def evict(self, required_bytes):
+        while self.entries and self.total_bytes + required_bytes > self.max_bytes:
+            path, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'bytes': self.total_bytes,
+        }
+
+
+class VcfModifiedError(ValueError):
+    '''
+    The VCF was replaced after its etag was read, raised while its
+    records are already being read
+    '''
+
+
+cache = LruFileCache()
+etags = dict()
+parsed_indexes = OrderedDict()
+parsed_indexes_lock = threading.Lock()
+
+
+def get_etag(location, refresh=False):
+    now = time.time()
+    if not refresh and location in etags and now - etags[location][1] < ETAG_TTL:
+        return etags[location][0]
+    bucket, key = split_s3_location(location)
+    etag = s3.head_object(Bucket=bucket, Key=key)['ETag']
+    etags[location] = (etag, now)
+    return etag
+
+
+def get_index(location):
+    '''
+    Parsed csi/tbi index of the VCF, cached by location and etag
+    '''
+    etag = get_etag(location)
+    key = (location, etag, 'index')
+    with parsed_indexes_lock:
+        index = parsed_indexes.get(key)
+        if index is not None:
+            parsed_indexes.move_to_end(key)
+    if index is not None:
+        cache.count_hit()
+        return index
+
+    data = cache.get(key)
+    if data is not None:
+        suffix, data = data[:4].decode(), data[4:]
+    else:
+        suffix, data = fetch_index_bytes(location)
+        cache.put(key, suffix.encode() + data)
+    index = parse_index(suffix, io.BytesIO(data))
+
+    with parsed_indexes_lock:
+        parsed_indexes[key] = index
+        if len(parsed_indexes) > MAX_PARSED_INDEXES:
+            parsed_indexes.popitem(last=False)
+    return index
+
+
+def fetch_index_bytes(location):
+    # prefer csi as bcftools does, fall back to tbi
+    for suffix in ('.csi', '.tbi'):
+        bucket, key = split_s3_location(location + suffix)
+        try:
+            return suffix, s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+        except ClientError as error:
+            print(f'Could not access {location}{suffix} - {error}')
+    raise ValueError(f'Could not access csi or tbi index for {location}')
+
+
+def fetch(location, first_byte=None, last_byte=None):
+    '''
+    Cached drop in for region_reader.s3_get_bytes. Reads are pinned to the
+    cached etag so a replaced VCF can never be mixed with a stale index.
+    Ranges start at a bgzf block, the blocks are cached by their offset
+    so reads of neighbouring and overlapping ranges share them. Only the
+    part of a range not already cached is read from s3, the incomplete
+    block an over read ends in is never cached.
+    '''
+    etag = get_etag(location)
+    if first_byte is None:
+        return get_bytes(location, etag, None, None)
+
+    size = None if last_byte is None else last_byte - first_byte + 1
+    parts = []
+    offset = first_byte
+    while last_byte is None or offset <= last_byte:
+        block = cache.get((location, etag, 'block', offset))
+        if block is None:
+            break
+        parts.append(block)
+        offset += len(block)
+        if block == BGZF_EOF:
+            return b''.join(parts)[:size]
+    else:
+        return b''.join(parts)[:size]
+
+    data = get_bytes(location, etag, offset, last_byte)
+    for start, end in block_spans(data):
+        cache.put((location, etag, 'block', offset + start), data[start:end])
+    parts.append(data)
+    return b''.join(parts)[:size]
+
+
+def get_bytes(location, etag, first_byte, last_byte):
+    bucket, s3_key = split_s3_location(location)
+    kwargs = {
+        'Bucket': bucket,
+        'Key': s3_key,
+        'IfMatch': etag,
+    }
+    if first_byte is not None:
+        kwargs['Range'] = f'bytes={first_byte}-{"" if last_byte is None else last_byte}'
+    try:
+        return s3.get_object(**kwargs)['Body'].read()
+    except ClientError as error:
+        if error.response['Error']['Code'] == 'InvalidRange':
+            # the cached blocks already reached the end of the file
+            return b''
+        if error.response['Error']['Code'] == 'PreconditionFailed':
+            # the VCF changed underneath us, forget everything about the old one
+            etags.pop(location, None)
+            raise VcfModifiedError(f'{location} was modified during the query')
+        raise error
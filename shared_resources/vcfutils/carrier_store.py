@@ -0,0 +1,167 @@
+import io
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+from .region_reader import s3, query_region, get_sample_names, get_region_chunks, get_ref_length
+from .genotypes import decode_genotypes
+
+
+# genomic window covered by each stored object
+CARRIER_WINDOW = 100000
+# number of set bits for every byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint32)
+
+
+'''
+Carrier store, a per VCF ingestion time artefact for sample restricted
+queries. For every window of CARRIER_WINDOW bases it holds the records
+starting in the window and bit packed sample sets (one bit per sample,
+in VCF column order) for
+
+    carriers[row]  samples with at least one copy of the alt allele
+    doubles[row]   samples with at least two copies of the alt allele
+    called1[rec]   samples with at least one called allele
+    called2[rec]   samples with at least two called alleles
+
+where row = allele_offsets[rec] + alt index. Counts over a sample
+selection are then AND + popcount operations. Ploidies above two are
+counted as two.
+'''
+
+
+def carrier_store_key(location, etag, chrom, window_start):
+    # Remove leading "s3://" and change "/" delimiters
+    vcf_key = location[5:].replace('/', '%')
+    return f'vcf-carriers/{vcf_key}/{etag.strip(chr(34))}/{chrom}/{window_start}.npz'
+
+
+def get_window_starts(start, end):
+    '''
+    Windows overlapping the 1-based closed interval [start, end]
+    '''
+    first = (start - 1) // CARRIER_WINDOW * CARRIER_WINDOW
+    return list(range(first, end, CARRIER_WINDOW))
+
+
+def get_build_windows(index):
+    '''
+    (chrom, window_start) of every window that has indexed records
+    '''
+    return [
+        (chrom, window_start)
+        for ref_id, chrom in enumerate(index.names)
+        for window_start in range(0, get_ref_length(index, ref_id), CARRIER_WINDOW)
+        if get_region_chunks(index, chrom, window_start + 1, window_start + CARRIER_WINDOW)
+    ]
+
+
+def pack(mask):
+    return np.packbits(mask)
+
+
+def build_window(location, chrom, window_start, index, fetch):
+    '''
+    Scans a window of the VCF and returns the serialised carrier store object
+    '''
+    sample_names = get_sample_names(location, fetch)
+    window_end = window_start + CARRIER_WINDOW
+    records = query_region(
+        location,
+        f'{chrom}:{window_start + 1}-{window_end}',
+        index=index,
+        # each record belongs to the window it starts in
+        include=lambda pos, reference, all_alts: window_start < pos <= window_end,
+        fetch=fetch
+    )
+    lines = []
+    allele_offsets = [0]
+    carriers = []
+    doubles = []
+    called1 = []
+    called2 = []
+
+    for pos, reference, all_alts, info_str, genotypes in records:
+        variant_type = 'N/A'
+        for info in info_str.split(';'):
+            if info.startswith('VT='):
+                variant_type = info[3:]
+        alts = all_alts.split(',')
+        matrix = decode_genotypes(genotypes)
+        called = np.count_nonzero(matrix >= 0, axis=1)
+        called1.append(pack(called >= 1))
+        called2.append(pack(called >= 2))
+        for allele in range(1, len(alts) + 1):
+            copies = np.count_nonzero(matrix == allele, axis=1)
+            carriers.append(pack(copies >= 1))
+            doubles.append(pack(copies >= 2))
+        allele_offsets.append(allele_offsets[-1] + len(alts))
+        lines.append(f'{pos}\t{reference}\t{all_alts}\t{variant_type}')
+
+    n_bytes = (len(sample_names) + 7) // 8
+    empty = np.zeros((0, n_bytes), dtype=np.uint8)
+    body = io.BytesIO()
+    np.savez_compressed(
+        body,
+        samples=np.frombuffer('\n'.join(sample_names).encode(), dtype=np.uint8),
+        records=np.frombuffer('\n'.join(lines).encode(), dtype=np.uint8),
+        allele_offsets=np.array(allele_offsets, dtype=np.int64),
+        carriers=np.stack(carriers) if carriers else empty,
+        doubles=np.stack(doubles) if doubles else empty,
+        called1=np.stack(called1) if called1 else empty,
+        called2=np.stack(called2) if called2 else empty,
+    )
+    return body.getvalue()
+
+
+def save_window(bucket, location, etag, chrom, window_start, index, fetch):
+    key = carrier_store_key(location, etag, chrom, window_start)
+    body = build_window(location, chrom, window_start, index, fetch)
+    s3.put_object(Bucket=bucket, Key=key, Body=body)
+    print(f'Uploaded - {bucket}/{key}')
+
+
+class CarrierWindow:
+    def __init__(self, data):
+        arrays = np.load(io.BytesIO(data))
+        self.sample_names = bytes(arrays['samples']).decode().split('\n') if arrays['samples'].size else []
+        self.records = [
+            line.split('\t')
+            for line in bytes(arrays['records']).decode().split('\n')
+        ] if arrays['records'].size else []
+        self.allele_offsets = arrays['allele_offsets']
+        self.carriers = arrays['carriers']
+        self.doubles = arrays['doubles']
+        self.called1 = arrays['called1']
+        self.called2 = arrays['called2']
+
+    def selection(self, sample_names):
+        '''
+        Packed bit mask of the named samples
+        '''
+        positions = {sample: n for n, sample in enumerate(self.sample_names)}
+        mask = np.zeros(len(self.sample_names), dtype=bool)
+        mask[[positions[sample] for sample in sample_names if sample in positions]] = True
+        return pack(mask)
+
+
+def popcount(packed):
+    return int(POPCOUNT[packed].sum())
+
+
+def load_window(bucket, location, etag, chrom, window_start, cache=None):
+    '''
+    CarrierWindow for the window, or None when the store was not built
+    '''
+    key = carrier_store_key(location, etag, chrom, window_start)
+    data = cache.get(('carriers', bucket, key)) if cache is not None else None
+    if data is None:
+        try:
+            data = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+        except ClientError as error:
+            if error.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise error
+        if cache is not None:
+            cache.put(('carriers', bucket, key), data)
+    return CarrierWindow(data)
@@ -0,0 +1,120 @@
+import numpy as np
+
+
+# allele index used for "." calls
+MISSING = -1
+# padding for samples with fewer alleles than the highest ploidy
+ABSENT = -2
+
+COMMA = ord(',')
+DOT = ord('.')
+
+
+def decode_genotypes(genotypes):
+    '''
+    Decodes a [%GT,] column such as "0|1,1/1,./.,1" into an int matrix of
+    allele indexes with one row per sample and one column per allele.
+    Missing calls are MISSING, unused ploidy slots are ABSENT.
+    '''
+    raw = np.frombuffer(genotypes.rstrip(',\n').encode('ascii'), dtype=np.uint8)
+    if raw.size == 0:
+        return np.empty((0, 0), dtype=np.int32)
+
+    is_digit = (raw >= 48) & (raw <= 57)
+    is_token = is_digit | (raw == DOT)
+    # a token (allele) starts where the previous character is a separator
+    starts = is_token.copy()
+    starts[1:] &= ~is_token[:-1]
+    start_positions = np.flatnonzero(starts)
+    token_ids = np.cumsum(starts) - 1
+
+    # allele values, digits are weighted by their position from the token end
+    token_positions = np.flatnonzero(is_digit)
+    digit_tokens = token_ids[token_positions]
+    token_lengths = np.bincount(token_ids[is_token], minlength=start_positions.size)
+    token_ends = start_positions + token_lengths
+    powers = token_ends[digit_tokens] - token_positions - 1
+    values = np.bincount(
+        digit_tokens,
+        weights=(raw[token_positions] - 48) * np.power(10.0, powers),
+        minlength=start_positions.size
+    ).astype(np.int32)
+    values[raw[start_positions] == DOT] = MISSING
+
+    # place each allele in its sample's row
+    sample_ids = np.cumsum(raw == COMMA)[start_positions]
+    n_samples = int(np.count_nonzero(raw == COMMA)) + 1
+    first_tokens = np.searchsorted(sample_ids, np.arange(n_samples))
+    slots = np.arange(start_positions.size) - first_tokens[sample_ids]
+    matrix = np.full((n_samples, int(slots.max()) + 1), ABSENT, dtype=np.int32)
+    matrix[sample_ids, slots] = values
+    return matrix
+
+
+def count_calls(matrix, alleles):
+    '''
+    Number of calls of any of the given allele indexes
+    '''
+    return int(np.count_nonzero(np.isin(matrix, alleles)))
+
+
+def count_alleles(matrix):
+    '''
+    Number of called (non missing) alleles, equivalent of INFO/AN
+    '''
+    return int(np.count_nonzero(matrix >= 0))
+
+
+def called_alleles(matrix, alleles):
+    '''
+    Subset of the given allele indexes that were called at least once
+    '''
+    return [int(allele) for allele in np.intersect1d(matrix, alleles)]
+
+
+def carrier_indices(matrix, alleles):
+    '''
+    Indices of the samples carrying any of the given allele indexes
+    '''
+    return np.flatnonzero(np.isin(matrix, alleles).any(axis=1)).tolist()
+
+
+def count_record(info_str, genotypes, hit_indexes, use_info=True):
+    '''
+    Counts the hit alt indexes of a vcf record, the rule every engine
+    answers by. INFO/AC and INFO/AN are used when use_info is set and
+    they are present, they describe all samples so a sample selection is
+    counted from its genotypes. Returns (variant type, hit indexes with
+    calls, calls, called alleles, genotype matrix or None if not decoded).
+    '''
+    all_alt_counts = None
+    total_count = None
+    variant_type = 'N/A'
+
+    for info in info_str.split(';'):
+        if info.startswith('AC='):
+            all_alt_counts = info[3:]
+        elif info.startswith('AN='):
+            total_count = int(info[3:])
+        elif info.startswith('VT='):
+            variant_type = info[3:]
+
+    matrix = None
+    hit_alleles = [i + 1 for i in hit_indexes]
+    if use_info and all_alt_counts is not None:
+        alt_counts = [int(c) for c in all_alt_counts.split(',')]
+        called_indexes = [i for i in hit_indexes if alt_counts[i] != 0]
+        calls = sum(alt_counts[i] for i in hit_indexes)
+    else:
+        # decoding 0|0,0|0,0|0,0|0
+        matrix = decode_genotypes(genotypes)
+        called_indexes = [allele - 1 for allele in called_alleles(matrix, hit_alleles)]
+        calls = count_calls(matrix, hit_alleles)
+
+    if use_info and total_count is not None:
+        alleles = total_count
+    else:
+        if matrix is None:
+            matrix = decode_genotypes(genotypes)
+        alleles = count_alleles(matrix)
+    return variant_type, called_indexes, calls, alleles, matrix
@@ -0,0 +1,325 @@
+import struct
+import zlib
+
+import boto3
+from botocore.exceptions import ClientError
+
+from .index_reader import Csi, Tbi
+
+
+# BGZF blocks are never larger than 64KB (compressed or uncompressed)
+MAX_BLOCK_SIZE = 65536
+# tabix indexes always use 16kb leaf bins and 5 levels
+TBI_MIN_SHIFT = 14
+TBI_DEPTH = 5
+# lines scanned between calls of the stop callback of query_region
+STOP_CHECK_INTERVAL = 1024
+
+s3 = boto3.client('s3')
+
+
+def split_s3_location(location):
+    delim_index = location.find('/', 5)
+    return location[5:delim_index], location[delim_index + 1:]
+
+
+def parse_region(region):
+    # region is of form: "chrom:start-end"
+    chrom, span = region.rsplit(':', 1)
+    start, end = span.split('-')
+    return chrom, int(start), int(end)
+
+
+def s3_get_bytes(location, first_byte=None, last_byte=None):
+    bucket, key = split_s3_location(location)
+    kwargs = {
+        'Bucket': bucket,
+        'Key': key,
+    }
+    if first_byte is not None:
+        kwargs['Range'] = f'bytes={first_byte}-{"" if last_byte is None else last_byte}'
+    return s3.get_object(**kwargs)['Body'].read()
+
+
+def parse_index(suffix, file_obj):
+    return Csi(file_obj) if suffix == '.csi' else Tbi(file_obj)
+
+
+def load_index(location):
+    # prefer csi as bcftools does, fall back to tbi
+    for suffix in ('.csi', '.tbi'):
+        bucket, key = split_s3_location(location + suffix)
+        try:
+            response = s3.get_object(Bucket=bucket, Key=key)
+        except ClientError as error:
+            print(f'Could not access {location}{suffix} - {error}')
+            continue
+        return parse_index(suffix, response['Body'])
+    raise ValueError(f'Could not access csi or tbi index for {location}')
+
+
+def index_params(index):
+    if isinstance(index, Csi):
+        return index.min_shift, index.depth
+    return TBI_MIN_SHIFT, TBI_DEPTH
+
+
+def reg2bins(beg, end, min_shift, depth):
+    '''
+    Bins overlapping the 0-based half open interval [beg, end)
+    as described in the SAM/CSI specifications
+    '''
+    end -= 1
+    bins = []
+    shift = min_shift + depth * 3
+    first_bin = 0
+    for level in range(depth + 1):
+        bins.extend(range(first_bin + (beg >> shift), first_bin + (end >> shift) + 1))
+        shift -= 3
+        first_bin += 1 << (level * 3)
+    return bins
+
+
+def bin_start(bin_no, min_shift, depth):
+    '''
+    Start coordinate (0-based) of the interval covered by a bin
+    '''
+    level = 0
+    first_bin = 0
+    while bin_no >= first_bin + (1 << (level * 3)):
+        first_bin += 1 << (level * 3)
+        level += 1
+    return (bin_no - first_bin) << (min_shift + 3 * (depth - level))
+
+
+def bin_end(bin_no, min_shift, depth):
+    '''
+    End coordinate (exclusive, 0-based) of the interval covered by a bin
+    '''
+    level = 0
+    first_bin = 0
+    while bin_no >= first_bin + (1 << (level * 3)):
+        first_bin += 1 << (level * 3)
+        level += 1
+    return (bin_no - first_bin + 1) << (min_shift + 3 * (depth - level))
+
+
+def get_ref_length(index, ref_id):
+    '''
+    Upper bound of the positions indexed for a reference
+    '''
+    min_shift, depth = index_params(index)
+    bins = get_ref_bins(index, ref_id)
+    return max((bin_end(bin_no, min_shift, depth) for bin_no in bins), default=0)
+
+
+def get_ref_bins(index, ref_id):
+    # lazily built bin lookup, kept on the index object for reuse
+    bin_maps = index.__dict__.setdefault('bin_maps', {})
+    if ref_id not in bin_maps:
+        bin_maps[ref_id] = {
+            bin['bin']: bin
+            for bin in index.refs[ref_id]['bins']
+            if bin['bin'] < index.bin_limit
+        }
+    return bin_maps[ref_id]
+
+
+def get_min_offset(index, ref_id, beg):
+    '''
+    Smallest virtual offset that may contain records overlapping beg
+    '''
+    min_shift, depth = index_params(index)
+    if isinstance(index, Tbi):
+        intvs = index.refs[ref_id]['intvs']
+        if not intvs:
+            return 0
+        return intvs[min(beg >> TBI_MIN_SHIFT, len(intvs) - 1)]['ioff']['virtual_file_offset']
+    # walk up from the leaf bin until a bin with a loffset exists
+    bins = get_ref_bins(index, ref_id)
+    bin_no = ((1 << (depth * 3)) - 1) // 7 + (beg >> min_shift)
+    while bin_no > 0 and bin_no not in bins:
+        bin_no = (bin_no - 1) >> 3
+    return bins[bin_no]['loffset'] if bin_no in bins else 0
+
+
+def get_region_chunks(index, chrom, start, end):
+    '''
+    Merged list of (virtual_begin, virtual_end) chunks that may contain
+    records overlapping the 1-based closed interval [start, end]
+    '''
+    if chrom not in index.names:
+        return []
+    ref_id = index.names.index(chrom)
+    min_shift, depth = index_params(index)
+    beg = max(start - 1, 0)
+    min_offset = get_min_offset(index, ref_id, beg)
+    bins = get_ref_bins(index, ref_id)
+    chunks = sorted(
+        (
+            max(chunk['chunk_beg']['virtual_file_offset'], min_offset),
+            chunk['chunk_end']['virtual_file_offset']
+        )
+        for bin_no in reg2bins(beg, end, min_shift, depth)
+        if bin_no in bins
+        for chunk in bins[bin_no]['chunks']
+        if chunk['chunk_end']['virtual_file_offset'] > min_offset
+    )
+    merged = []
+    for chunk_beg, chunk_end in chunks:
+        # merge chunks that overlap or share a bgzf block
+        if merged and chunk_beg >> 16 <= merged[-1][1] >> 16:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], chunk_end))
+        else:
+            merged.append((chunk_beg, chunk_end))
+    return merged
+
+
+def chunk_byte_range(chunk_beg, chunk_end):
+    '''
+    Compressed byte range holding exactly the bgzf blocks of a chunk
+    '''
+    first_byte = chunk_beg >> 16
+    if chunk_end & 65535:
+        # the chunk ends inside this block, we don't know its size yet
+        last_byte = (chunk_end >> 16) + MAX_BLOCK_SIZE - 1
+    else:
+        last_byte = (chunk_end >> 16) - 1
+    return first_byte, last_byte
+
+
+def block_spans(data):
+    '''
+    Yields (start, end) of each complete bgzf block in data, a read
+    starting at a block boundary. Stops at the first incomplete block.
+    '''
+    pos = 0
+    while pos + 18 <= len(data):
+        # BSIZE is the total block size minus one
+        block_size = struct.unpack_from('<H', data, pos + 16)[0] + 1
+        if pos + block_size > len(data):
+            break
+        yield pos, pos + block_size
+        pos += block_size
+
+
+def inflate_blocks(data, block_offset=0, stop_offset=None):
+    '''
+    Yields (block_offset, uncompressed bytes) for each bgzf block in data.
+    block_offset is the file offset of data[0].
+    '''
+    for start, end in block_spans(data):
+        if stop_offset is not None and block_offset + start > stop_offset:
+            break
+        yield block_offset + start, zlib.decompress(data[start + 18: end - 8], -15)
+
+
+def read_chunk(location, chunk_beg, chunk_end, fetch=s3_get_bytes):
+    '''
+    Uncompressed text of the records between two virtual offsets
+    '''
+    first_byte, last_byte = chunk_byte_range(chunk_beg, chunk_end)
+    if last_byte < first_byte:
+        return b''
+    data = fetch(location, first_byte, last_byte)
+    end_block = chunk_end >> 16
+    parts = []
+    for block_offset, block in inflate_blocks(data, first_byte, end_block):
+        if block_offset == end_block:
+            block = block[:chunk_end & 65535]
+        if block_offset == first_byte:
+            block = block[chunk_beg & 65535:]
+        parts.append(block)
+    return b''.join(parts)
+
+
+def read_header(location, fetch=s3_get_bytes):
+    '''
+    The #CHROM line of the VCF header split into columns
+    '''
+    first_byte = 0
+    fetch_size = MAX_BLOCK_SIZE * 4
+    text = b''
+    while True:
+        data = fetch(location, first_byte, first_byte + fetch_size - 1)
+        next_byte = first_byte
+        for block_offset, block in inflate_blocks(data, first_byte):
+            next_byte = block_offset + struct.unpack_from('<H', data, block_offset - first_byte + 16)[0] + 1
+            text += block
+            line_start = text.find(b'\n#CHROM')
+            line_end = text.find(b'\n', line_start + 1) if line_start >= 0 else -1
+            if line_end >= 0:
+                return text[line_start + 1:line_end].decode().rstrip('\r').split('\t')
+        if next_byte == first_byte or len(data) < fetch_size:
+            raise ValueError(f'Could not find #CHROM header line in {location}')
+        first_byte = next_byte
+        fetch_size *= 2
+
+
+def get_sample_names(location, fetch=s3_get_bytes):
+    return read_header(location, fetch)[9:]
+
+
+def extract_genotypes(columns, sample_columns=None):
+    '''
+    Genotype column in the same form bcftools outputs for [%GT,]
+    '''
+    fmt = columns[0]
+    samples = columns[1:] if sample_columns is None else [columns[i + 1] for i in sample_columns]
+    if fmt == 'GT':
+        return ','.join(samples)
+    if not fmt.startswith('GT:'):
+        return ','.join('.' for _ in samples)
+    return ','.join(sample.split(':', 1)[0] for sample in samples)
+
+
+def query_region(location, region, *, index=None, sample_columns=None, include=None, match=None, stop=None, fetch=s3_get_bytes):
+    '''
+    In process replacement for `bcftools query --regions region`.
+    Yields (pos, ref, alt, info, genotypes) tuples for records overlapping
+    the region, where genotypes matches bcftools' [%GT,] output.
+    sample_columns restricts the genotypes to these sample indices.
+    include(pos, ref, alt) -> bool drops records before their genotypes
+    are parsed, like bcftools --include.
+    match(pos, ref, alt) -> (alts, hit indexes) does the same for records
+    without hits, and its result is yielded as a sixth item so the caller
+    need not match the record again.
+    stop() -> bool ends the scan early, it is called before each chunk
+    and every STOP_CHECK_INTERVAL lines scanned, whether or not they are
+    included, so a selective query still notices it.
+    '''
+    chrom, start, end = parse_region(region)
+    if index is None:
+        index = load_index(location)
+    scanned = 0
+
+    for chunk_beg, chunk_end in get_region_chunks(index, chrom, start, end):
+        if stop is not None and stop():
+            return
+        text = read_chunk(location, chunk_beg, chunk_end, fetch).decode()
+        for line in text.splitlines():
+            scanned += 1
+            if stop is not None and scanned % STOP_CHECK_INTERVAL == 0 and stop():
+                return
+            if not line or line[0] == '#':
+                continue
+            # only split the genotypes once the record is known to be needed
+            (rec_chrom, position, _, reference, all_alts, _, _, info_str, *rest) = line.split('\t', 8)
+            if rec_chrom != chrom:
+                continue
+            pos = int(position)
+            if pos > end:
+                return
+            if pos + len(reference) - 1 < start:
+                continue
+            if include is not None and not include(pos, reference, all_alts):
+                continue
+            if match is not None:
+                matched = match(pos, reference, all_alts)
+                if not matched[1]:
+                    continue
+            genotypes = extract_genotypes(rest[0].split('\t'), sample_columns) if rest else ''
+            if match is not None:
+                yield pos, reference, all_alts, info_str, genotypes, matched
+            else:
+                yield pos, reference, all_alts, info_str, genotypes
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from .cache import get_etag
+from .region_reader import s3
+
+
+# bucket the performQuery responses of work items are cached in, the
+# cache is off if neither it nor the local stand-in is set
+RESULT_CACHE_BUCKET = os.environ.get('RESULT_CACHE_BUCKET')
+RESULT_CACHE_PREFIX = 'query-cache/'
+# local stand-in for the bucket, used when set
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR')
+# seconds a cached response is served for, the bucket lifecycle removes
+# them after a day
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 12 * 3600))
+# changes whenever an engine changes what it counts or the compact
+# layout changes, so responses of the previous one are no longer served
+RESULT_CACHE_VERSION = 3
+
+
+def is_enabled():
+    return bool(RESULT_CACHE_BUCKET or RESULT_CACHE_DIR)
+
+
+def get_engine(payload):
+    '''
+    performQuery engine answering payload. The carrier store and the
+    sample scan count the same way, so they share 'samples'.
+    '''
+    if payload.passthrough.get('selectedSamplesOnly', False):
+        return 'samples'
+    return 'variants'
+
+
+def get_result_key(payload, vcf_location, region):
+    '''
+    Key of the response to the work item (vcf_location, region) of
+    payload, a hash of everything that decides what performQuery finds.
+    The etag of the vcf is part of it, so replacing the vcf invalidates
+    its entries. None if the vcf can't be versioned.
+    '''
+    if not is_enabled() or not vcf_location.startswith('s3://'):
+        return None
+    try:
+        etag = get_etag(vcf_location)
+    except ClientError as e:
+        print(f'Not caching {vcf_location} - {e}')
+        return None
+    fields = [
+        RESULT_CACHE_VERSION,
+        get_engine(payload),
+        vcf_location,
+        etag,
+        region,
+        payload.dataset_id,
+        payload.reference_bases,
+        payload.alternate_bases,
+        payload.end_min,
+        payload.end_max,
+        payload.variant_type,
+        payload.variant_min_length,
+        payload.variant_max_length,
+        payload.requested_granularity,
+        payload.include_details,
+        payload.passthrough,
+    ]
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+def get_result_location(key):
+    '''
+    (bucket, key) of a cached response in s3, None for the local stand-in
+    '''
+    if RESULT_CACHE_DIR:
+        return None
+    return RESULT_CACHE_BUCKET, f'{RESULT_CACHE_PREFIX}{key}.bin'
+
+
+def get_cached_result(key):
+    '''
+    Compact PerformQueryResponse cached under key, None if there is none
+    younger than RESULT_CACHE_TTL
+    '''
+    if key is None:
+        return None
+    if RESULT_CACHE_DIR:
+        path = os.path.join(RESULT_CACHE_DIR, key)
+        try:
+            if time.time() - os.path.getmtime(path) > RESULT_CACHE_TTL:
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+    bucket, s3_key = get_result_location(key)
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=s3_key)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            print(f'Could not read cached result {s3_key} - {e}')
+        return None
+    if time.time() - obj['LastModified'].timestamp() > RESULT_CACHE_TTL:
+        return None
+    return obj['Body'].read()
+
+
+def put_cached_result(key, body):
+    if key is None:
+        return
+    if RESULT_CACHE_DIR:
+        os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+        path = os.path.join(RESULT_CACHE_DIR, key)
+        # write then rename so readers never see a partial entry
+        temp_path = f'{path}.{threading.get_ident()}.part'
+        with open(temp_path, 'wb') as f:
+            f.write(body)
+        os.replace(temp_path, path)
+        return
+    bucket, s3_key = get_result_location(key)
+    try:
+        s3.put_object(Bucket=bucket, Key=s3_key, Body=body)
+    except ClientError as e:
+        # the next query just runs the work item again
+        print(f'Could not cache result {s3_key} - {e}')
@@ -0,0 +1,67 @@
+from .region_reader import index_params, get_ref_bins, bin_start
+
+
+# bgzf blocks of vcf text compress roughly this much
+COMPRESSION_RATIO = 4
+
+
+def chunk_size(chunk_beg, chunk_end):
+    '''
+    Approximate compressed bytes between two virtual offsets
+    '''
+    blocks = (chunk_end >> 16) - (chunk_beg >> 16)
+    within_block = ((chunk_end & 65535) - (chunk_beg & 65535)) // COMPRESSION_RATIO
+    return max(blocks + within_block, 0)
+
+
+def get_tile_sizes(index, ref_id):
+    '''
+    {tile: compressed bytes} for the tiles of 1 << min_shift bases of a
+    reference, from the chunks of its leaf bins. Records in higher level
+    bins are counted in the first tile they overlap.
+    '''
+    # lazily built, kept on the index object for reuse
+    tile_maps = index.__dict__.setdefault('tile_maps', {})
+    if ref_id in tile_maps:
+        return tile_maps[ref_id]
+
+    min_shift, depth = index_params(index)
+    tiles = dict()
+    for bin_no, bin in get_ref_bins(index, ref_id).items():
+        tile = bin_start(bin_no, min_shift, depth) >> min_shift
+        size = sum(
+            chunk_size(chunk['chunk_beg']['virtual_file_offset'], chunk['chunk_end']['virtual_file_offset'])
+            for chunk in bin['chunks']
+        )
+        tiles[tile] = tiles.get(tile, 0) + size
+    tile_maps[ref_id] = tiles
+    return tiles
+
+
+def plan_splits(index, chrom, start, end, bytes_per_split):
+    '''
+    Cuts the 1-based closed interval [start, end] into consecutive
+    (split_start, split_end) regions holding about bytes_per_split
+    compressed bytes each. Splits are cut on tile boundaries, so dense
+    regions get short splits and sparse regions long ones.
+    '''
+    if chrom not in index.names:
+        return [(start, end)]
+    ref_id = index.names.index(chrom)
+    min_shift, _ = index_params(index)
+    tiles = get_tile_sizes(index, ref_id)
+    last_tile = (end - 1) >> min_shift
+    splits = []
+    split_start = start
+    size = 0
+
+    for tile in range((start - 1) >> min_shift, last_tile):
+        size += tiles.get(tile, 0)
+        if size >= bytes_per_split:
+            # last base of this tile
+            split_end = (tile + 1) << min_shift
+            splits.append((split_start, split_end))
+            split_start = split_end + 1
+            size = 0
+    splits.append((split_start, end))
+    return splits
@@ -0,0 +1,23 @@
+import os
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the lambdas import the shared packages as top level modules
+sys.path[:0] = [
+    os.path.join(ROOT, 'shared_resources'),
+    os.path.join(ROOT, 'lambda', 'performQuery'),
+]
+
+# configuration the modules read at import, nothing here reaches aws
+for name, value in {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'BEACON_API_VERSION': 'v2.0.0',
+    'BEACON_ID': 'test.beacon',
+    'DYNAMO_VARIANT_QUERIES_TABLE': 'test-variant-queries',
+    'DYNAMO_VARIANT_QUERY_RESPONSES_TABLE': 'test-variant-query-responses',
+    'SPLIT_QUERY_LAMBDA': 'test-splitQuery',
+    'SPLIT_QUERY_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:test-splitQuery',
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,79 @@
+import random
+from types import SimpleNamespace
+
+from variantutils.aggregation import VariantAggregator
+
+
+VARIANTS = [f'chr{chrom}\t{pos}\tA\t{alt}\tSNP' for chrom in (1, 2) for pos in range(1, 40) for alt in 'GT']
+
+
+def get_responses(seed):
+    variants = VARIANTS[:]
+    random.Random(seed).shuffle(variants)
+    # every variant twice, spread over responses as splits would find them
+    return [
+        SimpleNamespace(exists=True, variants=variants[n::7])
+        for n in range(7)
+    ] + [SimpleNamespace(exists=True, variants=variants[:50])]
+
+
+def get_page(aggregator):
+    return [result['variantInternalId'] for result in aggregator.results]
+
+
+def test_page_does_not_depend_on_arrival_order():
+    pages = {
+        tuple(get_page(VariantAggregator('GRCh38', skip=20, limit=10).consume(get_responses(seed))))
+        for seed in range(10)
+    }
+    assert len(pages) == 1
+
+
+def test_pages_partition_the_variants():
+    seen = []
+    for skip in range(0, len(VARIANTS), 25):
+        aggregator = VariantAggregator('GRCh38', skip=skip, limit=25).consume(get_responses(skip))
+        assert aggregator.count == len(VARIANTS)
+        assert aggregator.complete
+        seen += get_page(aggregator)
+    assert len(seen) == len(set(seen)) == len(VARIANTS)
+
+
+def test_results_in_variant_order():
+    aggregator = VariantAggregator('GRCh38', skip=0, limit=5).consume(get_responses(1))
+    starts = [result['variation']['location']['interval']['start']['value'] for result in aggregator.results]
+    alts = [result['variation']['alternateBases'] for result in aggregator.results]
+    assert list(zip(starts, alts)) == [(1, 'G'), (1, 'T'), (2, 'G'), (2, 'T'), (3, 'G')]
+
+
+def test_only_the_page_is_kept():
+    aggregator = VariantAggregator('GRCh38', skip=3, limit=4).consume(get_responses(2))
+    assert len(aggregator.ordered) == 7
+    assert len(aggregator.results) == 4
+
+
+def test_boolean_stops_on_first_hit():
+    consumed = []
+    closed = []
+
+    def responses():
+        try:
+            for response in [SimpleNamespace(exists=False, variants=[])] * 2 + get_responses(3):
+                consumed.append(response)
+                yield response
+        finally:
+            closed.append(True)
+
+    aggregator = VariantAggregator('GRCh38', with_variants=False, boolean=True).consume(responses())
+    assert aggregator.exists
+    assert not aggregator.complete
+    assert len(consumed) == 3
+    assert closed
+
+
+def test_no_hits():
+    responses = [SimpleNamespace(exists=False, variants=[]) for _ in range(3)]
+    aggregator = VariantAggregator('GRCh38', skip=0, limit=10).consume(responses)
+    assert not aggregator.exists
+    assert aggregator.count == 0
+    assert aggregator.results == []
@@ -0,0 +1,113 @@
+import itertools
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from allele_matcher import build_matcher
+
+
+BASES = ['A', 'C', 'G', 'T', 'N']
+
+
+def get_payload(**kwargs):
+    payload = dict(
+        region='1:100-200',
+        end_min=0,
+        end_max=1000,
+        reference_bases='N',
+        alternate_bases=None,
+        variant_type=None,
+        variant_min_length=0,
+        variant_max_length=-1,
+    )
+    payload.update(kwargs)
+    return SimpleNamespace(**payload)
+
+
+def old_hit_indexes(payload, pos, reference, all_alts):
+    '''
+    Per record checks of performQuery before the matcher was compiled
+    '''
+    first_bp = int(payload.region[payload.region.find(':') + 1: payload.region.find('-')])
+    last_bp = int(payload.region[payload.region.find('-') + 1:])
+    v_prefix = '<{}'.format(payload.variant_type)
+    variant_max_length = float('inf') if payload.variant_max_length < 0 else payload.variant_max_length
+    ref_length = len(reference)
+
+    if not first_bp <= pos <= last_bp:
+        return []
+    if not payload.end_min <= pos + ref_length - 1 <= payload.end_max:
+        return []
+    if payload.reference_bases != 'N' and reference.upper() != payload.reference_bases:
+        return []
+    alts = all_alts.split(',')
+
+    def length_ok(alt):
+        return payload.variant_min_length <= len(alt) <= variant_max_length
+
+    if payload.alternate_bases is not None:
+        if payload.alternate_bases == 'N':
+            return [i for i, alt in enumerate(alts) if alt.upper() in BASES and length_ok(alt)]
+        return [i for i, alt in enumerate(alts) if alt.upper() == payload.alternate_bases and length_ok(alt)]
+    if payload.variant_type == 'DUP':
+        pattern = re.compile('({}){{2,}}'.format(reference))
+        return [
+            i for i, alt in enumerate(alts)
+            if (
+                (alt.startswith(v_prefix) or (alt.startswith('<CN') and alt not in ('<CN0>', '<CN1>')))
+                if alt.startswith('<') else pattern.fullmatch(alt)
+            )
+            and length_ok(alt)
+        ]
+    if payload.variant_type == 'CNV':
+        pattern = re.compile(r'\.|({})*'.format(reference))
+        return [
+            i for i, alt in enumerate(alts)
+            if (
+                alt.startswith(('<CN', '<DEL', '<DUP', v_prefix))
+                if alt.startswith('<') else pattern.fullmatch(alt)
+            )
+            and length_ok(alt)
+        ]
+    raise ValueError(payload.variant_type)
+
+
+ALTS = [
+    'A', 'a', 'C', 'N', 'AA', 'AT', 'ATAT', 'ATATAT', 'ATA', 'AC', '.',
+    '<DUP>', '<DUP:TANDEM>', '<CN0>', '<CN1>', '<CN2>', '<CN3>', '<DEL>', '<INS>',
+]
+RECORDS = [
+    (pos, reference, ','.join(alts))
+    for pos in (99, 100, 150, 200, 201)
+    for reference in ('A', 'AT', 'a')
+    for alts in itertools.combinations(ALTS, 2)
+]
+
+
+@pytest.mark.parametrize('payload', [
+    get_payload(variant_type='DUP'),
+    get_payload(variant_type='DUP', variant_min_length=3, variant_max_length=5),
+    get_payload(variant_type='CNV'),
+    get_payload(variant_type='CNV', reference_bases='AT'),
+    get_payload(alternate_bases='N'),
+    get_payload(alternate_bases='N', reference_bases='A'),
+    get_payload(alternate_bases='AT', end_min=100, end_max=150),
+    get_payload(alternate_bases='A', variant_max_length=0),
+], ids=repr)
+def test_matches_per_record_checks(payload):
+    match = build_matcher(payload)
+    for pos, reference, all_alts in RECORDS:
+        assert match(pos, reference, all_alts)[1] == old_hit_indexes(payload, pos, reference, all_alts), (pos, reference, all_alts)
+
+
+def test_returns_split_alts():
+    match = build_matcher(get_payload(alternate_bases='G'))
+    assert match(150, 'A', 'C,G') == (['C', 'G'], [1])
+    assert match(150, 'A', 'C,T') == (['C', 'T'], [])
+
+
+def test_reference_wildcards():
+    payload = get_payload(reference_bases='AN', alternate_bases='G')
+    assert build_matcher(payload, reference_wildcards=True)(150, 'AC', 'G')[1] == [0]
+    assert build_matcher(payload)(150, 'AC', 'G')[1] == []
@@ -0,0 +1,74 @@
+import struct
+
+import pytest
+
+from payloads.lambda_responses import PerformQueryResponse, COMPACT_HEADER
+from variantutils.search_variants import load_compact_response
+
+
+def get_response(**kwargs):
+    response = dict(
+        exists=True,
+        vcf_location='s3://bucket/cohort.vcf.gz',
+        dataset_id='dataset-1',
+        all_alleles_count=2 ** 40,
+        variants=['chr1\t100\tA\tG\tSNP', 'chr1\t120\tAT\tA\tDEL', 'chr2\t5\tA\tG\tSNP'],
+        call_count=7,
+        sample_indices=[0, 3, 2 ** 32 - 1],
+        sample_names=['HG00096', 'HG00097', 'chr1'],
+        partial=False,
+    )
+    response.update(kwargs)
+    return PerformQueryResponse(**response)
+
+
+def assert_round_trip(response):
+    decoded = load_compact_response(response.dumpb())
+    assert decoded.exists == response.exists
+    assert decoded.partial == response.partial
+    assert decoded.vcf_location == response.vcf_location
+    assert decoded.dataset_id == response.dataset_id
+    assert decoded.all_alleles_count == response.all_alleles_count
+    assert decoded.call_count == response.call_count
+    assert list(decoded.sample_indices) == list(response.sample_indices)
+    assert list(decoded.sample_names) == list(response.sample_names)
+    assert decoded.variant_chunks == response.variant_chunks
+    if not response.variant_chunks:
+        assert list(decoded.variants) == list(response.variants)
+
+
+@pytest.mark.parametrize('response', [
+    get_response(),
+    get_response(exists=False, partial=True, variants=[], sample_indices=[], sample_names=[], call_count=0),
+    # strings are shared, the ids in the header still tell them apart
+    get_response(dataset_id='s3://bucket/cohort.vcf.gz'),
+    get_response(dataset_id='chr1'),
+    get_response(sample_names=['dataset-1', 's3://bucket/cohort.vcf.gz', 'ü']),
+    get_response(variants=[], variant_chunks=[
+        {'location': 's3://bucket/variants/0.tsv', 'first_byte': 0, 'last_byte': 2 ** 33, 'count': 12},
+        {'location': 's3://bucket/cohort.vcf.gz', 'first_byte': 10, 'last_byte': 20, 'count': 1},
+    ]),
+], ids=repr)
+def test_round_trip(response):
+    assert_round_trip(response)
+
+
+def test_columns_are_little_endian_uint32():
+    data = get_response().dumpb()
+    header = COMPACT_HEADER.unpack_from(data)
+    n_strings = header[7]
+    offsets = struct.unpack_from(f'<{n_strings + 1}I', data, COMPACT_HEADER.size)
+    assert offsets[0] == 0
+    assert len(data) == (
+        COMPACT_HEADER.size
+        + 4 * (n_strings + 1)
+        + 4 * 5 * 3
+        + 4 * 3
+        + 4 * 3
+        + offsets[-1]
+    )
+
+
+def test_rejects_other_data():
+    with pytest.raises(ValueError):
+        load_compact_response(b'\0' * COMPACT_HEADER.size)
@@ -0,0 +1,42 @@
+import numpy as np
+
+from vcfutils.genotypes import (
+    ABSENT, MISSING, decode_genotypes, count_calls, count_alleles, called_alleles, carrier_indices, count_record
+)
+
+
+GENOTYPES = '0|1,1/1,./.,2,10|0,\n'
+
+
+def test_decode_genotypes():
+    assert decode_genotypes(GENOTYPES).tolist() == [
+        [0, 1],
+        [1, 1],
+        [MISSING, MISSING],
+        [2, ABSENT],
+        [10, 0],
+    ]
+    assert decode_genotypes('').shape == (0, 0)
+
+
+def test_counts():
+    matrix = decode_genotypes(GENOTYPES)
+    assert count_calls(matrix, [1]) == 3
+    assert count_calls(matrix, [1, 2]) == 4
+    assert count_alleles(matrix) == 7
+    assert called_alleles(matrix, [1, 3, 10]) == [1, 10]
+    assert carrier_indices(matrix, [1, 2]) == [0, 1, 3]
+
+
+def test_count_record_uses_info():
+    assert count_record('AC=5,1;AN=20;VT=SNP', GENOTYPES, [0, 1])[:4] == ('SNP', [0, 1], 6, 20)
+    variant_type, called_indexes, calls, alleles, matrix = count_record('AC=0,1;AN=20', GENOTYPES, [0])
+    assert (variant_type, called_indexes, calls, alleles, matrix) == ('N/A', [], 0, 20, None)
+
+
+def test_count_record_from_genotypes():
+    # a sample selection, or a record without AC and AN
+    for info_str, use_info in (('AC=5,1;AN=20', False), ('DP=10', True)):
+        variant_type, called_indexes, calls, alleles, matrix = count_record(info_str, GENOTYPES, [0, 1], use_info)
+        assert (called_indexes, calls, alleles) == ([0, 1], 4, 7)
+        assert isinstance(matrix, np.ndarray)
@@ -0,0 +1,290 @@
+import gzip
+import io
+import random
+import struct
+import zlib
+
+import pytest
+
+from vcfutils.region_reader import (
+    STOP_CHECK_INTERVAL, bin_end, bin_start, chunk_byte_range, get_min_offset, get_region_chunks,
+    get_sample_names, parse_index, query_region, read_chunk, reg2bins
+)
+
+
+LOCATION = 's3://bucket/test.vcf.gz'
+HEADER = (
+    '##fileformat=VCFv4.2\n'
+    '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS2\n'
+)
+# uncompressed bytes per block, small so chunks span blocks and records
+# are split between them
+BLOCK_TEXT = 700
+
+
+def bgzf_block(payload):
+    deflate = zlib.compressobj(6, zlib.DEFLATED, -15)
+    data = deflate.compress(payload) + deflate.flush()
+    return (
+        b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+        + struct.pack('<H', len(data) + 25)
+        + data
+        + struct.pack('<II', zlib.crc32(payload), len(payload))
+    )
+
+
+def reg2bin(beg, end, min_shift, depth):
+    # smallest bin holding [beg, end), as in htslib
+    end -= 1
+    shift = min_shift
+    first_bin = ((1 << (depth * 3)) - 1) // 7
+    level = depth
+    while level > 0:
+        if beg >> shift == end >> shift:
+            return first_bin + (beg >> shift)
+        level -= 1
+        shift += 3
+        first_bin -= 1 << (level * 3)
+    return 0
+
+
+def make_records():
+    random.seed(7)
+    records = []
+    pos = 1
+    for _ in range(400):
+        pos += random.randint(1, 900)
+        ref = random.choice('ACGT')
+        records.append(('chr1', pos, ref, random.choice('ACGT')))
+    # a deletion across a 16kb leaf bin boundary, it overlaps regions
+    # that start after its position
+    records.append(('chr1', pos + 16384 - pos % 16384 - 20, 'A' * 60, 'A'))
+    records.append(('chr1', pos + 16384 - pos % 16384 + 100, 'C', 'G'))
+    records.sort(key=lambda record: record[1])
+    pos = 0
+    for _ in range(3000):
+        pos += random.randint(1, 5)
+        records.append(('chr2', pos, 'G', 'T'))
+    return records
+
+
+class VcfFile:
+    '''
+    BGZF compressed VCF and its csi and tbi indexes, built in memory
+    '''
+    def __init__(self, records):
+        self.records = records
+        text = HEADER.encode()
+        spans = []
+        for chrom, pos, ref, alt in records:
+            line = f'{chrom}\t{pos}\t.\t{ref}\t{alt}\t.\t.\tAC=1\tGT\t0|1\t1|1\n'.encode()
+            spans.append((len(text), len(text) + len(line)))
+            text += line
+
+        blocks = [bgzf_block(text[n:n + BLOCK_TEXT]) for n in range(0, len(text), BLOCK_TEXT)]
+        self.block_offsets = [0]
+        for block in blocks:
+            self.block_offsets.append(self.block_offsets[-1] + len(block))
+        self.data = b''.join(blocks) + bgzf_block(b'')
+        self.virtual_spans = [(self.virtual(beg), self.virtual(end)) for beg, end in spans]
+        self.fetches = []
+
+    def virtual(self, offset):
+        return (self.block_offsets[offset // BLOCK_TEXT] << 16) | offset % BLOCK_TEXT
+
+    def fetch(self, location, first_byte=None, last_byte=None):
+        assert location == LOCATION
+        self.fetches.append((first_byte, last_byte))
+        return self.data[first_byte or 0:None if last_byte is None else last_byte + 1]
+
+    def names(self):
+        return list(dict.fromkeys(chrom for chrom, *_ in self.records))
+
+    def ref_bins(self, chrom, min_shift, depth):
+        bins = {}
+        for (rec_chrom, pos, ref, _), (beg, end) in zip(self.records, self.virtual_spans):
+            if rec_chrom != chrom:
+                continue
+            chunks = bins.setdefault(reg2bin(pos - 1, pos - 1 + len(ref), min_shift, depth), [])
+            if chunks and chunks[-1][1] == beg:
+                chunks[-1] = (chunks[-1][0], end)
+            else:
+                chunks.append((beg, end))
+        return bins
+
+    def first_offset(self, chrom, beg):
+        # offset of the first record ending after beg
+        return min(
+            (virtual[0] for (rec_chrom, pos, ref, _), virtual in zip(self.records, self.virtual_spans)
+             if rec_chrom == chrom and pos - 1 + len(ref) > beg),
+            default=0
+        )
+
+    def aux(self):
+        names = b''.join(name.encode() + b'\0' for name in self.names())
+        return struct.pack('<7i', 2, 1, 2, 0, ord('#'), 0, len(names)) + names
+
+    def csi(self, min_shift=14, depth=5):
+        out = b'CSI\x01' + struct.pack('<3i', min_shift, depth, len(self.aux())) + self.aux()
+        out += struct.pack('<i', len(self.names()))
+        for chrom in self.names():
+            bins = self.ref_bins(chrom, min_shift, depth)
+            out += struct.pack('<i', len(bins))
+            for bin_no, chunks in sorted(bins.items()):
+                loffset = self.first_offset(chrom, bin_start(bin_no, min_shift, depth))
+                out += struct.pack('<IQi', bin_no, loffset, len(chunks))
+                out += b''.join(struct.pack('<QQ', *chunk) for chunk in chunks)
+        return parse_index('.csi', io.BytesIO(gzip.compress(out)))
+
+    def tbi(self):
+        out = b'TBI\x01' + struct.pack('<i', len(self.names())) + self.aux()
+        for chrom in self.names():
+            bins = self.ref_bins(chrom, 14, 5)
+            out += struct.pack('<i', len(bins))
+            for bin_no, chunks in sorted(bins.items()):
+                out += struct.pack('<Ii', bin_no, len(chunks))
+                out += b''.join(struct.pack('<QQ', *chunk) for chunk in chunks)
+            last = max(pos - 1 + len(ref) for rec_chrom, pos, ref, _ in self.records if rec_chrom == chrom)
+            intvs = [self.first_offset(chrom, window << 14) for window in range((last >> 14) + 1)]
+            out += struct.pack(f'<i{len(intvs)}Q', len(intvs), *intvs)
+        return parse_index('.tbi', io.BytesIO(gzip.compress(out)))
+
+    def overlapping(self, region):
+        chrom, span = region.rsplit(':', 1)
+        start, end = map(int, span.split('-'))
+        return [
+            (pos, ref, alt)
+            for rec_chrom, pos, ref, alt in self.records
+            if rec_chrom == chrom and pos <= end and pos + len(ref) - 1 >= start
+        ]
+
+
+@pytest.fixture(scope='module')
+def vcf():
+    return VcfFile(make_records())
+
+
+@pytest.fixture(scope='module', params=['csi', 'csi-12-6', 'tbi'])
+def index(request, vcf):
+    if request.param == 'tbi':
+        return vcf.tbi()
+    if request.param == 'csi':
+        return vcf.csi()
+    return vcf.csi(12, 6)
+
+
+def regions(vcf):
+    random.seed(11)
+    chr1_end = max(pos for chrom, pos, *_ in vcf.records if chrom == 'chr1')
+    deletion = next(pos for chrom, pos, ref, _ in vcf.records if len(ref) > 1)
+    yield f'chr1:1-{chr1_end}'
+    yield f'chr1:{deletion + 30}-{deletion + 40}'
+    yield 'chr2:100-200'
+    yield 'chr3:1-1000'
+    for _ in range(30):
+        start = random.randint(1, chr1_end)
+        yield f'chr1:{start}-{start + random.randint(0, 40000)}'
+
+
+@pytest.mark.parametrize('min_shift,depth', [(14, 5), (12, 6)])
+def test_reg2bins_are_the_bins_overlapping(min_shift, depth):
+    random.seed(3)
+    bin_count = ((1 << ((depth + 1) * 3)) - 1) // 7
+    for _ in range(5):
+        beg = random.randint(0, 1 << (min_shift + 8))
+        end = beg + random.randint(1, 1 << (min_shift + 2))
+        assert sorted(reg2bins(beg, end, min_shift, depth)) == [
+            bin_no for bin_no in range(bin_count)
+            if bin_start(bin_no, min_shift, depth) < end and bin_end(bin_no, min_shift, depth) > beg
+        ]
+
+
+def test_bin_start():
+    assert bin_start(0, 14, 5) == 0
+    assert bin_start(2, 14, 5) == 1 << 26
+    assert bin_start(4681, 14, 5) == 0
+    assert bin_start(4682, 14, 5) == 1 << 14
+    assert bin_end(4682, 14, 5) == 2 << 14
+
+
+def test_min_offset_is_before_overlapping_records(vcf, index):
+    chr1_end = max(pos + len(ref) - 1 for chrom, pos, ref, _ in vcf.records if chrom == 'chr1')
+    for beg in range(0, chr1_end, 997):
+        assert get_min_offset(index, 0, beg) <= vcf.first_offset('chr1', beg)
+
+
+def test_region_chunks_are_merged(vcf, index):
+    for region in regions(vcf):
+        chrom, span = region.rsplit(':', 1)
+        start, end = map(int, span.split('-'))
+        chunks = get_region_chunks(index, chrom, start, end)
+        for (_, previous_end), (chunk_beg, _) in zip(chunks, chunks[1:]):
+            # chunks sharing a block are read once
+            assert previous_end >> 16 < chunk_beg >> 16
+
+
+def test_chunk_byte_range():
+    assert chunk_byte_range(100 << 16 | 5, 300 << 16) == (100, 299)
+    assert chunk_byte_range(100 << 16, 300 << 16 | 1) == (100, 300 + 65535)
+
+
+def test_read_chunk_slices_virtual_offsets(vcf):
+    for first, last in [(0, 0), (3, 40), (100, 101), (0, len(vcf.records) - 1)]:
+        chunk_beg, chunk_end = vcf.virtual_spans[first][0], vcf.virtual_spans[last][1]
+        text = read_chunk(LOCATION, chunk_beg, chunk_end, vcf.fetch).decode()
+        assert [line.split('\t')[1] for line in text.splitlines()] == [
+            str(pos) for _, pos, *_ in vcf.records[first:last + 1]
+        ]
+
+
+def test_query_region_matches_overlapping_records(vcf, index):
+    for region in regions(vcf):
+        records = list(query_region(LOCATION, region, index=index, fetch=vcf.fetch))
+        assert [record[:3] for record in records] == vcf.overlapping(region)
+        assert all(record[3:] == ('AC=1', '0|1,1|1') for record in records)
+
+
+def test_query_region_selects_samples_and_matches(vcf, index):
+    region = 'chr2:1-400'
+    records = list(query_region(
+        LOCATION, region, index=index, sample_columns=[1],
+        match=lambda pos, ref, alt: ([alt], [0] if pos % 2 else []), fetch=vcf.fetch
+    ))
+    assert [record[0] for record in records] == [pos for pos, *_ in vcf.overlapping(region) if pos % 2]
+    assert all(record[4:] == ('1|1', (['T'], [0])) for record in records)
+
+
+def test_stop_before_reading(vcf, index):
+    vcf.fetches.clear()
+    assert list(query_region(LOCATION, 'chr2:1-20000', index=index, stop=lambda: True, fetch=vcf.fetch)) == []
+    assert vcf.fetches == []
+
+
+def stop_on_second_call():
+    calls = []
+
+    def stop():
+        calls.append(1)
+        return len(calls) > 1
+    return calls, stop
+
+
+def test_stop_while_scanning(vcf, index):
+    region = 'chr2:1-20000'
+    calls, stop = stop_on_second_call()
+    records = list(query_region(LOCATION, region, index=index, stop=stop, fetch=vcf.fetch))
+    assert len(calls) == 2
+    assert 0 < len(records) < STOP_CHECK_INTERVAL < len(vcf.overlapping(region))
+
+
+def test_stop_checked_on_excluded_lines(vcf, index):
+    calls, stop = stop_on_second_call()
+    records = list(query_region(
+        LOCATION, 'chr2:1-20000', index=index, include=lambda pos, ref, alt: False, stop=stop, fetch=vcf.fetch
+    ))
+    assert records == []
+    assert len(calls) == 2
+
+
+def test_sample_names(vcf):
+    assert get_sample_names(LOCATION, vcf.fetch) == ['S1', 'S2']